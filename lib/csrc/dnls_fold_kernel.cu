@@ -135,7 +135,7 @@ __global__ void dnls_fold_forward_kernel(
             }
           } // for patch size
         } // for patch size
-        vid[t_im][ci][h_im][w_im] = val;
+        vid[t_im][ci][h_im][w_im] += val;
       } // for colors
     } // for each pixel (with stride)
 }
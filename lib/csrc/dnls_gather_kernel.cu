@@ -209,8 +209,8 @@ __global__ void dnls_gather_forward_kernel(
     // Assign first lane to image value
     if (lane==0){
       for (int ci = 0; ci < colors; ci++){
-        vid[t0][ci][h0][w0] = pix[ci];
-        wvid[t0][ci][h0][w0] = wpix[ci];
+        vid[t0][ci][h0][w0] += pix[ci];
+        wvid[t0][ci][h0][w0] += wpix[ci];
       }
     }
   }
@@ -432,8 +432,8 @@ __global__ void dnls_gather_forward_kernel_dist(
     // Assign first lane to image value
     if (lane==0){
       for (int ci = 0; ci < colors; ci++){
-        vid[t0][ci][h0][w0] = pix[ci];
-        wvid[t0][ci][h0][w0] = wpix[ci];
+        vid[t0][ci][h0][w0] += pix[ci];
+        wvid[t0][ci][h0][w0] += wpix[ci];
       }
     }
   }
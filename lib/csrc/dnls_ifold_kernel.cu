@@ -112,6 +112,14 @@ __global__ void dnls_ifold_forward_kernel(
       for(int ci = 0; ci < colors; ci++){
         scalar_t val = 0;
         for (int pk = 0; pk < pt; pk++){
+        for (int tr = 0; tr < 2; tr++){
+
+          // -- the query frame whose (reflected) frame "pk" is "t_im" --
+          int ti = (tr == 0) ? t_im - pk : 2*(nframes-1) - t_im - pk;
+          bool valid_t = (tr == 0) || (ti + pk >= nframes);
+          valid_t = valid_t && (ti >= 0) && (ti < nframes);
+          if (!valid_t){ continue; }
+
           for (int pi = 0; pi < ps; pi++){
             for (int pj = 0; pj < ps; pj++){
 
@@ -119,7 +127,6 @@ __global__ void dnls_ifold_forward_kernel(
               // use "psOffset" instead of "psHalf" because of reflection.
               int _wi = w_im + dilation*(pi - psOffset - adj);
               int _hi = h_im + dilation*(pj - psOffset - adj);
-              int ti = t_im + pk;
 
               // -- check bounds (we need the patch for the pixel!) --
               valid = (_wi >= left) && (_wi < right_bnd);
@@ -162,13 +169,14 @@ __global__ void dnls_ifold_forward_kernel(
               // -- accumulate --
               valid_q = valid && (qi >= 0) && (qi < numQueries);
               if (valid_q){
-                val += patches[qi][0][0][ci][h_ip][w_ip];
+                val += patches[qi][0][pk][ci][h_ip][w_ip];
               }
 
             }
           } // for patch size
+        } // for query frames
         } // for patch size
-        vid[t_im][ci][h_im][w_im] = val;
+        vid[t_im][ci][h_im][w_im] += val;
       } // for colors
     } // for each pixel (with stride)
 }
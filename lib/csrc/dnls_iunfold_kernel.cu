@@ -273,6 +273,14 @@ __global__ void dnls_iunfold_backward_kernel(
         // nhits_q = 0;
         scalar_t val = 0;
         for (int pk = 0; pk < pt; pk++){
+        for (int tr = 0; tr < 2; tr++){
+
+          // -- the query frame whose (reflected) frame "pk" is "t_im" --
+          int ti = (tr == 0) ? t_im - pk : 2*(nframes-1) - t_im - pk;
+          bool valid_t = (tr == 0) || (ti + pk >= nframes);
+          valid_t = valid_t && (ti >= 0) && (ti < nframes);
+          if (!valid_t){ continue; }
+
           for (int pi = 0; pi < ps; pi++){
             for (int pj = 0; pj < ps; pj++){
 
@@ -281,7 +289,6 @@ __global__ void dnls_iunfold_backward_kernel(
               int _hi = h_im + dilation*(pj - psOffset - adj);
               // int _wi = w_im + dilation*(pi - psHalf);
               // int _hi = h_im + dilation*(pj - psHalf);
-              int ti = t_im + pk;
 
               // -- check bounds --
               valid = (_wi >= left) && (_wi < (right_bnd));
@@ -338,7 +345,7 @@ __global__ void dnls_iunfold_backward_kernel(
               // -- accumulate --
               valid_q = valid && (qi >= 0) && (qi < numQueries);
               if (valid_q){
-                val += patches[qi][0][0][ci][h_ip][w_ip];
+                val += patches[qi][0][pk][ci][h_ip][w_ip];
                 // nhits_q += 1;
               }
               // if(valid){
@@ -346,6 +353,7 @@ __global__ void dnls_iunfold_backward_kernel(
               // }
             }
           } // for patch size
+        } // for query frames
         } // for patch size
         // bool eq_hits = nhits == nhits_q;
         // bool hit_req = true;//((not is_edge) && (nhits == ndim)) || is_edge;
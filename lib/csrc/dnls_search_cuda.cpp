@@ -6,13 +6,13 @@
 
 void dnls_cuda_search_forward(
     torch::Tensor vid0, torch::Tensor vid1,
-    torch::Tensor qinds, torch::Tensor fflow, torch::Tensor bflow,
+    torch::Tensor qinds,
     torch::Tensor dists, torch::Tensor inds,
     int h0_off, int w0_off, int h1_off, int w1_off,
     int ps, int pt, int ws_h, int ws_w, int wt, int chnls,
     int dilation, int stride, bool use_adj,
     bool reflect_bounds, bool search_abs,
-    torch::Tensor bufs, torch::Tensor tranges,
+    torch::Tensor traj, torch::Tensor tranges,
     torch::Tensor n_tranges, torch::Tensor min_tranges);
 
 
@@ -32,29 +32,27 @@ void dnls_cuda_search_backward(
 
 void dnls_search_forward(
     torch::Tensor vid0, torch::Tensor vid1,
-    torch::Tensor qinds,torch::Tensor fflow,torch::Tensor bflow,
+    torch::Tensor qinds,
     torch::Tensor dists,torch::Tensor inds,
     int h0_off, int w0_off, int h1_off, int w1_off,
     int ps, int pt, int ws_h, int ws_w, int wt,
     int chnls, int dilation, int stride,
     bool use_adj, bool reflect_bounds, bool search_abs,
-    torch::Tensor bufs,torch::Tensor tranges,
+    torch::Tensor traj,torch::Tensor tranges,
     torch::Tensor n_tranges,torch::Tensor min_tranges){
   CHECK_INPUT(vid0);
   CHECK_INPUT(vid1);
   CHECK_INPUT(qinds);
-  CHECK_INPUT(fflow);
-  CHECK_INPUT(bflow);
   CHECK_INPUT(dists);
   CHECK_INPUT(inds);
-  CHECK_INPUT(bufs);
+  CHECK_INPUT(traj);
   CHECK_INPUT(tranges);
   CHECK_INPUT(n_tranges);
   CHECK_INPUT(min_tranges);
-  dnls_cuda_search_forward(vid0,vid1,qinds,fflow,bflow,dists,inds,
+  dnls_cuda_search_forward(vid0,vid1,qinds,dists,inds,
                            h0_off,w0_off,h1_off,w1_off,
                            ps,pt,ws_h,ws_w,wt,chnls,dilation,stride,
-                           use_adj,reflect_bounds,search_abs,bufs,tranges,
+                           use_adj,reflect_bounds,search_abs,traj,tranges,
                            n_tranges,min_tranges);
 }
 
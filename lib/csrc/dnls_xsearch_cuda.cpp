@@ -6,13 +6,12 @@
 
 void dnls_cuda_xsearch_forward(
     torch::Tensor vid0,torch::Tensor vid1,torch::Tensor queryInds,
-    torch::Tensor fflow,torch::Tensor bflow,
     torch::Tensor nlDists,torch::Tensor nlInds,
     int ps, int pt, int ws_h, int ws_w, int wt,
     int chnls, int stride, int dilation,
     bool use_search_abs, bool use_bounds, bool use_adj,
     int oh0, int ow0, int oh1, int ow1,
-    torch::Tensor bufs,torch::Tensor tranges,
+    torch::Tensor traj,torch::Tensor tranges,
     torch::Tensor n_tranges,torch::Tensor min_tranges);
 
 
@@ -31,30 +30,27 @@ void dnls_cuda_xsearch_backward(
 
 void dnls_xsearch_forward(
     torch::Tensor vid0,torch::Tensor vid1,torch::Tensor queryInds,
-    torch::Tensor fflow,torch::Tensor bflow,
     torch::Tensor nlDists,torch::Tensor nlInds,
     int ps, int pt, int ws_h, int ws_w, int wt,
     int chnls, int stride, int dilation,
     bool use_search_abs, bool use_bounds, bool use_adj,
     int oh0, int ow0, int oh1, int ow1,
-    torch::Tensor bufs,torch::Tensor tranges,
+    torch::Tensor traj,torch::Tensor tranges,
     torch::Tensor n_tranges,torch::Tensor min_tranges){
   CHECK_INPUT(vid0);
   CHECK_INPUT(vid1);
   CHECK_INPUT(queryInds);
-  CHECK_INPUT(fflow);
-  CHECK_INPUT(bflow);
   CHECK_INPUT(nlDists);
   CHECK_INPUT(nlInds);
-  CHECK_INPUT(bufs);
+  CHECK_INPUT(traj);
   CHECK_INPUT(tranges);
   CHECK_INPUT(n_tranges);
   CHECK_INPUT(min_tranges);
-  dnls_cuda_xsearch_forward(vid0,vid1,queryInds,fflow,bflow,nlDists,nlInds,
+  dnls_cuda_xsearch_forward(vid0,vid1,queryInds,nlDists,nlInds,
                             ps,pt,ws_h,ws_w,wt,chnls,stride,dilation,
                             use_search_abs, use_bounds, use_adj,
                             oh0, ow0, oh1, ow1,
-                            bufs,tranges,n_tranges,min_tranges);
+                            traj,tranges,n_tranges,min_tranges);
 }
 
 void dnls_xsearch_backward(
@@ -36,14 +36,12 @@ __global__ void dnls_xsearch_forward_kernel(
     torch::PackedTensorAccessor32<scalar_t,4,torch::RestrictPtrTraits> vid0,
     torch::PackedTensorAccessor32<scalar_t,4,torch::RestrictPtrTraits> vid1,
     torch::PackedTensorAccessor32<int,2,torch::RestrictPtrTraits> queryInds,
-    torch::PackedTensorAccessor32<scalar_t,4,torch::RestrictPtrTraits> fflow,
-    torch::PackedTensorAccessor32<scalar_t,4,torch::RestrictPtrTraits> bflow,
     torch::PackedTensorAccessor32<scalar_t,4,torch::RestrictPtrTraits> nlDists,
     torch::PackedTensorAccessor32<int,5,torch::RestrictPtrTraits> nlInds,
     int ps, int pt, int ws_h, int ws_w, int wt, int chnls, int stride, int dilation, 
     bool use_search_abs, bool use_bounds, bool use_adj,
     int h0_off, int w0_off, int h1_off, int w1_off,
-    torch::PackedTensorAccessor32<int,5,torch::RestrictPtrTraits> bufs,
+    torch::PackedTensorAccessor32<int,3,torch::RestrictPtrTraits> traj,
     torch::PackedTensorAccessor32<int,2,torch::RestrictPtrTraits> tranges,
     torch::PackedTensorAccessor32<int,1,torch::RestrictPtrTraits> n_tranges,
     torch::PackedTensorAccessor32<int,1,torch::RestrictPtrTraits> min_tranges,
@@ -87,9 +85,7 @@ __global__ void dnls_xsearch_forward_kernel(
   bool valid_n_ti,valid_n_hi,valid_n_wi,valid_n;
   bool eq_ti,eq_hi,eq_wi,eq_dim;
 
-  float cw0,ch0,ct0,cw_f,ch_f;
-  int l_cw0,l_ch0,l_ct0;
-  int cw_i,ch_i,ch,cw,ct;
+  int ch,cw;
   float v_pix,n_pix;
   double _dist,dist;
 
@@ -131,55 +127,12 @@ __global__ void dnls_xsearch_forward_kernel(
 
         for( int wt_k = 0; wt_k < n_tranges[ti]; wt_k++){
           int n_ti = tranges[ti][wt_k];
-          int dt = n_ti - min_tranges[ti];
-
-          // ------------------------
-          //      init direction
-          // ------------------------
-          int direction = max(-1,min(1,n_ti - ti));
-          if (direction != 0){
-
-            // -- get offset at index --
-            int dtd = int(dt-direction);
-            cw0 = 1.*bufs[bidx][0][dtd][ws_i][ws_j];
-            ch0 = 1.*bufs[bidx][1][dtd][ws_i][ws_j];
-            ct0 = 1.*bufs[bidx][2][dtd][ws_i][ws_j];
-
-            // -- legalize access --
-            l_cw0 = int(max(0,min(w-1,int(cw0))));
-            l_ch0 = int(max(0,min(h-1,int(ch0))));
-            l_ct0 = int(max(0,min(nframes-1,int(ct0))));
-
-            // -- access flows --
-            if (direction > 0 ){
-              cw_f = cw0 + fflow[l_ct0][0][l_ch0][l_cw0];
-              ch_f = ch0 + fflow[l_ct0][1][l_ch0][l_cw0];
-            }else{
-              cw_f = cw0 + bflow[l_ct0][0][l_ch0][l_cw0];
-              ch_f = ch0 + bflow[l_ct0][1][l_ch0][l_cw0];
-            }
-            cw_i = int(cw_f+0.5);
-            ch_i = int(ch_f+0.5);
-
-            // -- rounding --
-            cw = max(0,min(width-1,cw_i));
-            ch = max(0,min(height-1,ch_i));
-            ct = n_ti;
-
-          }else{
-            cw = wi;
-            ch = hi;
-            ct = ti;
-          }
 
-          // ----------------
-          //     update
-          // ----------------
-          if (wt > 0){
-            bufs[bidx][0][dt][ws_i][ws_j] = cw;
-            bufs[bidx][1][dt][ws_i][ws_j] = ch;
-            bufs[bidx][2][dt][ws_i][ws_j] = ct;
-          }
+          // ------------------------------
+          //   flow-chained search center
+          // ------------------------------
+          ch = traj[bidx][wt_k][0];
+          cw = traj[bidx][wt_k][1];
 
           // --------------------
           //      init dists
@@ -291,11 +244,11 @@ __global__ void dnls_xsearch_forward_kernel(
 
 void dnls_cuda_xsearch_forward(
     torch::Tensor vid0, torch::Tensor vid1, torch::Tensor queryInds,
-    torch::Tensor fflow, torch::Tensor bflow, torch::Tensor nlDists, torch::Tensor nlInds,
+    torch::Tensor nlDists, torch::Tensor nlInds,
     int ps, int pt, int ws_h, int ws_w, int wt, int chnls, int stride, int dilation,
     bool use_search_abs, bool use_bounds, bool use_adj,
     int h0_off, int w0_off, int h1_off, int w1_off,
-    torch::Tensor bufs, torch::Tensor tranges, torch::Tensor n_tranges,
+    torch::Tensor traj, torch::Tensor tranges, torch::Tensor n_tranges,
     torch::Tensor min_tranges){
 
     // # -- launch params --
@@ -326,13 +279,11 @@ void dnls_cuda_xsearch_forward(
          vid0.packed_accessor32<scalar_t,4,torch::RestrictPtrTraits>(),
          vid1.packed_accessor32<scalar_t,4,torch::RestrictPtrTraits>(),
          queryInds.packed_accessor32<int,2,torch::RestrictPtrTraits>(),
-         fflow.packed_accessor32<scalar_t,4,torch::RestrictPtrTraits>(),
-         bflow.packed_accessor32<scalar_t,4,torch::RestrictPtrTraits>(),
          nlDists.packed_accessor32<scalar_t,4,torch::RestrictPtrTraits>(),
          nlInds.packed_accessor32<int,5,torch::RestrictPtrTraits>(),
          ps, pt, ws_h, ws_w, wt, chnls, stride, dilation, 
          use_search_abs, use_bounds, use_adj, h0_off, w0_off, h1_off, w1_off,
-         bufs.packed_accessor32<int,5,torch::RestrictPtrTraits>(),
+         traj.packed_accessor32<int,3,torch::RestrictPtrTraits>(),
          tranges.packed_accessor32<int,2,torch::RestrictPtrTraits>(),
          n_tranges.packed_accessor32<int,1,torch::RestrictPtrTraits>(),
          min_tranges.packed_accessor32<int,1,torch::RestrictPtrTraits>(),
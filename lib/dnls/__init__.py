@@ -1,12 +1,31 @@
-from . import scatter
-from . import gather
-from . import search
-from . import testing
-from . import utils
-from . import simple
-from . import fold
-from . import unfold
-from . import ifold
-from . import iunfold
-from . import xsearch
-from . import wpsum
+"""
+
+Submodules are imported on first access (PEP 562), so "import dnls"
+only pays for the ops that are used; "dnls.testing" and "dnls.simple"
+(numba.cuda, PIL, ...) cost nothing unless touched.
+
+"""
+
+# -- python --
+import importlib
+
+# -- submodules; imported on first access --
+SUBMODULES = ["scatter","gather","search","testing","utils","simple",
+              "fold","unfold","ifold","iunfold","xsearch","wpsum",
+              "cpu","box","patchmatch","pyramid","backend","jit",
+              "pipeline","memory","workspace"]
+
+# -- attributes of submodules --
+ATTRIBUTES = {"warmup":"jit"}
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module("." + name,__name__)
+    if name in ATTRIBUTES:
+        module = importlib.import_module("." + ATTRIBUTES[name],__name__)
+        return getattr(module,name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals().keys()) + SUBMODULES + list(ATTRIBUTES))
@@ -0,0 +1,120 @@
+"""
+
+Backend dispatch for the dnls ops
+
+Each op ("search_forward", "scatter_backward", ...) is resolved to an
+implementation from the device of its tensors. CUDA ops are read from
+the "dnls_cuda" extension, which is only imported on first use so the
+package imports on hosts without it. Other devices use the engines
+registered below (or with "register").
+
+"""
+
+# -- python --
+import importlib
+
+# -- linalg --
+import torch as th
+
+# -- engines of each (op,device type); a callable or a "module" path --
+ENGINES = {}
+
+# -- the cuda extension; loaded on first use --
+_CUDA_EXT = None
+
+
+def register(op,device_type,impl):
+    """
+    Registers "impl" for "op" on "device_type" (e.g. "cpu").
+
+    impl = a callable, or the path of a module defining "op"
+    which is only imported when the op is first used.
+    """
+    ENGINES[(op,device_type)] = impl
+
+def get(op,device):
+    """
+    The implementation of "op" for tensors on "device"
+    """
+    impl = lookup(op,device)
+    if impl is None:
+        device_type = th.device(device).type
+        raise NotImplementedError(f"No {device_type} engine for [{op}]")
+    return impl
+
+def has(op,device):
+    return not(lookup(op,device) is None)
+
+def lookup(op,device):
+    """
+    The implementation of "op" for tensors on "device" or None
+    """
+
+    # -- registered engine --
+    device_type = th.device(device).type
+    impl = ENGINES.get((op,device_type),None)
+    if isinstance(impl,str):
+        impl = getattr(importlib.import_module(impl),op)
+        ENGINES[(op,device_type)] = impl
+    if not(impl is None): return impl
+
+    # -- cuda extension --
+    if device_type == "cuda":
+        return getattr(cuda_ext(),op,None)
+    return None
+
+def cuda_ext():
+    """
+    The "dnls_cuda" extension; imported once, on first use
+    """
+    global _CUDA_EXT
+    if _CUDA_EXT is None:
+        try:
+            _CUDA_EXT = importlib.import_module("dnls_cuda")
+        except ImportError as err:
+            msg = "The dnls_cuda extension is not available; "
+            msg += "install it with \"python -m pip install -e ./lib\" "
+            msg += "on a host with CUDA or use tensors on the cpu."
+            raise ImportError(msg) from err
+    return _CUDA_EXT
+
+def concurrent_cpu():
+    """
+    True when the cpu engines may run on several threads at once; their
+    numba "parallel" kernels abort the process on concurrent launches
+    under the "workqueue" threading layer (numba's fallback without
+    TBB or OpenMP).
+    """
+    from dnls.cpu.search import threading_layer
+    return threading_layer() != "workqueue"
+
+def cuda_available():
+    """
+    True when the extension imports and a cuda device is visible
+    """
+    if not(th.cuda.is_available()): return False
+    try:
+        cuda_ext()
+    except ImportError:
+        return False
+    return True
+
+# -- cpu engines --
+for _op in ["search_forward","search_topk","search_backward"]:
+    register(_op,"cpu","dnls.cpu.search")
+for _op in ["xsearch_forward","xsearch_topk","xsearch_backward"]:
+    register(_op,"cpu","dnls.cpu.xsearch")
+for _op in ["scatter_forward","scatter_backward","scatter_backward_eff"]:
+    register(_op,"cpu","dnls.cpu.scatter")
+for _op in ["gather_forward","gather_forward_race","gather_backward"]:
+    register(_op,"cpu","dnls.cpu.gather")
+for _op in ["ifold_forward","ifold_backward"]:
+    register(_op,"cpu","dnls.cpu.ifold")
+for _op in ["iunfold_forward","iunfold_backward"]:
+    register(_op,"cpu","dnls.cpu.iunfold")
+for _op in ["fold_forward","fold_backward"]:
+    register(_op,"cpu","dnls.cpu.fold")
+for _op in ["unfold_forward","unfold_backward"]:
+    register(_op,"cpu","dnls.cpu.unfold")
+for _op in ["wpsum_forward","wpsum_backward_vid","wpsum_backward_dists"]:
+    register(_op,"cpu","dnls.cpu.wpsum")
@@ -0,0 +1,352 @@
+"""
+
+Box-filtered (integral image) engine for SearchNl
+
+With pt = 1, dilation = 1 and zero flow, every query of a frame is
+compared with the candidate at the same displacement (dh,dw). The patch
+distances of all queries for one displacement are a ps x ps box sum of
+the squared-difference image, computed with two cumulative sums, so the
+cost per candidate does not depend on "ps".
+
+Mirrors search_forward/search_topk of the CPU engine and runs on any
+device. Only the forward pass is implemented; the backward pass uses
+the engine of the video's device.
+
+"""
+
+# -- linalg --
+import torch as th
+import torch.nn.functional as nnf
+
+# -- local --
+from dnls.utils.inds import get_raster
+
+# -- max elements of a squared-difference block --
+BOX_NUMEL = 2**24
+
+
+def is_supported(vid0, queries, fflow, bflow, ps, pt, ws_h, ws_w, wt,
+                 dilation, stride, use_adj, reflect_bounds, search_abs,
+                 h0_off, w0_off, h1_off, w1_off, zero_flow=None):
+    """
+    True when the box-filtered search gives the same result as the kernel:
+    pt = 1, dilation = 1, zero flow (wt = 0, "zero_flow", or "None"
+    flows), a relative search window, and a dense raster of in-frame
+    queries (a stride-1 QueryRange, its tuple or its expanded indices,
+    whose frames' bounding boxes are at most twice the number of its
+    queries).
+
+    zero_flow = the caller's "is_zero_flow"; None only takes missing
+    flows as zero. Only the shapes and the raster's numbers are read,
+    so the check never waits on the device.
+    """
+
+    # -- search params --
+    if not(pt == 1 and dilation == 1) or search_abs: return False
+    if zero_flow is None: zero_flow = fflow is None and bflow is None
+    if wt > 0 and not(zero_flow): return False
+
+    # -- a raster of queries --
+    t,c,h,w = vid0.shape
+    queries = get_raster(queries,t)
+    if queries is None: return False
+    if queries.stride != 1 or queries.num <= 0: return False
+
+    # -- reflect padding must stay inside the frame --
+    pad0,pad1,_,_,_ = box_pads(ps,ws_h,ws_w,stride,use_adj,
+                               h0_off,w0_off,h1_off,w1_off)
+    if reflect_bounds:
+        if max(pad0[:2] + pad1[:2]) >= w: return False
+        if max(pad0[2:] + pad1[2:]) >= h: return False
+
+    # -- in-frame queries --
+    t_start,t_end,top,left,btm,right = queries.coords
+    n_h,n_w = queries.grid
+    t_last = t_start + (queries.start + queries.num - 1) // (n_h*n_w)
+    if min(n_h,n_w,queries.start,t_start,top,left) < 0: return False
+    if not(t_last < t and btm <= h and right <= w): return False
+
+    # -- dense queries --
+    if raster_area(queries) > 2*queries.num: return False
+
+    return True
+
+def search_forward(vid0, vid1, qinds, dists, inds,
+                   h0_off, w0_off, h1_off, w1_off,
+                   ps, pt, ws_h, ws_w, wt, chnls, dilation, stride,
+                   use_adj, reflect_bounds, search_abs,
+                   traj, tranges, n_tranges, min_tranges):
+    """
+    Fills "dists" and "inds" [NumQueries,2*wt+1,ws_h,ws_w(,3)] in-place.
+
+    Matches the CUDA signature; "traj" is unused (zero flow).
+    """
+    for qsel,wt_k,ws_i,n_ti,dists_r,n_hi,n_wi in box_rows(
+            vid0, vid1, qinds, ps, ws_h, ws_w, chnls, stride,
+            use_adj, reflect_bounds, h0_off, w0_off, h1_off, w1_off,
+            tranges, n_tranges):
+        dists[qsel,wt_k,ws_i] = dists_r
+        inds[qsel,wt_k,ws_i,:,0] = n_ti
+        inds[qsel,wt_k,ws_i,:,1] = n_hi[:,None].int()
+        inds[qsel,wt_k,ws_i,:,2] = n_wi.int()
+
+def search_topk(vid0, vid1, qinds, dists, inds,
+                h0_off, w0_off, h1_off, w1_off,
+                ps, pt, ws_h, ws_w, wt, chnls, dilation, stride,
+                use_adj, reflect_bounds, search_abs,
+                traj, tranges, n_tranges, min_tranges, early_stop=True):
+    """
+    Fills the top-k "dists" and "inds" [NumQueries,K(,3)] in-place,
+    merging each row of the search window into a running top-k.
+
+    "traj" and "early_stop" are unused; every box sum costs the same.
+    """
+
+    # -- init --
+    dists[...] = float("inf")
+    inds[...] = -1
+
+    for qsel,wt_k,ws_i,n_ti,dists_r,n_hi,n_wi in box_rows(
+            vid0, vid1, qinds, ps, ws_h, ws_w, chnls, stride,
+            use_adj, reflect_bounds, h0_off, w0_off, h1_off, w1_off,
+            tranges, n_tranges):
+
+        merge_topk(dists,inds,qsel,dists_r,n_ti,n_hi,n_wi)
+
+    # -- sort --
+    order = th.argsort(dists,1)
+    dists[...] = th.gather(dists,1,order)
+    inds[...] = th.gather(inds,1,order[...,None].expand(-1,-1,3))
+
+def merge_topk(dists,inds,qsel,dists_r,n_ti,n_hi,n_wi):
+    """
+    Merges one row of candidates into the running top-k of "qsel"
+    """
+
+    # -- merge dists --
+    k = dists.shape[1]
+    vals = th.cat([dists[qsel],dists_r],1)
+    order = th.topk(vals,k,dim=1,largest=False).indices
+    dists[qsel] = th.gather(vals,1,order)
+
+    # -- merge inds --
+    n_wi = n_wi.int()
+    cinds = th.stack([th.full_like(n_wi,n_ti),
+                      n_hi.int()[:,None].expand_as(n_wi),n_wi],-1)
+    all_inds = th.cat([inds[qsel],cinds],1)
+    order = order[...,None].expand(-1,-1,3)
+    inds[qsel] = th.gather(all_inds,1,order)
+
+def box_rows(vid0, vid1, qinds, ps, ws_h, ws_w, chnls, stride,
+             use_adj, reflect_bounds, h0_off, w0_off, h1_off, w1_off,
+             tranges, n_tranges):
+    """
+    Yields (qsel,wt_k,ws_i,n_ti,dists,n_hi,n_wi) for each row of the search
+    window; dists = n_wi = [len(qsel),ws_w], inf outside the frame.
+    """
+
+    # -- unpack --
+    t,c,h,w = vid0.shape
+    device = qinds.device
+    qinds = qinds.long()
+    wsHalf_h,wsHalf_w = (ws_h-1)//2,(ws_w-1)//2
+    pad0,pad1,padw,corner0,corner1 = box_pads(ps,ws_h,ws_w,stride,use_adj,
+                                              h0_off,w0_off,h1_off,w1_off)
+    ws_j = stride*(th.arange(ws_w,device=device) - wsHalf_w)
+    nopad = (0,0,0,0)
+
+    # -- top-left corner of the patch at (0,0) in the padded videos --
+    o0_h,o0_w = corner0
+    o1_h,o1_w = corner1
+
+    for qsel_f in frame_groups(qinds):
+
+        # -- bounding box of the frame's queries --
+        ti = int(qinds[qsel_f[0],0].item())
+        top = int(qinds[qsel_f,1].min().item())
+        btm = int(qinds[qsel_f,1].max().item())
+        left = int(qinds[qsel_f,2].min().item())
+        right = int(qinds[qsel_f,2].max().item())
+        box_w = right - left + 1
+        ext_w = box_w + ps - 1
+
+        # -- chunk the box by rows --
+        nrows = max(1,BOX_NUMEL // (chnls * ws_w * ext_w) - ps + 1)
+        for r_start in range(top,btm+1,nrows):
+            r_end = min(r_start+nrows,btm+1)
+            hi_f = qinds[qsel_f,1]
+            qsel = qsel_f[(hi_f >= r_start) & (hi_f < r_end)]
+            if len(qsel) == 0: continue
+            ext_h = r_end - r_start + ps - 1
+
+            # -- query locations inside the block --
+            hi,wi = qinds[qsel,1],qinds[qsel,2]
+            l_hi,l_wi = hi - r_start,wi - left
+            n_wi = wi[:,None] + ws_j
+            valid_w = (n_wi >= 0) & (n_wi < w)
+
+            # -- anchor block --
+            a_h,a_w = r_start + o0_h,left + o0_w
+            block0 = padded_block(vid0,ti,chnls,a_h,ext_h,a_w,ext_w,
+                                  pad0,nopad,reflect_bounds)
+
+            for wt_k in range(int(n_tranges[ti].item())):
+
+                # -- the candidates' rows of every row displacement --
+                n_ti = int(tranges[ti,wt_k].item())
+                b_h = r_start - stride*wsHalf_h + o1_h
+                b_w = left - stride*wsHalf_w + o1_w
+                blocks1 = padded_block(vid1,n_ti,chnls,
+                                       b_h,ext_h+stride*(ws_h-1),
+                                       b_w,ext_w+stride*(ws_w-1),
+                                       pad1,padw,reflect_bounds)
+                for ws_i in range(ws_h):
+
+                    # -- candidate blocks; one per column displacement --
+                    dh = stride*(ws_i - wsHalf_h)
+                    block1 = blocks1[:,stride*ws_i:stride*ws_i+ext_h]
+                    block1 = block1.unfold(2,ext_w,stride)
+
+                    # -- box-filtered squared difference --
+                    dists = box_dists(block0,block1,ps,l_hi,l_wi)
+
+                    # -- only candidates inside the frame --
+                    n_hi = hi + dh
+                    valid = valid_w & ((n_hi >= 0) & (n_hi < h))[:,None]
+                    dists = th.where(valid,dists,th.full_like(dists,float("inf")))
+                    yield qsel,wt_k,ws_i,n_ti,dists,n_hi,n_wi
+
+def workspace_bytes(nq, vshape, k, ps, ws_h, ws_w, stride, dtype=th.float32):
+    """
+    Peak bytes of the buffers "search_topk" allocates for a stride-1
+    raster of "nq" queries of frames "vshape" (of "dtype"), as read
+    from "box_rows": its largest block of rows, with either the float64
+    box sums of the block ("box_sum") or the merge of one row of the
+    search window into the running top-k ("merge_topk")
+    """
+
+    # -- bytes of each dtype --
+    isz = th.empty((),dtype=dtype).element_size()
+    f32,i32,i64,f64 = 4,4,8,8
+
+    # -- the largest block of rows of one frame's queries --
+    t,c,h,w = vshape
+    rows = min(h,(nq + 2*w - 2)//w)
+    box_w = w if rows > 1 else 1
+    ext_w = box_w + ps - 1
+    nrows = max(1,BOX_NUMEL // (c * ws_w * ext_w) - ps + 1)
+    ext_h = min(rows,nrows) + ps - 1
+    numel = ext_h * ws_w * ext_w
+    nsel = min(nq,min(rows,nrows) * box_w)
+
+    # -- int64 queries; the anchor & candidate blocks --
+    ext_h1,ext_w1 = ext_h + stride*(ws_h-1),ext_w + stride*(ws_w-1)
+    blocks = c*ext_h*ext_w * isz + c*ext_h1*ext_w1 * isz
+    base = nq*3 * i64 + blocks
+
+    # -- the block's queries: qsel, hi, wi, l_hi, l_wi, n_hi; n_wi and
+    # -- the (bool) valid_w & valid of each column displacement --
+    base += nsel * (6*i64 + ws_w*(i64 + 2))
+
+    # -- "box_dists"' squared differences, their float64 copy
+    # -- and the padded cumulative sums --
+    cast = 0 if isz == f64 else numel * f64
+    csums = numel * isz + cast + numel * f64 + (ext_h+1)*ws_w*ext_w * f64
+
+    # -- "merge_topk": a row's dists, the merged values & int64 order
+    # -- and the merged int32 inds --
+    merge = nsel * (ws_w * f32 + (k+ws_w) * f32 + k * i64)
+    merge += nsel * (i32 + 4*ws_w * i32 + 3*k * i32 + 3*(k+ws_w) * i32)
+    return base + max(csums,merge)
+
+def padded_block(vid,ti,chnls,r0,nr,c0,nc,pad,padw,reflect_bounds):
+    """
+    The [chnls,nr,nc] block at (r0,c0) of frame "ti" padded by "pad"
+    (reflected, or zeros) and then by "padw" (zeros); only the block's
+    pixels are read, so the video is never padded whole.
+    """
+    t,c,h,w = vid.shape
+    rows,valid_h = pad_index(r0,nr,h,pad[2],pad[3],padw[2],reflect_bounds,
+                             vid.device)
+    cols,valid_w = pad_index(c0,nc,w,pad[0],pad[1],padw[0],reflect_bounds,
+                             vid.device)
+    block = vid[ti,:chnls].index_select(1,rows).index_select(2,cols)
+    valid = valid_h[:,None] & valid_w[None,:]
+    return th.where(valid,block,th.zeros_like(block))
+
+def pad_index(start,num,size,pad_b,pad_a,padw_b,reflect_bounds,device):
+    """
+    The frame index (and validity) of padded positions [start,start+num)
+    """
+    idx = th.arange(start,start+num,device=device) - padw_b - pad_b
+    valid = (idx >= -pad_b) & (idx < size + pad_a)
+    if reflect_bounds:
+        idx = th.where(idx < 0,-idx,idx)
+        idx = th.where(idx >= size,2*(size-1) - idx,idx)
+    else:
+        valid = valid & (idx >= 0) & (idx < size)
+    return idx.clamp(0,size-1),valid
+
+def box_dists(block0,block1,ps,l_hi,l_wi):
+    """
+    The [len(l_hi),n] distances of the patches at (l_hi,l_wi) of the
+    anchor block [c,H+ps-1,W+ps-1] to the candidate blocks
+    [c,H+ps-1,n,W+ps-1]; summed one channel at a time
+    """
+    delta = th.zeros_like(block1[0])
+    for ci in range(block1.shape[0]):
+        delta += (block0[ci,:,None] - block1[ci])**2
+    return box_sum(delta,ps)[l_hi,:,l_wi]
+
+def box_sum(delta,ps):
+    """
+    [H+ps-1,n,W+ps-1] -> [H,n,W] sums over ps x ps windows
+    """
+    delta = delta.double()
+    csum = nnf.pad(delta.cumsum(0),(0,0,0,0,1,0))
+    delta = csum[ps:] - csum[:-ps]
+    csum = nnf.pad(delta.cumsum(2),(1,0))
+    delta = csum[...,ps:] - csum[...,:-ps]
+    return delta.float()
+
+def box_pads(ps,ws_h,ws_w,stride,use_adj,h0_off,w0_off,h1_off,w1_off):
+    """
+    Paddings (left,right,top,btm) of each video and the corner (h,w)
+    of the patch anchored at (0,0) inside the padded videos.
+    """
+    psHalf = (ps-1)//2
+    adj = psHalf if use_adj else 0
+    s0_h,s0_w = adj - psHalf - h0_off,adj - psHalf - w0_off
+    s1_h,s1_w = adj - psHalf - h1_off,adj - psHalf - w1_off
+    wsHalf_h,wsHalf_w = (ws_h-1)//2,(ws_w-1)//2
+    pad0 = (max(0,-s0_w),max(0,s0_w+ps-1),max(0,-s0_h),max(0,s0_h+ps-1))
+    pad1 = (max(0,-s1_w),max(0,s1_w+ps-1),max(0,-s1_h),max(0,s1_h+ps-1))
+    padw = (stride*wsHalf_w,stride*(ws_w-1-wsHalf_w),
+            stride*wsHalf_h,stride*(ws_h-1-wsHalf_h))
+    corner0 = (s0_h + pad0[2],s0_w + pad0[0])
+    corner1 = (s1_h + pad1[2] + padw[2],s1_w + pad1[0] + padw[0])
+    return pad0,pad1,padw,corner0,corner1
+
+def frame_groups(qinds):
+    """
+    Splits the query indices by frame
+    """
+    ti = qinds[:,0]
+    ti,order = th.sort(ti,stable=True)
+    _,counts = th.unique_consecutive(ti,return_counts=True)
+    return th.split(order,counts.tolist())
+
+def raster_area(queries):
+    """
+    The summed area of each frame's bounding box of a stride-1 raster
+    """
+    n_h,n_w = queries.grid
+    n_hw = n_h*n_w
+    area,qi,q_end = 0,queries.start,queries.start + queries.num
+    while qi < q_end:
+        f_end = min((qi // n_hw + 1) * n_hw,q_end)
+        r0,r1 = (qi % n_hw) // n_w,((f_end-1) % n_hw) // n_w
+        cols = n_w if r1 > r0 else f_end - qi
+        area += (r1 - r0 + 1) * cols
+        qi = f_end
+    return area
@@ -0,0 +1,9 @@
+from . import search
+from . import xsearch
+from . import scatter
+from . import gather
+from . import ifold
+from . import iunfold
+from . import fold
+from . import unfold
+from . import wpsum
@@ -0,0 +1,35 @@
+"""
+
+CPU engine for Fold
+
+Fold is iFold over the whole frame (coords = [0,0,h,w], adj = 0,
+only_full = False) and reads the same cached index maps. As in the
+kernel, the patch pixels outside the frame are dropped (exact for an
+odd "ps" and pt = 1, which the cuda backward asserts).
+
+"""
+
+# -- local --
+from .ifold import index_map,fold_rows,unfold_rows
+
+
+def fold_forward(vid, patches, start, stride, dilation):
+    """
+    Adds "patches" [num,1,pt,c,ps,ps] of queries [start,start+num)
+    into "vid" in-place.
+    """
+    nq,_,pt,c,ps,_ = patches.shape
+    t,c,h,w = vid.shape
+    imap = index_map(vid.shape,(0,0,h,w),ps,pt,stride,dilation,
+                     0,False,False,start,nq,vid.device)
+    fold_rows(vid,patches,imap)
+
+def fold_backward(grad_vid, grad_patches, start, stride, dilation):
+    """
+    Fills "grad_patches" [num,1,pt,c,ps,ps] in-place.
+    """
+    nq,_,pt,c,ps,_ = grad_patches.shape
+    t,c,h,w = grad_vid.shape
+    imap = index_map(grad_vid.shape,(0,0,h,w),ps,pt,stride,dilation,
+                     0,False,False,start,nq,grad_vid.device)
+    unfold_rows(grad_vid,grad_patches,imap)
@@ -0,0 +1,126 @@
+"""
+
+CPU engine for GatherNl
+
+Mirrors dnls_cuda.gather_forward(_race)/gather_backward. The forward
+pass splits the video into disjoint (frame,row band) tiles, one per
+numba task, and each tile only sums the neighbors that land inside it,
+so no two threads write the same pixel. The neighbors are bucketed by
+frame once per call and each weight "exp(-lam * dist)" is computed
+once per (query,neighbor).
+
+"""
+
+# -- linalg --
+import torch as th
+
+# -- numba --
+import numba
+from numba import njit,prange
+
+# -- local --
+from .search import numpify,writable,write_back,num_bands
+from .scatter import scatter_forward
+
+
+def gather_forward(vid, wvid, patches, nlDists, nlInds,
+                   ws, wt, dilation, lam):
+    """
+    Accumulates the weighted "patches" into "vid" and "wvid" in-place.
+
+    Matches the CUDA signature; "ws" and "wt" only bound the CUDA
+    kernel's search for contributing queries, while every neighbor
+    is visited here.
+    """
+    gather_forward_race(vid, wvid, patches, nlDists, nlInds,
+                        dilation, lam, True)
+
+def gather_forward_race(vid, wvid, patches, nlDists, nlInds,
+                        dilation, lam, exact):
+    """
+    Accumulates the weighted "patches" into "vid" and "wvid" in-place.
+
+    Each pixel is summed by one thread, in neighbor order, so the result
+    is deterministic and "exact" needs no serial fallback.
+    """
+
+    # -- neighbors by frame --
+    t,c,h,w = vid.shape
+    nq,k,pt = patches.shape[:3]
+    order,starts = frame_buckets(nlInds,t,pt)
+    weights = th.exp(-lam * nlDists.type(th.float32))
+
+    # -- tiles; split the rows when there are more threads than frames --
+    nbands = num_bands(t,h)
+
+    # -- exec; zero-copy into the caller's videos --
+    vid_nba,wvid_nba = writable(vid),writable(wvid)
+    numba_gather_fwd(vid_nba,wvid_nba,numpify(patches),numpify(weights),
+                     numpify(nlInds),numpify(order),numpify(starts),
+                     dilation,nbands)
+    write_back(vid,vid_nba)
+    write_back(wvid,wvid_nba)
+
+def gather_backward(grad_vid, patches, nlDists, nlInds, dilation):
+    """
+    Fills "patches" [NumQueries,K,pt,c,ps,ps] with the video gradient
+    at each patch pixel; zero outside the frame, time is reflected.
+    """
+    scatter_forward(grad_vid, patches, nlInds, dilation, 0, False)
+
+def frame_buckets(nlInds,t,pt):
+    """
+    The (query,neighbor) pairs sorted by first frame and the start of
+    each frame's bucket. Bucket "b" holds first frame "b-(pt-1)", so
+    every pair that reaches [0,t) for some "pk" has a bucket.
+    """
+    key = nlInds[...,0].reshape(-1).long() + (pt-1)
+    nkeys = t + pt - 1
+    key = th.where((key >= 0) & (key < nkeys),key,th.full_like(key,nkeys))
+    order = th.argsort(key,stable=True)
+    counts = th.bincount(key,minlength=nkeys+1)[:nkeys]
+    starts = th.zeros(nkeys+1,dtype=th.int64)
+    starts[1:] = th.cumsum(counts,0)
+    return order,starts
+
+#
+# -- Numba --
+#
+
+@njit(parallel=True,cache=True)
+def numba_gather_fwd(vid,wvid,patches,weights,inds,order,starts,
+                     dilation,nbands):
+
+    # -- shapes --
+    nframes,colors,height,width = vid.shape
+    nq,k,pt,_,ps,_ = patches.shape
+    psHalf = (ps-1)//2
+    band_h = (height-1)//nbands+1
+
+    for tile in prange(nframes*nbands):
+
+        # -- the tile's pixels --
+        ti = tile // nbands
+        h_start = (tile % nbands) * band_h
+        h_end = min(h_start + band_h,height)
+
+        for pk in range(pt):
+
+            # -- pairs whose "pk" frame is "ti" --
+            bucket = ti - pk + pt - 1
+            for n in range(starts[bucket],starts[bucket+1]):
+                qi = order[n] // k
+                ki = order[n] % k
+                weight = weights[qi,ki]
+                h_i = inds[qi,ki,1]
+                w_i = inds[qi,ki,2]
+
+                for pi in range(ps):
+                    hi = h_i + dilation*(pi - psHalf)
+                    if hi < h_start or hi >= h_end: continue
+                    for pj in range(ps):
+                        wi = w_i + dilation*(pj - psHalf)
+                        if wi < 0 or wi >= width: continue
+                        for ci in range(colors):
+                            vid[ti,ci,hi,wi] += weight * patches[qi,ki,pk,ci,pi,pj]
+                            wvid[ti,ci,hi,wi] += weight
@@ -0,0 +1,172 @@
+"""
+
+CPU engine for iFold (and the index maps shared with iUnfold)
+
+The queries of an inset rectangle are rastered as in the CUDA kernels,
+
+    ti = q // (n_h*n_w)
+    hi = top + stride * ((q % (n_h*n_w)) // n_w)
+    wi = left + stride * (q % n_w)
+
+and each patch pixel (pk,pi,pj) of query "q" sits at
+
+    vT = reflect(ti + pk)
+    vH = hi + dilation*(pi - ps//2 + adj)
+    vW = wi + dilation*(pj - ps//2 + adj)
+
+with (vH,vW) reflected at the frame bounds when "use_reflect" (iUnfold
+only; as in the CUDA kernel, iFold drops the pixels outside the frame). The
+spatial map of one frame is cached per (vid_shape, coords, ps, stride,
+dilation, adj, only_full, use_reflect) and the flat map of a range
+[start,start+num) is built from it with one add. Fold is then one
+index_add_ into the video and unfold one index_select, and each backward
+pass is the exact adjoint of its forward pass.
+
+"""
+
+# -- python --
+from functools import lru_cache
+
+# -- linalg --
+import torch as th
+
+# -- local --
+from .patches import reflect
+from .scatter import pixel_rows
+
+
+def ifold_forward(vid, patches, top, left, btm, right,
+                  start, stride, dilation, adj, only_full, use_reflect):
+    """
+    Adds "patches" [num,1,pt,c,ps,ps] of queries [start,start+num)
+    into "vid" in-place; "use_reflect" is unused, as in the kernel.
+    """
+    nq,_,pt,c,ps,_ = patches.shape
+    imap = index_map(vid.shape,(top,left,btm,right),ps,pt,stride,dilation,
+                     adj,only_full,False,start,nq,vid.device)
+    fold_rows(vid,patches,imap)
+
+def ifold_backward(grad_vid, grad_patches, top, left, btm, right,
+                   start, stride, dilation, adj, only_full, use_reflect):
+    """
+    Fills "grad_patches" [num,1,pt,c,ps,ps] in-place.
+    """
+    nq,_,pt,c,ps,_ = grad_patches.shape
+    imap = index_map(grad_vid.shape,(top,left,btm,right),ps,pt,stride,
+                     dilation,adj,only_full,False,start,nq,grad_vid.device)
+    unfold_rows(grad_vid,grad_patches,imap)
+
+def fold_rows(vid,patches,imap):
+    """
+    One index_add_ of the valid [c]-pixel rows of "patches" straight
+    into "vid"; only the batch's pixels are touched.
+    """
+    nq,_,pt,c,ps,_ = patches.shape
+    index,valid,sel = imap
+    t,c,h,w = vid.shape
+    rows = patches[:,0].permute(0,1,3,4,2).reshape(-1,c)[sel]
+
+    # -- [t*h*w] pixel -> [t,c,h,w] flat index of each channel --
+    index = index.view(-1)[sel]
+    ti = th.div(index,h*w,rounding_mode="floor")
+    coff = h*w*th.arange(c,device=vid.device)
+    index = (ti*(c*h*w) + index % (h*w))[:,None] + coff
+
+    # -- accumulate; a copy only for non-contiguous videos --
+    flat = vid if vid.is_contiguous() else vid.contiguous()
+    flat.view(-1).index_add_(0,index.view(-1),rows.reshape(-1).type(vid.dtype))
+    if not(flat is vid): vid[...] = flat
+
+def unfold_rows(vid,patches,imap):
+    """
+    One index_select of the [c]-pixel rows read by "patches"
+    """
+    nq,_,pt,c,ps,_ = patches.shape
+    index,valid,sel = imap
+    rows = pixel_rows(vid).index_select(0,index.view(-1))
+    rows = rows * valid.view(-1,1)
+    patches[:,0] = rows.view(nq,pt,ps,ps,c).permute(0,1,4,2,3)
+
+def index_map(vshape,coords,ps,pt,stride,dilation,adj,only_full,
+              use_reflect,start,num,device):
+    """
+    returns (index,valid,sel) for queries [start,start+num)
+
+    index,valid = [num,pt,ps,ps]; invalid pixels point at zero
+    sel = the flat positions of the valid pixels
+
+    The tensors are cached and shared across calls; do not modify
+    them in-place.
+    """
+    return _index_map(tuple(vshape),tuple(coords),ps,pt,stride,dilation,adj,
+                      only_full,use_reflect,start,num,th.device(device))
+
+@lru_cache(maxsize=8)
+def _index_map(vshape,coords,ps,pt,stride,dilation,adj,only_full,
+               use_reflect,start,num,device):
+
+    # -- one frame's map --
+    t,c,h,w = vshape
+    s_index,s_valid = spatial_map(vshape,coords,ps,stride,dilation,adj,
+                                  only_full,use_reflect,device)
+    n_hw = s_index.shape[0]
+
+    # -- queries of the range --
+    qi = start + th.arange(num,device=device)
+    ti,si = th.div(qi,n_hw,rounding_mode="floor"),qi % n_hw
+
+    # -- frames --
+    pk = th.arange(pt,device=device)
+    vT = reflect(ti[:,None] + pk,t)
+    valid_t = (ti[:,None] < t) & (vT >= 0) & (vT < t)
+
+    # -- flat map --
+    index = vT[:,:,None,None]*(h*w) + s_index[si][:,None]
+    valid = valid_t[:,:,None,None] & s_valid[si][:,None]
+    index = th.where(valid,index,th.zeros_like(index))
+    sel = th.nonzero(valid.view(-1))[:,0]
+    return index,valid,sel
+
+@lru_cache(maxsize=16)
+def _spatial_map(vshape,coords,ps,stride,dilation,adj,only_full,
+                 use_reflect,device):
+
+    # -- rastered queries of the rectangle --
+    t,c,h,w = vshape
+    top,left,btm,right = coords
+    n_h,n_w = rect_size(coords,ps,stride,dilation,only_full)
+    hi = top + stride*th.arange(n_h,device=device)
+    wi = left + stride*th.arange(n_w,device=device)
+
+    # -- patch pixels --
+    offs = dilation*(th.arange(ps,device=device) - ps//2 + adj)
+    vH = hi[:,None,None,None] + offs.view(1,1,ps,1)
+    vW = wi[None,:,None,None] + offs.view(1,1,1,ps)
+    if use_reflect:
+        vH,vW = reflect(vH,h),reflect(vW,w)
+    valid = (vH >= 0) & (vH < h) & (vW >= 0) & (vW < w)
+    index = vH*w + vW
+    return index.view(n_h*n_w,ps,ps),valid.view(n_h*n_w,ps,ps)
+
+def spatial_map(vshape,coords,ps,stride,dilation,adj,only_full,
+                use_reflect,device):
+    """
+    The [n_h*n_w,ps,ps] flat (H*W) index and validity of the patch
+    pixels of one frame's queries
+    """
+    return _spatial_map(tuple(vshape),tuple(coords),ps,stride,dilation,adj,
+                        only_full,use_reflect,th.device(device))
+
+def rect_size(coords,ps,stride,dilation,only_full):
+    """
+    The (n_h,n_w) queries along each side of the rectangle
+    """
+    top,left,btm,right = coords
+    sq_h,sq_w = btm - top,right - left
+    if only_full:
+        n_h = (sq_h - (ps-1)*dilation - 1)//stride + 1
+        n_w = (sq_w - (ps-1)*dilation - 1)//stride + 1
+    else:
+        n_h = (sq_h - 1)//stride + 1
+        n_w = (sq_w - 1)//stride + 1
+    return n_h,n_w
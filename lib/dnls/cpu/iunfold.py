@@ -0,0 +1,33 @@
+"""
+
+CPU engine for iUnfold
+
+The adjoint of dnls.cpu.ifold; both read the same cached index maps.
+
+"""
+
+# -- local --
+from .ifold import index_map,fold_rows,unfold_rows
+
+
+def iunfold_forward(vid, patches, top, left, btm, right,
+                    start, stride, dilation, adj, only_full, use_reflect):
+    """
+    Fills "patches" [num,1,pt,c,ps,ps] of queries [start,start+num)
+    in-place.
+    """
+    nq,_,pt,c,ps,_ = patches.shape
+    imap = index_map(vid.shape,(top,left,btm,right),ps,pt,stride,dilation,
+                     adj,only_full,use_reflect,start,nq,vid.device)
+    unfold_rows(vid,patches,imap)
+
+def iunfold_backward(grad_vid, grad_patches, top, left, btm, right,
+                     start, stride, dilation, adj, only_full, use_reflect):
+    """
+    Adds "grad_patches" into "grad_vid" in-place.
+    """
+    nq,_,pt,c,ps,_ = grad_patches.shape
+    imap = index_map(grad_vid.shape,(top,left,btm,right),ps,pt,stride,
+                     dilation,adj,only_full,use_reflect,start,nq,
+                     grad_vid.device)
+    fold_rows(grad_vid,grad_patches,imap)
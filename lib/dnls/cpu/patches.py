@@ -0,0 +1,91 @@
+"""
+
+Flat patch indices for the vectorized CPU engines
+
+A patch anchored at (ti,hi,wi) reads pixel (pk,pi,pj) from
+
+    vT = ti + pk
+    vH = hi - shift_h + dilation*pi
+    vW = wi - shift_w + dilation*pj
+
+where the shifts fold together the padding offsets and the
+"psHalf - adj" re-centering used throughout the CUDA kernels.
+
+"""
+
+# -- linalg --
+import torch as th
+
+
+def reflect(vals,lim):
+    vals = th.where(vals < 0, -vals, vals)
+    vals = th.where(vals >= lim, 2*(lim-1) - vals, vals)
+    return vals
+
+def patch_index(locs,vshape,ps,pt,dilation,shift_h,shift_w,
+                reflect_bounds,reflect_t):
+    """
+    locs = [...,3]
+    returns (index,valid) both [...,pt,1,ps,ps]
+
+    index is into the flattened [T,C,H,W] video at channel zero;
+    add "ci*H*W" to read channel ci. Invalid pixels point at zero.
+    """
+
+    # -- unpack --
+    t,c,h,w = vshape
+    device = locs.device
+    locs = locs.long()
+    ti = locs[...,0,None,None,None,None]
+    hi = locs[...,1,None,None,None,None]
+    wi = locs[...,2,None,None,None,None]
+
+    # -- offsets --
+    pk = th.arange(pt,device=device).view(pt,1,1,1)
+    pij = dilation*th.arange(ps,device=device)
+    pi,pj = pij.view(1,1,ps,1),pij.view(1,1,1,ps)
+
+    # -- coords --
+    vT = ti + pk
+    vH = hi - shift_h + pi
+    vW = wi - shift_w + pj
+    if reflect_t: vT = reflect(vT,t)
+    if reflect_bounds:
+        vH = reflect(vH,h)
+        vW = reflect(vW,w)
+
+    # -- valid --
+    valid = (vT >= 0) & (vT < t)
+    valid = valid & (vH >= 0) & (vH < h)
+    valid = valid & (vW >= 0) & (vW < w)
+
+    # -- flat index --
+    index = (vT * c * h + vH) * w + vW
+    index = th.where(valid,index,th.zeros_like(index))
+    return index,valid
+
+def channel_index(index,vshape,chnls=-1):
+    """
+    [...,pt,1,ps,ps] -> [...,pt,chnls,ps,ps]
+    """
+    t,c,h,w = vshape
+    if chnls <= 0: chnls = c
+    coff = h*w*th.arange(chnls,device=index.device).view(chnls,1,1)
+    return index + coff
+
+def gather_patches(vid,index,valid,chnls=-1):
+    """
+    Reads the patches [...,pt,chnls,ps,ps] at "index" from "vid"
+    """
+    index = channel_index(index,vid.shape,chnls)
+    patches = vid.reshape(-1)[index]
+    patches = patches * valid
+    return patches
+
+def scatter_patches(vid,index,valid,patches):
+    """
+    Adds the patches [...,pt,c,ps,ps] into "vid" at "index"
+    """
+    index = channel_index(index,vid.shape)
+    patches = patches * valid
+    vid.view(-1).index_add_(0,index.reshape(-1),patches.reshape(-1))
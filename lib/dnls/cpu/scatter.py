@@ -0,0 +1,87 @@
+"""
+
+CPU engine for ScatterNl
+
+Mirrors dnls_cuda.scatter_forward/scatter_backward(_eff). The flat
+index of every patch pixel is built once per call, with the channels
+kept together, so the forward pass is one index_select of pixel rows
+and the backward pass is one index_add_ of the gradient rows.
+
+"""
+
+# -- linalg --
+import torch as th
+
+# -- local --
+from .patches import patch_index
+
+
+def scatter_forward(vid, patches, inds, dilation, adj, reflect_bounds):
+    """
+    Fills "patches" [NumQueries,K,pt,c,ps,ps] in-place.
+    """
+
+    # -- flat pixel index --
+    nq,k,pt,c,ps,_ = patches.shape
+    index,valid = scatter_index(inds,vid.shape,ps,pt,dilation,
+                                adj,reflect_bounds)
+
+    # -- one gather of [c]-pixel rows --
+    rows = pixel_rows(vid).index_select(0,index.view(-1))
+    rows = rows * valid.view(-1,1)
+    rows = rows.view(nq,k,pt,ps,ps,c).permute(0,1,2,5,3,4)
+    patches[...] = rows
+
+def scatter_backward(grad_vid, grad_patches, inds, dilation, exact,
+                     adj, reflect_bounds):
+    """
+    Accumulates the patch gradients into "grad_vid" in-place.
+
+    The cpu index_add_ visits the pixels in order, so the sum is
+    deterministic; "exact" also accumulates in float64 so it matches
+    the serial (exact) kernel up to float32 rounding.
+    """
+
+    # -- flat pixel index --
+    nq,k,pt,c,ps,_ = grad_patches.shape
+    index,valid = scatter_index(inds,grad_vid.shape,ps,pt,dilation,
+                                adj,reflect_bounds)
+
+    # -- [c]-gradient rows of the valid pixels --
+    rows = grad_patches.permute(0,1,2,4,5,3).reshape(-1,c)
+    valid = valid.view(-1)
+    index,rows = index.view(-1)[valid],rows[valid]
+
+    # -- one scatter-add --
+    t,c,h,w = grad_vid.shape
+    dtype = th.float64 if exact else grad_vid.dtype
+    accum = th.zeros((t*h*w,c),device=grad_vid.device,dtype=dtype)
+    accum.index_add_(0,index,rows.type(dtype))
+    grad_vid += accum.view(t,h,w,c).permute(0,3,1,2).type(grad_vid.dtype)
+
+def scatter_backward_eff(grad_vid, grad_patches, inds, dilation, exact,
+                         adj, reflect_bounds):
+    """
+    As "scatter_backward"; the cuda kernel always reflects at the
+    spatial bounds, so this one does too.
+    """
+    scatter_backward(grad_vid, grad_patches, inds, dilation, exact,
+                     adj, True)
+
+def scatter_index(inds,vshape,ps,pt,dilation,adj,reflect_bounds):
+    """
+    The flat [T*H*W] index of each patch pixel [NumQueries,K,pt,ps,ps]
+    and its validity. Time is always reflected, as in the kernels.
+    """
+    t,c,h,w = vshape
+    shift = dilation*(ps//2 - adj)
+    index,valid = patch_index(inds,(t,1,h,w),ps,pt,dilation,
+                              shift,shift,reflect_bounds,True)
+    return index[...,0,:,:],valid[...,0,:,:]
+
+def pixel_rows(vid):
+    """
+    [T,C,H,W] -> [T*H*W,C]
+    """
+    t,c,h,w = vid.shape
+    return vid.permute(0,2,3,1).reshape(t*h*w,c)
@@ -0,0 +1,449 @@
+"""
+
+CPU engine for SearchNl
+
+Mirrors the signatures of dnls_cuda.search_forward/search_backward
+and is registered as their cpu engine in dnls.backend.
+
+"""
+
+# -- linalg --
+import torch as th
+import numpy as np
+
+# -- numba --
+import numba
+from numba import njit,prange
+
+# -- local --
+from .patches import reflect
+
+
+def search_forward(vid0, vid1, qinds, dists, inds,
+                   h0_off, w0_off, h1_off, w1_off,
+                   ps, pt, ws_h, ws_w, wt, chnls, dilation, stride,
+                   use_adj, reflect_bounds, search_abs,
+                   traj, tranges, n_tranges, min_tranges):
+    """
+    Fills "dists" and "inds" [NumQueries,2*wt+1,ws_h,ws_w(,3)] in-place.
+
+    Matches the CUDA signature; "traj" = [NumQueries,st,2] are the
+    flow-chained centers of each searched frame.
+    """
+    numba_search_fwd(numpify(vid0),numpify(vid1),numpify(qinds),
+                     dists.numpy(),inds.numpy(),
+                     h0_off,w0_off,h1_off,w1_off,
+                     ps,pt,ws_h,ws_w,chnls,dilation,stride,
+                     use_adj,reflect_bounds,search_abs,numpify(traj),
+                     numpify(tranges),numpify(n_tranges),
+                     numpify(min_tranges))
+
+def search_topk(vid0, vid1, qinds, dists, inds,
+                h0_off, w0_off, h1_off, w1_off,
+                ps, pt, ws_h, ws_w, wt, chnls, dilation, stride,
+                use_adj, reflect_bounds, search_abs,
+                traj, tranges, n_tranges, min_tranges, early_stop=True):
+    """
+    Fills the top-k "dists" and "inds" [NumQueries,K(,3)] in-place.
+
+    Each query keeps a bounded max-heap of its "k" best candidates while
+    scanning the search window, so the exhaustive buffers never exist.
+    With "early_stop", a candidate is dropped once its partial distance
+    reaches the heap's k-th distance; partial sums only grow, so the
+    result is the same.
+    """
+    numba_search_topk(numpify(vid0),numpify(vid1),numpify(qinds),
+                      dists.numpy(),inds.numpy(),
+                      h0_off,w0_off,h1_off,w1_off,
+                      ps,pt,ws_h,ws_w,chnls,dilation,stride,
+                      use_adj,reflect_bounds,search_abs,numpify(traj),
+                      numpify(tranges),numpify(n_tranges),
+                      numpify(min_tranges),early_stop)
+
+def search_backward(grad_vid0, grad_vid1, vid0, vid1, grad_dists, inds, qinds,
+                    h0_off, w0_off, h1_off, w1_off,
+                    ps, pt, dilation, use_adj, reflect_bounds, exact):
+    """
+    Accumulates into "grad_vid0" and "grad_vid1" in-place.
+
+    The videos are split into disjoint (frame,row band) tiles, one per
+    numba task, and each tile only sums the (query,neighbor) pairs that
+    land inside it, so no two threads write the same pixel and no
+    partial videos are allocated. The pairs are bucketed by frame with
+    a stable sort, so each pixel sums its terms in the serial order and
+    "exact" needs no serial fallback.
+    """
+
+    # -- pairs by the frame each patch writes --
+    t,c,h,w = vid0.shape
+    nq,k = grad_dists.shape
+    pk = th.arange(pt)
+    tk = (qinds[:,None,None,0].long() + pk).expand(nq,k,pt)
+    tj = inds[...,0,None].long() + pk
+    if reflect_bounds: tk,tj = reflect(tk,t),reflect(tj,t)
+    order0,starts0 = frame_buckets(tk,t)
+    order1,starts1 = frame_buckets(tj,t)
+
+    # -- exec; zero-copy into the caller's videos --
+    grad0_nba,grad1_nba = writable(grad_vid0),writable(grad_vid1)
+    numba_search_bwd(grad0_nba,grad1_nba,numpify(vid0),numpify(vid1),
+                     numpify(grad_dists),numpify(inds),numpify(qinds),
+                     numpify(order0),numpify(starts0),
+                     numpify(order1),numpify(starts1),
+                     h0_off,w0_off,h1_off,w1_off,
+                     ps,pt,dilation,use_adj,reflect_bounds,
+                     num_bands(t,h))
+    write_back(grad_vid0,grad0_nba)
+    write_back(grad_vid1,grad1_nba)
+
+def frame_buckets(frames,nframes):
+    """
+    The flat positions of "frames" sorted by frame and the start of each
+    frame's bucket; the sort is stable, so a bucket keeps the serial
+    order, and frames outside [0,nframes) are dropped.
+    """
+    key = frames.reshape(-1).long()
+    key = th.where((key >= 0) & (key < nframes),key,th.full_like(key,nframes))
+    order = th.argsort(key,stable=True)
+    counts = th.bincount(key,minlength=nframes+1)[:nframes]
+    starts = th.zeros(nframes+1,dtype=th.int64)
+    starts[1:] = th.cumsum(counts,0)
+    return order,starts
+
+def num_bands(nframes,height):
+    # -- split the rows when there are more threads than frames --
+    return max(1,min(height,-(-numba.get_num_threads() // nframes)))
+
+def threading_layer():
+    """
+    The threading layer of numba's "parallel" kernels; launches a tiny
+    kernel when no kernel has started the layer yet.
+    """
+    try:
+        return numba.threading_layer()
+    except ValueError:
+        numba_launch(np.zeros(1))
+        return numba.threading_layer()
+
+def numpify(tensor):
+    # -- zero-copy view for contiguous cpu tensors --
+    return tensor.detach().contiguous().numpy()
+
+def writable(tensor):
+    # -- the tensor's own memory when possible --
+    if tensor.is_contiguous(): return tensor.detach().numpy()
+    return tensor.detach().contiguous().numpy()
+
+def write_back(tensor,array):
+    # -- only copies when "writable" had to --
+    if not(tensor.is_contiguous()):
+        tensor[...] = th.from_numpy(array)
+
+#
+# -- Numba --
+#
+
+@njit(parallel=True,cache=True)
+def numba_launch(arr):
+    for i in prange(arr.shape[0]):
+        arr[i] += 1
+
+@njit(cache=True)
+def bounds(val,lim):
+    nval = val
+    if val < 0: nval = -nval
+    elif val >= lim: nval = 2*(lim-1)-nval
+    return nval
+
+@njit(cache=True)
+def fill_ref(ref,vid0,ti,hi,wi,h0_off,w0_off,
+             ps,pt,chnls,dilation,psHalf,adj,reflect_bounds):
+    # -- anchor patch is shared across the search window --
+    nframes,color,height,width = vid0.shape
+    ref[...] = 0.
+    for pk in range(pt):
+        vT = ti + pk
+        if (vT >= nframes) or (vT < 0): continue
+        for pi in range(ps):
+            vH = (hi - h0_off) + dilation*(pi - psHalf + adj)
+            vH = bounds(vH,height) if reflect_bounds else vH
+            if (vH >= height) or (vH < 0): continue
+            for pj in range(ps):
+                vW = (wi - w0_off) + dilation*(pj - psHalf + adj)
+                vW = bounds(vW,width) if reflect_bounds else vW
+                if (vW >= width) or (vW < 0): continue
+                for ci in range(chnls):
+                    ref[pk,pi,pj,ci] = vid0[vT,ci,vH,vW]
+
+@njit(cache=True)
+def l2_dist(ref,vid1,n_ti,n_hi,n_wi,h1_off,w1_off,
+            ps,pt,chnls,dilation,psHalf,adj,reflect_bounds,thresh):
+    # -- compute delta over patch vol.; stop at each row past "thresh" --
+    nframes,color,height,width = vid1.shape
+    dist = 0.
+    for pk in range(pt):
+        nT = n_ti + pk
+        nvalid_t = (nT < nframes) and (nT >= 0)
+        for pi in range(ps):
+            nH = (n_hi - h1_off) + dilation*(pi - psHalf + adj)
+            nH = bounds(nH,height) if reflect_bounds else nH
+            nvalid_h = (nH < height) and (nH >= 0)
+            for pj in range(ps):
+                nW = (n_wi - w1_off) + dilation*(pj - psHalf + adj)
+                nW = bounds(nW,width) if reflect_bounds else nW
+                nvalid = nvalid_t and nvalid_h
+                nvalid = nvalid and (nW < width) and (nW >= 0)
+                for ci in range(chnls):
+                    n_pix = vid1[nT,ci,nH,nW] if nvalid else 0.
+                    _dist = ref[pk,pi,pj,ci] - n_pix
+                    dist += _dist*_dist
+            if dist >= thresh: return dist
+    return dist
+
+@njit(cache=True)
+def heap_push(vals,inds,val,n_ti,n_hi,n_wi):
+    # -- bounded max-heap; keeps the "k" smallest values --
+    k = vals.shape[0]
+    if not(val < vals[0]): return
+    vals[0] = val
+    inds[0,0] = n_ti
+    inds[0,1] = n_hi
+    inds[0,2] = n_wi
+    i = 0
+    while True:
+        left,right = 2*i+1,2*i+2
+        largest = i
+        if (left < k) and (vals[left] > vals[largest]): largest = left
+        if (right < k) and (vals[right] > vals[largest]): largest = right
+        if largest == i: break
+        vals[i],vals[largest] = vals[largest],vals[i]
+        for j in range(3):
+            inds[i,j],inds[largest,j] = inds[largest,j],inds[i,j]
+        i = largest
+
+@njit(parallel=True,cache=True)
+def numba_search_fwd(vid0,vid1,qinds,dists,inds,
+                     h0_off,w0_off,h1_off,w1_off,
+                     ps,pt,ws_h,ws_w,chnls,dilation,stride,
+                     use_adj,reflect_bounds,search_abs,traj,
+                     tranges,n_tranges,min_tranges):
+
+    # -- shapes --
+    nframes,color,height,width = vid0.shape
+    nq = qinds.shape[0]
+    psHalf = (ps-1)//2
+    wsHalf_h = (ws_h-1)//2
+    wsHalf_w = (ws_w-1)//2
+    adj = psHalf if use_adj else 0
+    inf = np.inf
+
+    for bidx in prange(nq):
+
+        # -- unpack pixel locs --
+        ti = qinds[bidx,0]
+        hi = qinds[bidx,1]
+        wi = qinds[bidx,2]
+
+        # -- valid (anchor pixel) --
+        valid_ti = (ti < nframes) and (ti >= 0)
+        valid_hi = (hi < height) and (hi >= 0)
+        valid_wi = (wi < width) and (wi >= 0)
+        valid_anchor = valid_ti and valid_hi and valid_wi
+        if not(valid_ti): continue
+
+        # -- per-query scratch --
+        ref = np.zeros((pt,ps,ps,chnls),dtype=vid0.dtype)
+        fill_ref(ref,vid0,ti,hi,wi,h0_off,w0_off,
+                 ps,pt,chnls,dilation,psHalf,adj,reflect_bounds)
+
+        for wt_k in range(n_tranges[ti]):
+            n_ti = tranges[ti,wt_k]
+            ch = traj[bidx,wt_k,0]
+            cw = traj[bidx,wt_k,1]
+
+            for ws_i in range(ws_h):
+                for ws_j in range(ws_w):
+
+                    # -- spatial dir --
+                    if search_abs:
+                        n_hi = stride * ws_i
+                        n_wi = stride * ws_j
+                    else:
+                        n_hi = ch + stride * (ws_i - wsHalf_h)
+                        n_wi = cw + stride * (ws_j - wsHalf_w)
+
+                    # -- valid (search "n") --
+                    valid_n_ti = (n_ti < nframes) and (n_ti >= 0)
+                    valid_n_hi = (n_hi < height) and (n_hi >= 0)
+                    valid_n_wi = (n_wi < width) and (n_wi >= 0)
+                    valid = valid_n_ti and valid_n_hi and valid_n_wi
+                    valid = valid and valid_anchor
+
+                    # -- dist --
+                    if valid:
+                        dist = l2_dist(ref,vid1,n_ti,n_hi,n_wi,h1_off,w1_off,
+                                       ps,pt,chnls,dilation,psHalf,adj,
+                                       reflect_bounds,inf)
+                    else:
+                        dist = inf
+
+                    # -- fill --
+                    dists[bidx,wt_k,ws_i,ws_j] = dist
+                    inds[bidx,wt_k,ws_i,ws_j,0] = n_ti
+                    inds[bidx,wt_k,ws_i,ws_j,1] = n_hi
+                    inds[bidx,wt_k,ws_i,ws_j,2] = n_wi
+
+@njit(parallel=True,cache=True)
+def numba_search_topk(vid0,vid1,qinds,dists,inds,
+                      h0_off,w0_off,h1_off,w1_off,
+                      ps,pt,ws_h,ws_w,chnls,dilation,stride,
+                      use_adj,reflect_bounds,search_abs,traj,
+                      tranges,n_tranges,min_tranges,early_stop):
+
+    # -- shapes --
+    nframes,color,height,width = vid0.shape
+    nq,k = dists.shape
+    psHalf = (ps-1)//2
+    wsHalf_h = (ws_h-1)//2
+    wsHalf_w = (ws_w-1)//2
+    adj = psHalf if use_adj else 0
+
+    for bidx in prange(nq):
+
+        # -- init heap --
+        vals = dists[bidx]
+        hinds = inds[bidx]
+        vals[:] = np.inf
+        hinds[...] = -1
+
+        # -- unpack pixel locs --
+        ti = qinds[bidx,0]
+        hi = qinds[bidx,1]
+        wi = qinds[bidx,2]
+
+        # -- valid (anchor pixel) --
+        valid_ti = (ti < nframes) and (ti >= 0)
+        valid_hi = (hi < height) and (hi >= 0)
+        valid_wi = (wi < width) and (wi >= 0)
+        if not(valid_ti and valid_hi and valid_wi): continue
+
+        # -- per-query scratch --
+        ref = np.zeros((pt,ps,ps,chnls),dtype=vid0.dtype)
+        fill_ref(ref,vid0,ti,hi,wi,h0_off,w0_off,
+                 ps,pt,chnls,dilation,psHalf,adj,reflect_bounds)
+
+        for wt_k in range(n_tranges[ti]):
+            n_ti = tranges[ti,wt_k]
+            ch = traj[bidx,wt_k,0]
+            cw = traj[bidx,wt_k,1]
+
+            for ws_i in range(ws_h):
+                for ws_j in range(ws_w):
+
+                    # -- spatial dir --
+                    if search_abs:
+                        n_hi = stride * ws_i
+                        n_wi = stride * ws_j
+                    else:
+                        n_hi = ch + stride * (ws_i - wsHalf_h)
+                        n_wi = cw + stride * (ws_j - wsHalf_w)
+
+                    # -- valid (search "n") --
+                    valid = (n_ti < nframes) and (n_ti >= 0)
+                    valid = valid and (n_hi < height) and (n_hi >= 0)
+                    valid = valid and (n_wi < width) and (n_wi >= 0)
+                    if not(valid): continue
+
+                    # -- push --
+                    thresh = vals[0] if early_stop else np.inf
+                    dist = l2_dist(ref,vid1,n_ti,n_hi,n_wi,h1_off,w1_off,
+                                   ps,pt,chnls,dilation,psHalf,adj,
+                                   reflect_bounds,thresh)
+                    heap_push(vals,hinds,dist,n_ti,n_hi,n_wi)
+
+        # -- sort the heap --
+        order = np.argsort(vals)
+        svals = vals[order]
+        sinds = hinds[order]
+        vals[:] = svals
+        hinds[...] = sinds
+
+@njit(parallel=True,cache=True)
+def numba_search_bwd(grad_vid0,grad_vid1,vid0,vid1,grad_dists,inds,qinds,
+                     order0,starts0,order1,starts1,
+                     h0_off,w0_off,h1_off,w1_off,
+                     ps,pt,dilation,use_adj,reflect_bounds,nbands):
+
+    # -- shapes --
+    nframes,colors,height,width = vid0.shape
+    nq,k = grad_dists.shape
+    psHalf = ps//2
+    adj = psHalf if use_adj else 0
+    band_h = (height-1)//nbands+1
+
+    for tile in prange(nframes*nbands):
+
+        # -- the tile's pixels --
+        t_tile = tile // nbands
+        h_start = (tile % nbands) * band_h
+        h_end = min(h_start + band_h,height)
+
+        # -- the anchor (0) and the proposed (1) patches in the tile --
+        for side in range(2):
+            order = order0 if side == 0 else order1
+            starts = starts0 if side == 0 else starts1
+            for n in range(starts[t_tile],starts[t_tile+1]):
+                i0 = order[n] // (k*pt)
+                i1 = (order[n] // pt) % k
+                pk = order[n] % pt
+
+                tk_a = qinds[i0,0]
+                hk_a = qinds[i0,1]
+                wk_a = qinds[i0,2]
+                ti = inds[i0,i1,0]
+                hi = inds[i0,i1,1]
+                wi = inds[i0,i1,2]
+                weight = grad_dists[i0,i1]
+
+                # -- frames --
+                tk = bounds(tk_a+pk,nframes) if reflect_bounds else tk_a+pk
+                tj = bounds(ti+pk,nframes) if reflect_bounds else ti+pk
+                valid_tk = (tk >= 0) and (tk < nframes)
+                valid_tj = (tj >= 0) and (tj < nframes)
+
+                for pi in range(ps):
+
+                    # -- rows --
+                    hk = (hk_a-h0_off) + dilation*(pi - psHalf + adj)
+                    hk = bounds(hk,height) if reflect_bounds else hk
+                    hj = (hi-h1_off) + dilation*(pi - psHalf + adj)
+                    hj = bounds(hj,height) if reflect_bounds else hj
+                    h_out = hk if side == 0 else hj
+                    if h_out < h_start or h_out >= h_end: continue
+
+                    for pj in range(ps):
+
+                        # -- cols --
+                        wk = (wk_a-w0_off) + dilation*(pj - psHalf + adj)
+                        wk = bounds(wk,width) if reflect_bounds else wk
+                        wj = (wi-w1_off) + dilation*(pj - psHalf + adj)
+                        wj = bounds(wj,width) if reflect_bounds else wj
+
+                        # -- assess if valid --
+                        valid_j = (hj >= 0) and (hj < height)
+                        valid_j = valid_j and (wj >= 0) and (wj < width)
+                        valid_j = valid_j and valid_tj
+                        valid_k = (hk >= 0) and (hk < height)
+                        valid_k = valid_k and (wk >= 0) and (wk < width)
+                        valid_k = valid_k and valid_tk
+                        if side == 0 and not(valid_k): continue
+                        if side == 1 and not(valid_j): continue
+
+                        for c0 in range(colors):
+                            pix0 = vid0[tk,c0,hk,wk] if valid_k else 0.
+                            pix1 = vid1[tj,c0,hj,wj] if valid_j else 0.
+                            pix = 2 * weight * (pix0 - pix1)
+                            if side == 0:
+                                grad_vid0[tk,c0,hk,wk] += pix
+                            else:
+                                grad_vid1[tj,c0,hj,wj] -= pix
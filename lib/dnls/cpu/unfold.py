@@ -0,0 +1,34 @@
+"""
+
+CPU engine for Unfold
+
+Unfold is iUnfold over the whole frame (coords = [0,0,h,w], adj = 0,
+only_full = False) with the patch pixels reflected at the frame's
+bounds, as in the kernel; it reads the same cached index maps.
+
+"""
+
+# -- local --
+from .ifold import index_map,fold_rows,unfold_rows
+
+
+def unfold_forward(vid, patches, start, stride, dilation):
+    """
+    Fills "patches" [num,1,pt,c,ps,ps] of queries [start,start+num)
+    in-place.
+    """
+    nq,_,pt,c,ps,_ = patches.shape
+    t,c,h,w = vid.shape
+    imap = index_map(vid.shape,(0,0,h,w),ps,pt,stride,dilation,
+                     0,False,True,start,nq,vid.device)
+    unfold_rows(vid,patches,imap)
+
+def unfold_backward(grad_vid, grad_patches, start, stride, dilation):
+    """
+    Adds "grad_patches" into "grad_vid" in-place.
+    """
+    nq,_,pt,c,ps,_ = grad_patches.shape
+    t,c,h,w = grad_vid.shape
+    imap = index_map(grad_vid.shape,(0,0,h,w),ps,pt,stride,dilation,
+                     0,False,True,start,nq,grad_vid.device)
+    fold_rows(grad_vid,grad_patches,imap)
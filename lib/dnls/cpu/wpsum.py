@@ -0,0 +1,163 @@
+"""
+
+CPU engine for WeightedPatchSum
+
+Mirrors dnls_cuda.wpsum_forward/wpsum_backward_vid/wpsum_backward_dists.
+Each query reads its "k" neighbor pixels straight from the video and
+sums them into its own output patch, so the [NumQueries,K,pt,c,ps,ps]
+neighbor patches never exist.
+
+"""
+
+# -- linalg --
+import torch as th
+
+# -- numba --
+from numba import njit,prange
+
+# -- local --
+from .patches import reflect
+from .search import numpify,bounds,writable,write_back
+from .search import frame_buckets,num_bands
+
+
+def wpsum_forward(vid, patches, dists, inds,
+                  h_off, w_off, dilation, adj, reflect_bounds):
+    """
+    Adds the weighted sum of the neighbor patches into
+    "patches" [NumQueries,1,pt,c,ps,ps] in-place.
+    """
+    numba_wpsum_fwd(numpify(vid),patches.numpy(),numpify(dists),
+                    numpify(inds),h_off,w_off,dilation,adj,reflect_bounds)
+
+def wpsum_backward_vid(vid_grad, patches_grad, dists, inds,
+                       h_off, w_off, dilation, adj, reflect_bounds, exact):
+    """
+    Accumulates into "vid_grad" in-place.
+
+    The video is split into disjoint (frame,row band) tiles, as in the
+    search backward, so each pixel is summed by one thread, in the
+    serial order; "exact" needs no serial fallback.
+    """
+
+    # -- (query,neighbor,pk) by the (reflected) frame each writes --
+    t,c,h,w = vid_grad.shape
+    pt = patches_grad.shape[2]
+    frames = reflect(inds[...,0,None].long() + th.arange(pt),t)
+    order,starts = frame_buckets(frames,t)
+
+    # -- exec; zero-copy into the caller's video --
+    vid_grad_nba = writable(vid_grad)
+    numba_wpsum_bwd_vid(vid_grad_nba,numpify(patches_grad),numpify(dists),
+                        numpify(inds),numpify(order),numpify(starts),
+                        h_off,w_off,dilation,adj,reflect_bounds,
+                        num_bands(t,h))
+    write_back(vid_grad,vid_grad_nba)
+
+def wpsum_backward_dists(dists_grad, patches_grad, vid, inds,
+                         h_off, w_off, dilation, adj, reflect_bounds, exact):
+    """
+    Accumulates into "dists_grad" [NumQueries,K] in-place.
+    """
+    numba_wpsum_bwd_dists(dists_grad.numpy(),numpify(patches_grad),
+                          numpify(vid),numpify(inds),h_off,w_off,
+                          dilation,adj,reflect_bounds)
+
+#
+# -- Numba --
+#
+
+@njit(cache=True)
+def patch_coord(center,off,dilation,pi,psHalf,adj,lim,reflect_bounds):
+    coord = (center-off) + dilation*(pi - psHalf + adj)
+    return bounds(coord,lim) if reflect_bounds else coord
+
+@njit(parallel=True,cache=True)
+def numba_wpsum_fwd(vid,patches,dists,inds,h_off,w_off,
+                    dilation,adj,reflect_bounds):
+
+    # -- shapes --
+    nframes,colors,height,width = vid.shape
+    nq,_,pt,_,ps,_ = patches.shape
+    k = inds.shape[1]
+    psHalf = ps//2
+
+    for qi in prange(nq):
+        for ki in range(k):
+            dist = dists[qi,ki]
+            for pk in range(pt):
+                ti = bounds(inds[qi,ki,0] + pk,nframes)
+                if ti < 0 or ti >= nframes: continue
+                for pi in range(ps):
+                    hi = patch_coord(inds[qi,ki,1],h_off,dilation,pi,
+                                     psHalf,adj,height,reflect_bounds)
+                    if hi < 0 or hi >= height: continue
+                    for pj in range(ps):
+                        wi = patch_coord(inds[qi,ki,2],w_off,dilation,pj,
+                                         psHalf,adj,width,reflect_bounds)
+                        if wi < 0 or wi >= width: continue
+                        for ci in range(colors):
+                            patches[qi,0,pk,ci,pi,pj] += dist*vid[ti,ci,hi,wi]
+
+@njit(parallel=True,cache=True)
+def numba_wpsum_bwd_vid(vid_grad,patches_grad,dists,inds,order,starts,
+                        h_off,w_off,dilation,adj,reflect_bounds,nbands):
+
+    # -- shapes --
+    nframes,colors,height,width = vid_grad.shape
+    nq,_,pt,_,ps,_ = patches_grad.shape
+    k = inds.shape[1]
+    psHalf = ps//2
+    band_h = (height-1)//nbands+1
+
+    for tile in prange(nframes*nbands):
+
+        # -- the tile's pixels --
+        ti = tile // nbands
+        h_start = (tile % nbands) * band_h
+        h_end = min(h_start + band_h,height)
+
+        for n in range(starts[ti],starts[ti+1]):
+            qi = order[n] // (k*pt)
+            ki = (order[n] // pt) % k
+            pk = order[n] % pt
+            dist = dists[qi,ki]
+            for pi in range(ps):
+                hi = patch_coord(inds[qi,ki,1],h_off,dilation,pi,
+                                 psHalf,adj,height,reflect_bounds)
+                if hi < h_start or hi >= h_end: continue
+                for pj in range(ps):
+                    wi = patch_coord(inds[qi,ki,2],w_off,dilation,pj,
+                                     psHalf,adj,width,reflect_bounds)
+                    if wi < 0 or wi >= width: continue
+                    for ci in range(colors):
+                        grad = dist*patches_grad[qi,0,pk,ci,pi,pj]
+                        vid_grad[ti,ci,hi,wi] += grad
+
+@njit(parallel=True,cache=True)
+def numba_wpsum_bwd_dists(dists_grad,patches_grad,vid,inds,h_off,w_off,
+                          dilation,adj,reflect_bounds):
+
+    # -- shapes --
+    nframes,colors,height,width = vid.shape
+    nq,_,pt,_,ps,_ = patches_grad.shape
+    k = inds.shape[1]
+    psHalf = ps//2
+
+    for qi in prange(nq):
+        for ki in range(k):
+            grad = 0.
+            for pk in range(pt):
+                ti = bounds(inds[qi,ki,0] + pk,nframes)
+                if ti < 0 or ti >= nframes: continue
+                for pi in range(ps):
+                    hi = patch_coord(inds[qi,ki,1],h_off,dilation,pi,
+                                     psHalf,adj,height,reflect_bounds)
+                    if hi < 0 or hi >= height: continue
+                    for pj in range(ps):
+                        wi = patch_coord(inds[qi,ki,2],w_off,dilation,pj,
+                                         psHalf,adj,width,reflect_bounds)
+                        if wi < 0 or wi >= width: continue
+                        for ci in range(colors):
+                            grad += patches_grad[qi,0,pk,ci,pi,pj]*vid[ti,ci,hi,wi]
+            dists_grad[qi,ki] += grad
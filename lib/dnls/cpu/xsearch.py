@@ -0,0 +1,257 @@
+"""
+
+CPU engine for CrossSearchNl
+
+Queries are grouped into spatial tiles. For each tile and each searched
+frame, the candidates are the union of the tile's search windows; the
+query patches and candidate patches are compared with one matrix multiply
+per candidate chunk and only a running top-k is kept per query.
+Peak memory is bounded by the tile sizes rather than the search window.
+
+"""
+
+# -- linalg --
+import torch as th
+
+# -- local --
+from .patches import patch_index,gather_patches,scatter_patches
+from dnls.utils.flow import search_frames
+
+# -- tile sizes --
+TILE_SIZE = 32 # spatial side (in pixels) of a query tile
+CAND_NUMEL = 2**22 # max elements of a candidate patch chunk
+
+
+def xsearch_topk(vid0, vid1, qinds, k,
+                 ps, pt, ws_h, ws_w, wt, chnls, stride, dilation,
+                 use_search_abs, use_bounds, use_adj,
+                 h0_off, w0_off, h1_off, w1_off,
+                 traj, tranges, n_tranges, min_tranges):
+    """
+    Returns the top-k (dists,inds) [NumQueries,K(,3)] directly.
+    """
+
+    # -- alloc --
+    nq = qinds.shape[0]
+    device = qinds.device
+    dists = th.full((nq,k),-float("inf"),device=device,dtype=th.float32)
+    inds = -th.ones((nq,k,3),device=device,dtype=th.int32)
+
+    # -- running top-k over candidate tiles --
+    for qsel,n_ti,scores,cands,_,_ in xsearch_tiles(
+            vid0, vid1, qinds, traj,
+            ps, pt, ws_h, ws_w, chnls, stride, dilation,
+            use_search_abs, use_bounds, use_adj,
+            h0_off, w0_off, h1_off, w1_off,
+            tranges, n_tranges, min_tranges):
+
+        # -- merge with current best --
+        nb = cands.shape[0]
+        vals = th.cat([dists[qsel],scores],1)
+        order = th.topk(vals,k,dim=1,largest=True).indices
+        dists[qsel] = th.gather(vals,1,order)
+
+        # -- merge inds --
+        cinds = th.zeros((nb,3),device=device,dtype=th.int32)
+        cinds[:,0] = n_ti
+        cinds[:,1:] = cands
+        cinds = cinds[None,:].expand(len(qsel),nb,3)
+        all_inds = th.cat([inds[qsel],cinds],1)
+        order = order[...,None].expand(-1,-1,3)
+        inds[qsel] = th.gather(all_inds,1,order)
+
+    return dists,inds
+
+def xsearch_forward(vid0, vid1, qinds, dists, inds,
+                    ps, pt, ws_h, ws_w, wt, chnls, stride, dilation,
+                    use_search_abs, use_bounds, use_adj,
+                    h0_off, w0_off, h1_off, w1_off,
+                    traj, tranges, n_tranges, min_tranges):
+    """
+    Fills the exhaustive "dists" and "inds" [NumQueries,st,ws_h,ws_w(,3)].
+
+    Matches the CUDA signature; "traj" = [NumQueries,st,2] are the
+    flow-chained centers.
+    """
+
+    # -- inds of every window location --
+    wsHalf_h,wsHalf_w = (ws_h-1)//2,(ws_w-1)//2
+    frames = search_frames(qinds,tranges,n_tranges)
+    centers = traj.long()
+    st = frames.shape[1]
+    ws_i = stride*th.arange(ws_h,device=qinds.device)
+    ws_j = stride*th.arange(ws_w,device=qinds.device)
+    if use_search_abs:
+        n_hi = ws_i.view(1,1,ws_h).expand(qinds.shape[0],st,ws_h)
+        n_wi = ws_j.view(1,1,ws_w).expand(qinds.shape[0],st,ws_w)
+    else:
+        n_hi = centers[...,0,None] + ws_i - stride*wsHalf_h
+        n_wi = centers[...,1,None] + ws_j - stride*wsHalf_w
+    valid_t = (frames >= 0)[...,None,None]
+    inds[:,:st,...,0] = th.where(valid_t,frames[...,None,None],-1).int()
+    inds[:,:st,...,1] = th.where(valid_t,n_hi[...,:,None],-1).int()
+    inds[:,:st,...,2] = th.where(valid_t,n_wi[...,None,:],-1).int()
+
+    # -- scatter scores into the window --
+    for qsel,n_ti,scores,cands,wt_k,centers_t in xsearch_tiles(
+            vid0, vid1, qinds, traj,
+            ps, pt, ws_h, ws_w, chnls, stride, dilation,
+            use_search_abs, use_bounds, use_adj,
+            h0_off, w0_off, h1_off, w1_off,
+            tranges, n_tranges, min_tranges, frames=frames):
+        qi,ci = th.where(scores > -float("inf"))
+        if use_search_abs:
+            wi = cands[ci,0] // stride
+            wj = cands[ci,1] // stride
+        else:
+            wi = (cands[ci,0] - centers_t[qi,0]) // stride + wsHalf_h
+            wj = (cands[ci,1] - centers_t[qi,1]) // stride + wsHalf_w
+        dists[qsel[qi],wt_k,wi,wj] = scores[qi,ci]
+
+def xsearch_backward(vid0_grad, vid1_grad, vid0, vid1, qinds, grad_dists, inds,
+                     h0_off, w0_off, h1_off, w1_off, ps, pt, lam,
+                     use_bounds, exact):
+    """
+    Accumulates into "vid0_grad" and "vid1_grad" in-place.
+
+    Follows the CUDA kernel: adj = ps//2 and dilation = 1.
+    Each query chunk uses a single index_add_ per video.
+    """
+
+    # -- unpack --
+    nq,k = grad_dists.shape
+    t,c,h,w = vid0.shape
+    vshape = vid0.shape
+    qchunk = max(1,CAND_NUMEL // (k*pt*c*ps*ps))
+
+    for q_start in range(0,nq,qchunk):
+        q_end = min(q_start+qchunk,nq)
+
+        # -- patch indices --
+        qinds_b = qinds[q_start:q_end,None].expand(-1,k,-1)
+        inds_b = inds[q_start:q_end]
+        weight = grad_dists[q_start:q_end].view(-1,k,1,1,1,1)
+        index0,valid0 = patch_index(qinds_b,vshape,ps,pt,1,h0_off,w0_off,
+                                    use_bounds,use_bounds)
+        index1,valid1 = patch_index(inds_b,vshape,ps,pt,1,h1_off,w1_off,
+                                    use_bounds,use_bounds)
+
+        # -- spatial validity of both pixels --
+        valid = valid0 & valid1
+
+        # -- accumulate --
+        pix0 = gather_patches(vid0,index0,valid)
+        pix1 = gather_patches(vid1,index1,valid)
+        scatter_patches(vid1_grad,index1,valid,weight * pix0)
+        scatter_patches(vid0_grad,index0,valid,weight * pix1)
+
+def xsearch_tiles(vid0, vid1, qinds, traj,
+                  ps, pt, ws_h, ws_w, chnls, stride, dilation,
+                  use_search_abs, use_bounds, use_adj,
+                  h0_off, w0_off, h1_off, w1_off,
+                  tranges, n_tranges, min_tranges, frames=None):
+    """
+    Yields (qsel,n_ti,scores,cands,wt_k,centers_t) per candidate chunk.
+
+    scores = [len(qsel),len(cands)]; -inf outside each query's window.
+    """
+
+    # -- unpack --
+    t,c,h,w = vid0.shape
+    vshape = vid0.shape
+    device = qinds.device
+    psHalf = ps//2
+    adj = psHalf if use_adj else 0
+    wsHalf_h,wsHalf_w = (ws_h-1)//2,(ws_w-1)//2
+    shift0_h = h0_off + dilation*(psHalf - adj)
+    shift0_w = w0_off + dilation*(psHalf - adj)
+    shift1_h = h1_off + dilation*(psHalf - adj)
+    shift1_w = w1_off + dilation*(psHalf - adj)
+    qinds = qinds.long()
+
+    # -- flow-chained centers --
+    if frames is None:
+        frames = search_frames(qinds,tranges,n_tranges)
+    centers = traj.long()
+    st = frames.shape[1]
+
+    # -- skip invalid anchors --
+    ti,hi,wi = qinds[:,0],qinds[:,1],qinds[:,2]
+    valid = (ti >= 0) & (ti < t) & (hi >= 0) & (hi < h) & (wi >= 0) & (wi < w)
+    qvalid = th.where(valid)[0]
+
+    # -- group queries into spatial tiles of one frame --
+    nth = (h-1)//TILE_SIZE+1
+    ntw = (w-1)//TILE_SIZE+1
+    key = (ti[qvalid] * nth + hi[qvalid]//TILE_SIZE) * ntw + wi[qvalid]//TILE_SIZE
+    key,order = th.sort(key)
+    qvalid = qvalid[order]
+    _,counts = th.unique_consecutive(key,return_counts=True)
+
+    for qsel in th.split(qvalid,counts.tolist()):
+
+        # -- query patches --
+        index,qmask = patch_index(qinds[qsel],vshape,ps,pt,dilation,
+                                  shift0_h,shift0_w,use_bounds,True)
+        qpatches = gather_patches(vid0,index,qmask,chnls)
+        qpatches = qpatches.view(len(qsel),-1)
+        dim = qpatches.shape[1]
+
+        for wt_k in range(st):
+
+            # -- searched frame; shared by the tile --
+            n_ti = int(frames[qsel[0],wt_k].item())
+            if n_ti < 0: continue
+            centers_t = centers[qsel,wt_k]
+
+            # -- window bounds of each query --
+            if use_search_abs:
+                lo_h = th.zeros_like(centers_t[:,0])
+                lo_w = th.zeros_like(centers_t[:,1])
+            else:
+                lo_h = centers_t[:,0] - stride*wsHalf_h
+                lo_w = centers_t[:,1] - stride*wsHalf_w
+            hi_h = lo_h + stride*(ws_h-1)
+            hi_w = lo_w + stride*(ws_w-1)
+
+            # -- union of the windows, inside the frame --
+            top = max(int(lo_h.min().item()),0)
+            btm = min(int(hi_h.max().item()),h-1)
+            left = max(int(lo_w.min().item()),0)
+            right = min(int(hi_w.max().item()),w-1)
+            if (top > btm) or (left > right): continue
+            box_w = right - left + 1
+            cols = th.arange(left,right+1,device=device)
+
+            # -- window mask along width --
+            dw = cols[None,:] - lo_w[:,None]
+            mask_w = (dw >= 0) & (cols[None,:] <= hi_w[:,None])
+            mask_w = mask_w & (dw % stride == 0)
+
+            # -- chunk the box by rows --
+            nrows = max(1,CAND_NUMEL // (box_w * dim))
+            for r_start in range(top,btm+1,nrows):
+                r_end = min(r_start+nrows,btm+1)
+                rows = th.arange(r_start,r_end,device=device)
+
+                # -- window mask along height --
+                dh = rows[None,:] - lo_h[:,None]
+                mask_h = (dh >= 0) & (rows[None,:] <= hi_h[:,None])
+                mask_h = mask_h & (dh % stride == 0)
+                mask = mask_h[:,:,None] & mask_w[:,None,:]
+                mask = mask.view(len(qsel),-1)
+                if not(mask.any()): continue
+
+                # -- candidate patches --
+                cands = th.stack(th.meshgrid(rows,cols,indexing="ij"),-1)
+                cands = cands.view(-1,2)
+                locs = th.cat([th.full_like(cands[:,:1],n_ti),cands],1)
+                index,cmask = patch_index(locs,vshape,ps,pt,dilation,
+                                          shift1_h,shift1_w,use_bounds,True)
+                cpatches = gather_patches(vid1,index,cmask,chnls)
+                cpatches = cpatches.view(len(cands),-1)
+
+                # -- scores --
+                scores = th.matmul(qpatches,cpatches.T)
+                scores = scores.masked_fill(~mask,-float("inf"))
+                yield qsel,n_ti,scores,cands,wt_k,centers_t
@@ -7,26 +7,54 @@ A gather _without_ a race condition with k == 1
 
 # -- python --
 import torch as th
+from functools import lru_cache
 
-# -- cpp cuda kernel --
-import dnls_cuda
+# -- backend dispatch (cuda kernels load lazily) --
+from dnls import backend
+
+# -- the weights as an extra channel --
+from dnls.ifold import weight_channel
 
 
 def allocate_patches(nq,k,ps,pt,c,device):
     patches = th.zeros((nq,k,pt,c,ps,ps),device=device,dtype=th.float32)
     return patches
 
+def batch_frames(vid,start,nq,pt,stride):
+    """
+    The frames of "vid" folded by queries [start,start+nq), with the
+    start shifted to them; whole frames keep the cuda input contiguous.
+    """
+    t,c,h,w = vid.shape
+    n_hw = ((h-1)//stride + 1) * ((w-1)//stride + 1)
+    t0,t1 = start // n_hw,(start+nq-1) // n_hw
+    f0,f1 = max(t0-(pt-1),0),min(t1+1,t)
+    return vid[f0:f1],start - f0*n_hw
+
 class FoldFunction(th.autograd.Function):
     """
     [patches -> video] @ nlInds
 
     nlInds.shape = [NumQueries,K,3]
     patches.shape = [NumQueries,K,pt,c,ps,ps]
+
+    The patches are added into "vid" in-place.
     """
 
     @staticmethod
     def forward(ctx, patches, vid, qStart, stride, dilation):
-        dnls_cuda.fold_forward(vid, patches, qStart, stride, dilation)
+
+        # -- the cuda kernel visits every pixel of its video; narrow it --
+        nq,_,pt = patches.shape[:3]
+        bvid,bstart = vid,qStart
+        if vid.is_cuda:
+            bvid,bstart = batch_frames(vid,qStart,nq,pt,stride)
+
+        # -- accumulate --
+        fold_forward = backend.get("fold_forward",vid.device)
+        if bvid.numel() > 0:
+            fold_forward(bvid, patches, bstart, stride, dilation)
+        ctx.mark_dirty(vid)
         ctx.qStart = qStart
         ctx.stride = stride
         ctx.qNum = patches.shape[0]
@@ -54,31 +82,85 @@ class FoldFunction(th.autograd.Function):
         grad_patches = allocate_patches(qNum,1,ps,pt,colors,device)
 
         # -- backward --
-        dnls_cuda.fold_backward(grad_vid,grad_patches,qStart,stride,dilation)
+        fold_backward = backend.get("fold_backward",grad_vid.device)
+        fold_backward(grad_vid,grad_patches,qStart,stride,dilation)
 
-        return grad_patches,None,None,None,None
+        return grad_patches,grad_vid,None,None,None
 
 class Fold(th.nn.Module):
     # [patches -> video] @ nlInds [with k == 1]
+    #
+    # use_weights: also accumulates the weight of each pixel in the same
+    # pass and returns (vid,wvid); wvid.shape = [t,1,h,w]
 
-    def __init__(self, vid_shape, stride=1, dilation=1, device="cuda:0"):
+    def __init__(self, vid_shape, stride=1, dilation=1, use_weights=False,
+                 device="cuda:0"):
         super(Fold, self).__init__()
         self.device = device
         self.vid_shape = vid_shape
-        self.vid = self.allocate_vid(vid_shape,device)
+        self.use_weights = use_weights
+        self.vid,self.wvid = self.allocate_vid(vid_shape,device)
         self.stride = stride
         self.dilation = dilation
 
     def allocate_vid(self,vid_shape,device):
-        vid = th.zeros(vid_shape,device=device,dtype=th.float32)
-        return vid
-
-
-    def forward(self, patches, qStart):
-        bpatches,qStart = patches,qStart
-        vid = self.allocate_vid(self.vid_shape,self.device)
-        vid = FoldFunction.apply(bpatches, vid, qStart,
-                                 self.stride,self.dilation)
-        self.vid = self.vid + vid
-        return self.vid
-
+        if not(self.use_weights):
+            vid = th.zeros(vid_shape,device=device,dtype=th.float32)
+            return vid,None
+
+        # -- the weights are folded as an extra channel --
+        t,c,h,w = vid_shape
+        self.vwid = th.zeros((t,c+1,h,w),device=device,dtype=th.float32)
+        return self.vwid[:,:c],self.vwid[:,c:]
+
+    def forward(self, patches, qStart, weights=None):
+        """
+        Accumulates "patches" (scaled by the [NumQueries] "weights")
+        into "self.vid" in-place.
+        """
+        if not(weights is None):
+            patches = patches * weights.view(-1,1,1,1,1,1)
+        if not(self.use_weights):
+            self.vid = FoldFunction.apply(patches, self.vid, qStart,
+                                          self.stride,self.dilation)
+            return self.vid
+
+        # -- one pass over [patches,weights] --
+        c = self.vid_shape[1]
+        wpatches = weight_channel(patches,weights)
+        self.vwid = FoldFunction.apply(wpatches, self.vwid, qStart,
+                                       self.stride,self.dilation)
+        self.vid,self.wvid = self.vwid[:,:c],self.vwid[:,c:]
+        return self.vid,self.wvid
+
+    def norm_map(self, ps, pt=1):
+        """
+        The [t,1,h,w] weights of folding every query with uniform weights
+        """
+        return norm_map(self.vid_shape,ps,pt,self.stride,self.dilation,
+                        self.vid.device)
+
+#
+# -- Normalization Maps --
+#
+
+def norm_map(vid_shape,ps,pt=1,stride=1,dilation=1,device="cuda:0"):
+    """
+    The [t,1,h,w] weights of folding every query with uniform weights;
+    cached per geometry, so do not modify it in-place.
+    """
+    t,c,h,w = vid_shape
+    return _norm_map((t,h,w),ps,pt,stride,dilation,th.device(device))
+
+@lru_cache(maxsize=8)
+def _norm_map(shape,ps,pt,stride,dilation,device):
+
+    # -- fold ones over every query; one frame without a temporal patch --
+    t,h,w = shape
+    nframes = t if pt > 1 else 1
+    n_hw = ((h-1)//stride + 1) * ((w-1)//stride + 1)
+    ones = th.ones((nframes*n_hw,1,pt,1,ps,ps),device=device)
+    wvid = th.zeros((nframes,1,h,w),device=device)
+    fold_forward = backend.get("fold_forward",device)
+    fold_forward(wvid, ones, 0, stride, dilation)
+    return wvid.expand(t,1,h,w)
@@ -2,8 +2,8 @@
 # -- python --
 import torch as th
 
-# -- cpp cuda kernel --
-import dnls_cuda
+# -- backend dispatch (cuda kernels load lazily) --
+from dnls import backend
 
 
 def allocate_patches(nlInds,ps,pt,c):
@@ -18,17 +18,22 @@ class GatherNlFunction(th.autograd.Function):
 
     nlInds.shape = [NumQueries,K,3]
     patches.shape = [NumQueries,K,pt,c,ps,ps]
+
+    The weighted patches are added into "vid" and "wvid" in-place.
     """
 
     @staticmethod
     def forward(ctx, patches, nlDists, nlInds, vid, wvid,
                 ws, wt, dilation, lam, exact, use_race):
         if use_race:
-            dnls_cuda.gather_forward_race(vid, wvid, patches, nlDists, nlInds,
-                                          dilation, lam, exact)
+            gather_forward_race = backend.get("gather_forward_race",vid.device)
+            gather_forward_race(vid, wvid, patches, nlDists, nlInds,
+                                dilation, lam, exact)
         else:
-            dnls_cuda.gather_forward(vid, wvid, patches, nlDists, nlInds,
-                                     ws, wt, dilation, lam)
+            gather_forward = backend.get("gather_forward",vid.device)
+            gather_forward(vid, wvid, patches, nlDists, nlInds,
+                           ws, wt, dilation, lam)
+        ctx.mark_dirty(vid,wvid)
         ctx.save_for_backward(nlInds)
         ctx.dilation = dilation
         ctx.pt = patches.shape[2]
@@ -43,8 +48,9 @@ class GatherNlFunction(th.autograd.Function):
         ps,pt = ctx.ps,ctx.pt
         patches = allocate_patches(nlInds,ps,pt,grad_vid.shape[1])
         ones = th.ones_like(nlInds[:,:,0]).type(th.float32)
-        dnls_cuda.gather_backward(grad_vid,patches,ones,nlInds,dilation)
-        return patches,None,None,None,None,None,None,None,None,None,None
+        gather_backward = backend.get("gather_backward",grad_vid.device)
+        gather_backward(grad_vid,patches,ones,nlInds,dilation)
+        return patches,None,None,grad_vid,grad_wvid,None,None,None,None,None,None
 
 class GatherNl(th.nn.Module):
     # [patches -> video] @ nlInds
@@ -53,6 +59,7 @@ class GatherNl(th.nn.Module):
                  exact=False, use_race=True, device="cuda"):
         super(GatherNl, self).__init__()
         self.vid_shape = vid_shape
+        self.device = device
         self.vid,self.wvid = self.allocate_vid(vid_shape,device)
         self.dilation = dilation
         self.lam = lam
@@ -67,13 +74,12 @@ class GatherNl(th.nn.Module):
         return vid,wvid
 
     def forward(self, patches, nlDists, nlInds):
-        vid,wvid = self.allocate_vid(self.vid_shape,self.device)
-        vid,wvid = GatherNlFunction.apply(patches,nlDists,nlInds,vid,wvid,
-                                          self.ws, self.wt,
-                                          self.dilation,self.lam,
-                                          self.exact,self.use_race)
-        self.vid += vid
-        self.wvid += wvid
+        # -- accumulates into "self.vid" and "self.wvid" in-place --
+        self.vid,self.wvid = GatherNlFunction.apply(patches,nlDists,nlInds,
+                                                    self.vid,self.wvid,
+                                                    self.ws, self.wt,
+                                                    self.dilation,self.lam,
+                                                    self.exact,self.use_race)
         return self.vid,self.wvid
 
 
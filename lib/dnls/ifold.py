@@ -7,29 +7,74 @@ Fold but with an inset rectangle of any size
 
 # -- python --
 import torch as th
+from functools import lru_cache
 
-# -- cpp cuda kernel --
-import dnls_cuda
+# -- backend dispatch (cuda kernels load lazily) --
+from dnls import backend
 
 
 def allocate_patches(nq,k,ps,pt,c,device):
     patches = th.zeros((nq,k,pt,c,ps,ps),device=device,dtype=th.float32)
     return patches
 
+def query_grid(coords,ps,stride,dilation,only_full):
+    """
+    The (n_h,n_w) queries along each side of the rectangle
+    """
+    top,left,btm,right = coords
+    full = (ps-1)*dilation if only_full else 0
+    n_h = (btm - top - full - 1)//stride + 1
+    n_w = (right - left - full - 1)//stride + 1
+    return n_h,n_w
+
+def batch_frames(vid,coords,start,nq,ps,pt,stride,dilation,only_full):
+    """
+    The frames of "vid" folded by queries [start,start+nq), with the
+    start shifted to them. The kernel's rastering only depends on the
+    frames relative to the start, so it runs unchanged on the frames;
+    a slice of whole frames stays contiguous, as the kernel requires.
+
+    A patch of frame "ti" reaches frames ti..ti+pt-1, reflected at the
+    video's last frame; when it does, the slice keeps that last frame
+    (so the kernel reflects there) and the reflected frames.
+    """
+    t,c,h,w = vid.shape
+    n_h,n_w = query_grid(coords,ps,stride,dilation,only_full)
+    n_hw = n_h * n_w
+    t0,t1 = start // n_hw,(start+nq-1) // n_hw
+    f0,f1 = t0,min(t1+pt,t)
+    if t1+pt > t: # reflected back from frame "t-1"
+        f0 = max(min(f0,2*(t-1)-(t1+pt-1)),0)
+    return vid[f0:f1],start - f0*n_hw
+
 class iFoldFunction(th.autograd.Function):
     """
     [patches -> video] @ nlInds
 
     nlInds.shape = [NumQueries,K,3]
     patches.shape = [NumQueries,K,pt,c,ps,ps]
+
+    The patches are added into "vid" in-place.
     """
 
     @staticmethod
     def forward(ctx, patches, vid, coords, qStart, stride, dilation, adj,
                 only_full,use_reflect):
+
+        # -- the cuda kernel visits every pixel of its video; narrow it --
+        nq,_,pt,_,ps,_ = patches.shape
+        bvid,bstart = vid,qStart
+        if vid.is_cuda:
+            bvid,bstart = batch_frames(vid,coords,qStart,nq,ps,pt,
+                                       stride,dilation,only_full)
+
+        # -- accumulate --
         top,left,btm,right = coords
-        dnls_cuda.ifold_forward(vid, patches, top, left, btm, right,
-                                qStart, stride, dilation, adj, only_full, use_reflect)
+        ifold_forward = backend.get("ifold_forward",vid.device)
+        if bvid.numel() > 0:
+            ifold_forward(bvid, patches, top, left, btm, right,
+                          bstart, stride, dilation, adj, only_full, use_reflect)
+        ctx.mark_dirty(vid)
         ctx.coords = coords
         ctx.qStart = qStart
         ctx.stride = stride
@@ -65,21 +110,27 @@ class iFoldFunction(th.autograd.Function):
         grad_patches = allocate_patches(qNum,1,ps,pt,colors,device)
 
         # -- backward --
-        dnls_cuda.ifold_backward(grad_vid,grad_patches,
-                                 top, left, btm, right,
-                                 qStart,stride,dilation,adj,
-                                 only_full, use_reflect)
-        return grad_patches,None,None,None,None,None,None,None,None
+        ifold_backward = backend.get("ifold_backward",grad_vid.device)
+        ifold_backward(grad_vid,grad_patches,
+                       top, left, btm, right,
+                       qStart,stride,dilation,adj,
+                       only_full, use_reflect)
+        return grad_patches,grad_vid,None,None,None,None,None,None,None
 
 class iFold(th.nn.Module):
     # [patches -> video] @ nlInds [with k == 1]
+    #
+    # use_weights: also accumulates the weight of each pixel in the same
+    # pass and returns (vid,wvid); wvid.shape = [t,1,h,w]
 
     def __init__(self,vid_shape,coords,stride=1,dilation=1,adj=0,
-                 only_full=False,use_reflect=True,device="cuda"):
+                 only_full=False,use_reflect=True,use_weights=False,
+                 device="cuda"):
         super(iFold, self).__init__()
         self.vshape = vid_shape
         self.vid_shape = vid_shape
-        self.vid = self.allocate_vid(vid_shape,device)
+        self.use_weights = use_weights
+        self.vid,self.wvid = self.allocate_vid(vid_shape,device)
         self.stride = stride
         self.dilation = dilation
         self.coords = coords
@@ -91,16 +142,92 @@ class iFold(th.nn.Module):
             self.coords = [0,0,h,w]
 
     def allocate_vid(self,vid_shape,device):
-        vid = th.zeros(vid_shape,device=device,dtype=th.float32)
-        return vid
+        if not(self.use_weights):
+            vid = th.zeros(vid_shape,device=device,dtype=th.float32)
+            return vid,None
+
+        # -- the weights are folded as an extra channel --
+        t,c,h,w = vid_shape
+        self.vwid = th.zeros((t,c+1,h,w),device=device,dtype=th.float32)
+        return self.vwid[:,:c],self.vwid[:,c:]
+
+    def forward(self, patches, qStart, weights=None):
+        """
+        Accumulates "patches" (scaled by the [NumQueries] "weights")
+        into "self.vid" in-place.
+        """
+        if not(weights is None):
+            patches = patches * weights.view(-1,1,1,1,1,1)
+        if not(self.use_weights):
+            self.vid = iFoldFunction.apply(patches, self.vid, self.coords,
+                                           qStart,self.stride,self.dilation,
+                                           self.adj,self.only_full,
+                                           self.use_reflect)
+            return self.vid
+
+        # -- one pass over [patches,weights] --
+        c = self.vid_shape[1]
+        wpatches = weight_channel(patches,weights)
+        self.vwid = iFoldFunction.apply(wpatches, self.vwid, self.coords,
+                                        qStart,self.stride,self.dilation,
+                                        self.adj,self.only_full,
+                                        self.use_reflect)
+        self.vid,self.wvid = self.vwid[:,:c],self.vwid[:,c:]
+        return self.vid,self.wvid
+
+    def norm_map(self, ps, pt=1):
+        """
+        The [t,1,h,w] weights of folding every query with uniform weights
+        """
+        return norm_map(self.vid_shape,self.coords,ps,pt,self.stride,
+                        self.dilation,self.adj,self.only_full,
+                        self.use_reflect,self.vid.device)
+
+def weight_channel(patches,weights=None):
+    """
+    Appends the weight of each patch as an extra channel
+    """
+    nq,k,pt,c,ps,_ = patches.shape
+    if weights is None:
+        wpatches = th.ones_like(patches[:,:,:,:1])
+    else:
+        wpatches = weights.view(-1,1,1,1,1,1).expand(nq,k,pt,1,ps,ps)
+        wpatches = wpatches.type(patches.dtype)
+    return th.cat([patches,wpatches],3)
+
+#
+# -- Normalization Maps --
+#
+
+def norm_map(vid_shape,coords,ps,pt=1,stride=1,dilation=1,adj=0,
+             only_full=False,use_reflect=True,device="cuda"):
+    """
+    The [t,1,h,w] weights of folding every query of "coords" with
+    uniform weights; the map is cached per geometry and shared across
+    calls, so do not modify it in-place.
 
-    def forward(self, patches, qStart):
-        ps = patches.shape[-1]
-        bpatches,qStart = patches,qStart
-        vid = self.allocate_vid(self.vid_shape,patches.device)
-        vid = iFoldFunction.apply(bpatches, vid, self.coords, qStart,
-                                  self.stride,self.dilation,self.adj,
-                                  self.only_full,self.use_reflect)
-        self.vid = self.vid + vid
-        return self.vid
+    The weights only depend on the geometry, so the map is one fold of
+    ones. Without a temporal patch (pt == 1) all frames share the same
+    weights and only one frame is folded.
+    """
+    t,c,h,w = vid_shape
+    if coords is None: coords = [0,0,h,w]
+    return _norm_map((t,h,w),tuple(coords),ps,pt,stride,dilation,adj,
+                     only_full,use_reflect,th.device(device))
+
+@lru_cache(maxsize=8)
+def _norm_map(shape,coords,ps,pt,stride,dilation,adj,only_full,
+              use_reflect,device):
+
+    # -- fold ones over every query --
+    t,h,w = shape
+    nframes = t if pt > 1 else 1
+    n_h,n_w = query_grid(coords,ps,stride,dilation,only_full)
+    ones = th.ones((nframes*n_h*n_w,1,pt,1,ps,ps),device=device)
+    wvid = th.zeros((nframes,1,h,w),device=device)
+    top,left,btm,right = coords
+    ifold_forward = backend.get("ifold_forward",device)
+    ifold_forward(wvid, ones, top, left, btm, right,
+                  0, stride, dilation, adj, only_full, use_reflect)
+    return wvid.expand(t,1,h,w)
 
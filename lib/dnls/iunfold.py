@@ -8,8 +8,8 @@ A gather _without_ a race condition with k == 1
 # -- python --
 import torch as th
 
-# -- cpp cuda kernel --
-import dnls_cuda
+# -- backend dispatch (cuda kernels load lazily) --
+from dnls import backend
 
 
 def allocate_vid(vid_shape,device):
@@ -41,10 +41,11 @@ class iUnfoldFunction(th.autograd.Function):
         device = vid.device
 
         # -- forward --
-        dnls_cuda.iunfold_forward(vid, patches,
-                                  top,left,btm,right,
-                                  start, stride, dilation,
-                                  adj, only_full, use_reflect)
+        iunfold_forward = backend.get("iunfold_forward",vid.device)
+        iunfold_forward(vid, patches,
+                        top,left,btm,right,
+                        start, stride, dilation,
+                        adj, only_full, use_reflect)
 
         # -- store --
         ctx.start = start
@@ -80,10 +81,11 @@ class iUnfoldFunction(th.autograd.Function):
         grad_vid = allocate_vid(vid_shape,grad_patches.device)
 
         # -- forward --
-        dnls_cuda.iunfold_backward(grad_vid,grad_patches,
-                                   top,left,btm,right,
-                                   start,stride,dilation,
-                                   adj,only_full,use_reflect)
+        iunfold_backward = backend.get("iunfold_backward",grad_vid.device)
+        iunfold_backward(grad_vid,grad_patches,
+                         top,left,btm,right,
+                         start,stride,dilation,
+                         adj,only_full,use_reflect)
 
         return None,grad_vid,None,None,None,None,None,None,None,None
 
@@ -0,0 +1,93 @@
+"""
+
+Ahead-of-time compilation of the numba kernels
+
+Every numba kernel is compiled with "cache=True", so a process only
+compiles a specialization once per machine and later processes load it
+from the on-disk cache (the package's __pycache__, or NUMBA_CACHE_DIR
+when that is not writable). "warmup" runs each cpu kernel once on a
+tiny video so the first real batch of a worker does not pay the
+compile (or cache load) latency.
+
+"""
+
+# -- python --
+import time
+
+# -- linalg --
+import torch as th
+
+# -- local --
+from dnls import search,gather,wpsum,simple
+from dnls.utils.inds import get_query_batch
+
+
+def warmup(dtypes=(th.float32,),shapes=((3,3,32,32),),verbose=True):
+    """
+    Compiles the cpu kernels for each video dtype and shape [T,C,H,W].
+
+    Numba specializes on the dtypes and layouts of the arrays, not their
+    sizes, so each shape is cropped to a small video with the same
+    number of channels. Returns {(kernel,dtype,shape): seconds} of the
+    first call of each kernel.
+    """
+    times = {}
+    for dtype in dtypes:
+        for shape in shapes:
+            vid = warmup_video(shape,dtype)
+            for name,run in WARMUPS.items():
+                start = time.perf_counter()
+                run(vid)
+                times[(name,str(dtype),tuple(shape))] = time.perf_counter() - start
+    if verbose: print_times(times)
+    return times
+
+def warmup_video(shape,dtype):
+    t,c,h,w = shape
+    return th.rand((min(t,2),c,min(h,16),min(w,16))).type(dtype)
+
+def print_times(times):
+    total = 0.
+    for (name,dtype,shape),secs in times.items():
+        print("[warmup] %s %s %s: %2.3f sec" % (name,dtype,shape,secs))
+        total += secs
+    print("[warmup] total: %2.3f sec" % total)
+
+#
+# -- Kernels --
+#
+
+def run_search(vid):
+    # -- dilation > 1 skips the box-filtered path --
+    t,c,h,w = vid.shape
+    qinds = get_query_batch(0,8,1,t,h,w,vid.device)
+    for use_stream in [True,False]:
+        vid_g = vid.clone().requires_grad_(True)
+        search_nl = search.SearchNl(None,None,3,3,1,3,1,dilation=2,
+                                    use_stream=use_stream,exact=True)
+        dists,inds = search_nl(vid_g,qinds)
+        th.autograd.backward(dists,th.ones_like(dists))
+
+def run_gather(vid):
+    t,c,h,w = vid.shape
+    inds = th.zeros((8,3,3),dtype=th.int32)
+    patches = th.rand((8,3,1,c,3,3)).type(vid.dtype)
+    dists = th.rand((8,3)).type(vid.dtype)
+    gather_nl = gather.GatherNl(vid.shape,3,0,device="cpu")
+    gather_nl(patches,dists,inds)
+
+def run_wpsum(vid):
+    inds = th.zeros((8,3,3),dtype=th.int32)
+    vid_g = vid.clone().requires_grad_(True)
+    dists = th.rand((8,3)).type(vid.dtype).requires_grad_(True)
+    patches = wpsum.WeightedPatchSum(3)(vid_g,dists,inds)
+    th.autograd.backward(patches,th.ones_like(patches))
+
+def run_simple_gather(vid):
+    patches = th.rand((8,3,1,vid.shape[1],3,3)).type(vid.dtype)
+    dists = th.rand((8,3)).type(vid.dtype)
+    inds = th.zeros((8,3,3),dtype=th.int32)
+    simple.gather.run(patches,dists,inds,shape=vid.shape)
+
+WARMUPS = {"search":run_search,"gather":run_gather,"wpsum":run_wpsum,
+           "simple_gather":run_simple_gather}
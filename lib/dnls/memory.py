@@ -0,0 +1,197 @@
+"""
+
+Memory footprint of the dnls ops
+
+"estimate(op, **params)" predicts the peak bytes an op allocates for
+one batch of "nq" queries: its outputs plus the buffers it allocates
+while running (exhaustive search buffers, top-k temporaries, gradient
+videos, ...). The inputs, already owned by the caller, are not counted.
+
+    bytes = dnls.memory.estimate("search", nq=1024, vshape=(5,3,128,128),
+                                 k=10, ps=7, ws=21, wt=2)
+    bytes["forward"], bytes["backward"]
+
+The estimates follow the cuda kernels, which allocate nothing beyond
+the tensors of the ops. On the cpu the search keeps a running top-k
+instead of the exhaustive buffers and its backward buckets the
+(pair,frame) terms by frame (both are estimated as such). A raster of
+queries with stride 1 (as the pipeline's batches) takes the
+box-filtered search on any device, whose workspace is estimated by
+the engine ("box.search.workspace_bytes"). The workspaces of the other
+cpu engines (index maps, candidate tiles) are not counted.
+
+"""
+
+# -- linalg --
+import torch as th
+
+# -- local --
+from dnls import backend
+from dnls.utils.pads import comp_pads
+
+# -- max elements of the (chunked) exhaustive buffers when streaming --
+from dnls.search import STREAM_NUMEL
+
+# -- the box-filtered search's workspace --
+from dnls.box import search as search_box
+
+# -- bytes of each dtype --
+F32,I32,I64,F64 = 4,4,8,8
+
+
+def estimate(op, **params):
+    """
+    Predicted peak bytes {"forward":..., "backward":...} of "op"
+
+    ops: "search", "xsearch", "scatter", "gather", "wpsum", "ifold", "iunfold"
+
+    params (the missing ones take the ops' defaults):
+      nq = number of queries in the batch
+      vshape = [T,C,H,W] video shape
+      k = number of neighbors
+      ps,pt = patch size in space and time
+      ws,wt = search window in space (-1 is the whole frame) and time
+      use_k = the search returns the top-k (else all candidates)
+      use_stream = the search streams the exhaustive buffers in chunks
+      stride,dilation = of the search
+      stride0 = the stride of a raster (QueryRange) of queries; None
+                for index tensors
+      use_flow = the search follows (non-zero) flows
+      device = the device of the tensors
+      dtype = the dtype of the video
+    """
+    if not(op in ESTIMATES):
+        raise ValueError(f"Uknown op for the memory estimate [{op}]")
+    return ESTIMATES[op](**params)
+
+#
+# -- Shapes --
+#
+
+def vid_bytes(vshape):
+    t,c,h,w = vshape
+    return t*c*h*w * F32
+
+def patch_bytes(nq,k,pt,c,ps):
+    return nq*k*pt*c*ps*ps * F32
+
+def search_window(vshape,ps,ws,stride,dilation):
+    # -- as "SearchNl._get_args" --
+    if ws != -1: return ws,ws
+    _,_,hp,wp = comp_pads(vshape, ps, stride, dilation)
+    n_h = (hp - (ps-1)*dilation - 1)//stride + 1
+    n_w = (wp - (ps-1)*dilation - 1)//stride + 1
+    return n_h,n_w
+
+def has_topk(device):
+    # -- the cuda kernels fill exhaustive buffers --
+    if th.device(device).type == "cuda": return False
+    return backend.has("search_topk",device)
+
+#
+# -- Ops --
+#
+
+def has_box(pt, wt, dilation, stride0, use_flow):
+    # -- as "box.search.is_supported" for a dense raster --
+    if not(stride0 == 1 and pt == 1 and dilation == 1): return False
+    return not(use_flow and wt > 0)
+
+def search(nq, vshape, k=10, ps=7, pt=1, ws=10, wt=0, use_k=True,
+           use_stream=True, stride=1, dilation=1, stride0=None,
+           use_flow=False, device="cuda", dtype=th.float32):
+    cpu = has_topk(device)
+    if not(has_box(pt,wt,dilation,stride0,use_flow)):
+        return search_buffers(nq, vshape, k, ps, pt, ws, wt, use_k,
+                              use_stream, stride, dilation, cpu, cpu)
+
+    # -- the box engine keeps a running top-k on any device --
+    ws_h,ws_w = search_window(vshape,ps,ws,stride,dilation)
+    work = search_box.workspace_bytes(nq,vshape,k,ps,ws_h,ws_w,stride,dtype)
+    return search_buffers(nq, vshape, k, ps, pt, ws, wt, use_k, use_stream,
+                          stride, dilation, True, cpu, work)
+
+def xsearch(nq, vshape, k=10, ps=7, pt=1, ws=10, wt=0, use_k=True,
+            use_stream=True, stride=1, dilation=1, device="cuda", **kwargs):
+    return search_buffers(nq, vshape, k, ps, pt, ws, wt, use_k, use_stream,
+                          stride, dilation, False, False)
+
+def search_buffers(nq, vshape, k, ps, pt, ws, wt, use_k, use_stream,
+                   stride, dilation, running_topk, tiled_bwd, work=0):
+
+    # -- search window --
+    st = 2*wt+1
+    ws_h,ws_w = search_window(vshape,ps,ws,stride,dilation)
+    numel = st * ws_h * ws_w # candidates per query
+
+    # -- the gradients of both videos; the tiled (cpu) backward also
+    # -- buckets the int64 (pair,frame) terms of both videos by frame --
+    bwd = 2*vid_bytes(vshape)
+    npairs = nq * (k if use_k else numel)
+    if tiled_bwd: bwd += npairs * (F32 + I64) + npairs*pt * 7*I64
+
+    # -- int32 queries, searched int64 frames and flow-chained centers (and
+    # -- their int64 copies); a temporal patch reaches "pt-1" frames past
+    # -- the searched ones --
+    nt = min(st,vshape[0]-pt+1)
+    queries = nq*3 * I32
+    centers = nq*nt * I64 + nq*nt*2 * I32
+    chain = nq*3 * I64 + nq*nt*2 * I64
+
+    # -- the top-k of each query; "work" = the engine's own buffers --
+    rtn = nq*k * (F32 + 3*I32)
+
+    # -- exhaustive buffers; all candidates are returned without "use_k" --
+    if not(use_k):
+        exh = nq*numel * (F32 + 3*I32)
+        fwd = queries + centers + max(chain,exh + work)
+        return {"forward":fwd,"backward":bwd}
+
+    # -- running top-k; no exhaustive buffers --
+    if use_stream and running_topk:
+        fwd = queries + centers + max(chain,rtn + work)
+        return {"forward":fwd,"backward":bwd}
+
+    # -- exhaustive buffers of a chunk & th.topk's values and int64 indices --
+    nchunk = nq
+    if use_stream: nchunk = min(nq,max(1,STREAM_NUMEL // (4*numel)))
+    exh = nchunk*numel * (F32 + 3*I32)
+    topk = nchunk*k * (F32 + I64 + 3*I32)
+    fwd = queries + centers + max(chain,exh + max(work,rtn + topk))
+    return {"forward":fwd,"backward":bwd}
+
+def scatter(nq, vshape, k=10, ps=7, pt=1, **kwargs):
+    c = vshape[1]
+    fwd = patch_bytes(nq,k,pt,c,ps)
+    bwd = vid_bytes(vshape)
+    return {"forward":fwd,"backward":bwd}
+
+def gather(nq, vshape, k=10, ps=7, pt=1, **kwargs):
+    # -- accumulates in-place; patches, ones & int32 ones --
+    c = vshape[1]
+    fwd = 0
+    bwd = patch_bytes(nq,k,pt,c,ps) + nq*k * (F32 + I32)
+    return {"forward":fwd,"backward":bwd}
+
+def wpsum(nq, vshape, k=10, ps=7, pt=1, **kwargs):
+    # -- one (weighted) patch per query; grads of the video & dists --
+    c = vshape[1]
+    fwd = patch_bytes(nq,1,pt,c,ps)
+    bwd = vid_bytes(vshape) + nq*k * F32
+    return {"forward":fwd,"backward":bwd}
+
+def ifold(nq, vshape, ps=7, pt=1, **kwargs):
+    # -- accumulates in-place --
+    c = vshape[1]
+    fwd = 0
+    bwd = patch_bytes(nq,1,pt,c,ps)
+    return {"forward":fwd,"backward":bwd}
+
+def iunfold(nq, vshape, ps=7, pt=1, **kwargs):
+    c = vshape[1]
+    fwd = patch_bytes(nq,1,pt,c,ps)
+    bwd = vid_bytes(vshape)
+    return {"forward":fwd,"backward":bwd}
+
+ESTIMATES = {"search":search,"xsearch":xsearch,"scatter":scatter,
+             "gather":gather,"wpsum":wpsum,"ifold":ifold,"iunfold":iunfold}
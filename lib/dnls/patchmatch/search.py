@@ -0,0 +1,305 @@
+"""
+
+PatchMatch engine for SearchNl
+
+An approximate top-k search with a nearly constant cost per query.
+Each query keeps its "k" best candidates, written in search-window
+coordinates (wt_k,ws_i,ws_j) so every candidate stays inside the
+window of the exhaustive search. The candidates are initialized with
+the flow-chained centers and random window locations, then refined by
+
+  - propagation: the matches of the neighboring queries, shifted
+    by the offset between the two queries
+  - random search: samples around each match with a radius that
+    halves down to one window step, plus a few uniform samples
+
+Distances are computed with the vectorized patch gathers of the CPU
+engines, so the engine runs on any device.
+
+"""
+
+# -- linalg --
+import torch as th
+
+# -- local --
+from dnls.cpu.patches import patch_index,gather_patches
+from dnls.utils.flow import search_frames
+
+# -- sizes --
+CAND_NUMEL = 2**24 # max elements of a candidate patch chunk
+NRAND = 8 # uniform samples per query and iteration
+
+
+def search_topk(vid0, vid1, qinds, dists, inds,
+                h0_off, w0_off, h1_off, w1_off,
+                ps, pt, ws_h, ws_w, wt, chnls, dilation, stride,
+                use_adj, reflect_bounds, search_abs,
+                traj, tranges, n_tranges, min_tranges, iters, metric="l2"):
+    """
+    Fills the top-k "dists" and "inds" [NumQueries,K(,3)] in-place
+    after "iters" rounds of propagation and random search.
+
+    traj = [NumQueries,st,2] are the flow-chained window centers
+
+    metric = "l2" (SearchNl) or "prod" (CrossSearchNl)
+    """
+
+    # -- unpack --
+    nq,k = dists.shape
+    device = qinds.device
+    qinds = qinds.long()
+    win = (ws_h,ws_w,stride,search_abs)
+    largest = metric_conf(metric,ps)[2]
+
+    # -- search windows --
+    frames = search_frames(qinds,tranges,n_tranges)
+    centers = traj.long()
+    n_frames = (frames >= 0).sum(1,keepdim=True)
+    st = frames.shape[1]
+
+    # -- anchor patches --
+    ref = anchor_patches(vid0,qinds,ps,pt,chnls,dilation,use_adj,
+                         reflect_bounds,h0_off,w0_off,metric)
+    pargs = (vid1,ref,qinds,ps,pt,chnls,dilation,use_adj,
+             reflect_bounds,h1_off,w1_off,metric)
+
+    # -- init: flow-chained centers & uniform samples --
+    wt_k = th.arange(st,device=device)[None,:,None].expand(nq,st,1)
+    flow_cands = th.cat([wt_k,to_window(centers,centers,win)],-1)
+    rand_cands = uniform_cands(nq,k+NRAND,n_frames,ws_h,ws_w,device)
+    cands = th.cat([flow_cands,rand_cands],1)
+    vals = cand_dists(pargs,window_inds(cands,frames,centers,win))
+    vals,cands = merge(vals,cands,k,win,largest)
+
+    # -- neighboring queries --
+    neighs = neighbor_queries(qinds,vid0.shape)
+
+    for _ in range(iters):
+
+        # -- propagation --
+        vals,cands = propagate(pargs,vals,cands,neighs,frames,centers,
+                               k,win,largest)
+
+        # -- random search --
+        r_cands = [uniform_cands(nq,NRAND,n_frames,ws_h,ws_w,device)]
+        radius = max(ws_h,ws_w)//2
+        while radius >= 1:
+            offs = th.randint(-radius,radius+1,(nq,k,2),device=device)
+            ws_i = (cands[...,1] + offs[...,0]).clamp(0,ws_h-1)
+            ws_j = (cands[...,2] + offs[...,1]).clamp(0,ws_w-1)
+            r_cands.append(th.stack([cands[...,0],ws_i,ws_j],-1))
+            radius = radius // 2
+        r_cands = th.cat(r_cands,1)
+        r_vals = cand_dists(pargs,window_inds(r_cands,frames,centers,win))
+        vals,cands = merge(th.cat([vals,r_vals],1),
+                           th.cat([cands,r_cands],1),k,win,largest)
+
+    # -- fill --
+    dists[...] = vals
+    inds[...] = window_inds(cands,frames,centers,win).int()
+
+def propagate(pargs,vals,cands,neighs,frames,centers,k,win,largest=False):
+    """
+    Merges the matches of each neighboring query, shifted by the offset
+    between the two queries, into the "k" best candidates.
+
+    A neighbor is in the query's frame, so both search the same frames
+    and the neighbor's window frame "wt_k" is kept with its match.
+    """
+    # -- the matches before this round (as "locs") --
+    cands0 = cands
+    locs = window_inds(cands0,frames,centers,win)
+    for nidx,dh,dw in neighs:
+        has_n = (nidx >= 0)[:,None]
+        n_cands = cands0[nidx.clamp(min=0)]
+        n_locs = locs[nidx.clamp(min=0)]
+        shift = th.stack([n_locs[...,1] - dh,n_locs[...,2] - dw],-1)
+        c_centers = centers.gather(1,n_cands[...,:1].expand(-1,-1,2))
+        shift = to_window(shift,c_centers,win)
+        p_cands = th.cat([n_cands[...,:1],shift],-1)
+        p_vals = cand_dists(pargs,window_inds(p_cands,frames,centers,win))
+        p_vals = th.where(has_n,p_vals,th.full_like(p_vals,worst(largest)))
+        vals,cands = merge(th.cat([vals,p_vals],1),
+                           th.cat([cands,p_cands],1),k,win,largest)
+    return vals,cands
+
+def recall(inds,inds_gt):
+    """
+    Fraction of the exact top-k "inds_gt" found in "inds" [NumQueries,K,3]
+    """
+    inds,inds_gt = inds.long(),inds_gt.long()
+    found = (inds_gt[:,:,None] == inds[:,None]).all(-1).any(-1)
+    return found.float().mean().item()
+
+def metric_conf(metric,ps):
+    """
+    The (psHalf,reflect_t,largest) conventions of each search kernel
+    """
+    if metric == "l2": return (ps-1)//2,False,False
+    elif metric == "prod": return ps//2,True,True
+    else: raise ValueError("Unknown metric [%s]" % metric)
+
+def worst(largest):
+    return -float("inf") if largest else float("inf")
+
+def anchor_patches(vid0,qinds,ps,pt,chnls,dilation,use_adj,
+                   reflect_bounds,h0_off,w0_off,metric="l2"):
+    """
+    The flattened anchor patch of each query [NumQueries,D]
+    """
+    psHalf,reflect_t,_ = metric_conf(metric,ps)
+    adj = psHalf if use_adj else 0
+    shift_h = h0_off + dilation*(psHalf - adj)
+    shift_w = w0_off + dilation*(psHalf - adj)
+    index,valid = patch_index(qinds,vid0.shape,ps,pt,dilation,
+                              shift_h,shift_w,reflect_bounds,reflect_t)
+    ref = gather_patches(vid0,index,valid,chnls)
+    return ref.view(qinds.shape[0],-1)
+
+def cand_dists(pargs,locs):
+    """
+    The patch distances [NumQueries,M] of the candidates "locs" [NumQueries,M,3];
+    the worst value when the candidate or the anchor is outside the video.
+    """
+
+    # -- unpack --
+    vid1,ref,qinds,ps,pt,chnls,dilation,use_adj = pargs[:8]
+    reflect_bounds,h1_off,w1_off,metric = pargs[8:]
+    t,c,h,w = vid1.shape
+    nq,m,_ = locs.shape
+    psHalf,reflect_t,largest = metric_conf(metric,ps)
+    adj = psHalf if use_adj else 0
+    shift_h = h1_off + dilation*(psHalf - adj)
+    shift_w = w1_off + dilation*(psHalf - adj)
+
+    # -- chunk the queries --
+    dists = th.zeros((nq,m),device=locs.device,dtype=th.float32)
+    qchunk = max(1,CAND_NUMEL // (m * ref.shape[1]))
+    for q_start in range(0,nq,qchunk):
+        q_end = min(q_start+qchunk,nq)
+        index,valid = patch_index(locs[q_start:q_end],vid1.shape,ps,pt,dilation,
+                                  shift_h,shift_w,reflect_bounds,reflect_t)
+        patches = gather_patches(vid1,index,valid,chnls)
+        patches = patches.view(q_end-q_start,m,-1)
+        if metric == "l2":
+            delta = (ref[q_start:q_end,None] - patches)**2
+        else:
+            delta = ref[q_start:q_end,None] * patches
+        dists[q_start:q_end] = delta.sum(-1)
+
+    # -- valid centers --
+    valid = in_video(locs,vid1.shape) & in_video(qinds,vid1.shape)[:,None]
+    dists = th.where(valid,dists,th.full_like(dists,worst(largest)))
+    return dists
+
+def merge(vals,cands,k,win,largest=False):
+    """
+    Keeps the "k" best distinct candidates of each query
+    """
+
+    # -- pad to "k" candidates --
+    if vals.shape[1] < k:
+        npad = k - vals.shape[1]
+        vals = th.cat([vals,th.full_like(vals[:,:1],worst(largest)).expand(-1,npad)],1)
+        cands = th.cat([cands,cands[:,:1].expand(-1,npad,-1)],1)
+
+    # -- sort by window location --
+    ws_h,ws_w,_,_ = win
+    key = (cands[...,0] * ws_h + cands[...,1]) * ws_w + cands[...,2]
+    key,order = th.sort(key,1)
+    vals = th.gather(vals,1,order)
+    cands = th.gather(cands,1,order[...,None].expand(-1,-1,3))
+
+    # -- drop repeats --
+    repeat = th.zeros_like(key,dtype=th.bool)
+    repeat[:,1:] = key[:,1:] == key[:,:-1]
+    vals = vals.masked_fill(repeat,worst(largest))
+
+    # -- take best --
+    topk = th.topk(vals,k,dim=1,largest=largest,sorted=True)
+    order = topk.indices[...,None].expand(-1,-1,3)
+    return topk.values,th.gather(cands,1,order)
+
+def window_inds(cands,frames,centers,win):
+    """
+    (wt_k,ws_i,ws_j) -> (n_ti,n_hi,n_wi) [NumQueries,M,3]
+    """
+    ws_h,ws_w,stride,search_abs = win
+    wsHalf_h,wsHalf_w = (ws_h-1)//2,(ws_w-1)//2
+    wt_k = cands[...,0]
+    n_ti = frames.gather(1,wt_k)
+    if search_abs:
+        n_hi = stride * cands[...,1]
+        n_wi = stride * cands[...,2]
+    else:
+        n_hi = centers[...,0].gather(1,wt_k) + stride*(cands[...,1] - wsHalf_h)
+        n_wi = centers[...,1].gather(1,wt_k) + stride*(cands[...,2] - wsHalf_w)
+    return th.stack([n_ti,n_hi,n_wi],-1)
+
+def to_window(locs,centers,win):
+    """
+    Nearest window location (ws_i,ws_j) of the pixels "locs" [...,2],
+    given the window centers [...,2] of the same shape.
+    """
+    ws_h,ws_w,stride,search_abs = win
+    wsHalf_h,wsHalf_w = (ws_h-1)//2,(ws_w-1)//2
+    if search_abs:
+        ws_i = th.div(locs[...,0] + stride//2,stride,rounding_mode="floor")
+        ws_j = th.div(locs[...,1] + stride//2,stride,rounding_mode="floor")
+    else:
+        dh = locs[...,0] - centers[...,0] + stride//2
+        dw = locs[...,1] - centers[...,1] + stride//2
+        ws_i = th.div(dh,stride,rounding_mode="floor") + wsHalf_h
+        ws_j = th.div(dw,stride,rounding_mode="floor") + wsHalf_w
+    ws_i = ws_i.clamp(0,ws_h-1)
+    ws_j = ws_j.clamp(0,ws_w-1)
+    return th.stack([ws_i,ws_j],-1)
+
+def uniform_cands(nq,m,n_frames,ws_h,ws_w,device):
+    """
+    Uniform window locations [NumQueries,M,3]
+    """
+    wt_k = (th.rand((nq,m),device=device) * n_frames).long()
+    wt_k = th.minimum(wt_k,n_frames-1)
+    ws_i = th.randint(0,ws_h,(nq,m),device=device)
+    ws_j = th.randint(0,ws_w,(nq,m),device=device)
+    return th.stack([wt_k,ws_i,ws_j],-1)
+
+def neighbor_queries(qinds,vshape):
+    """
+    Returns [(nidx,dh,dw),...]; "nidx" is the index of the query at
+    (ti,hi+dh,wi+dw) or -1. The offsets are one step of the query raster.
+    """
+
+    # -- sorted keys --
+    t,c,h,w = vshape
+    key = (qinds[:,0] * h + qinds[:,1]) * w + qinds[:,2]
+    key,order = th.sort(key)
+
+    # -- raster steps --
+    step_h = raster_step(qinds[:,1])
+    step_w = raster_step(qinds[:,2])
+
+    neighs = []
+    for dh,dw in [(-step_h,0),(step_h,0),(0,-step_w),(0,step_w)]:
+        n_hi = qinds[:,1] + dh
+        n_wi = qinds[:,2] + dw
+        n_key = (qinds[:,0] * h + n_hi) * w + n_wi
+        pos = th.searchsorted(key,n_key).clamp(max=len(key)-1)
+        found = (key[pos] == n_key) & (n_hi >= 0) & (n_hi < h)
+        found = found & (n_wi >= 0) & (n_wi < w)
+        nidx = th.where(found,order[pos],-th.ones_like(pos))
+        neighs.append((nidx,dh,dw))
+    return neighs
+
+def raster_step(vals):
+    vals = th.unique(vals)
+    if len(vals) < 2: return 1
+    return int((vals[1:] - vals[:-1]).min().item())
+
+def in_video(locs,vshape):
+    t,c,h,w = vshape
+    valid = (locs[...,0] >= 0) & (locs[...,0] < t)
+    valid = valid & (locs[...,1] >= 0) & (locs[...,1] < h)
+    valid = valid & (locs[...,2] >= 0) & (locs[...,2] < w)
+    return valid
@@ -0,0 +1,193 @@
+"""
+
+Batched non-local pipeline with a memory budget
+
+Each batch of queries is searched, its neighbors are scattered into
+patches, the user's function maps them to one patch per query and
+the results are folded into the output video, which is normalized by
+the (cached) weights of folding every query. The batch size is the
+largest number of queries whose buffers fit in the memory budget.
+
+With "nthreads" workers the batches run concurrently: worker "r" runs
+batches r, r+nthreads, ... into its own fold, so at most "nthreads"
+batches are in flight and no two workers write the same video. The
+folds are summed once all batches are done. On the cpu, a single
+worker runs when numba's threading layer is "workqueue", which does
+not allow concurrent kernels.
+
+"""
+
+# -- python --
+from concurrent.futures import ThreadPoolExecutor
+
+# -- linalg --
+import torch as th
+
+# -- local --
+from dnls import memory,backend,workspace
+from dnls.search import SearchNl
+from dnls.scatter import ScatterNl
+from dnls.ifold import iFold
+from dnls.utils.inds import QueryRange
+from dnls.utils.flow import cached_zero_flow
+
+
+class NonLocalPipeline():
+    """
+    Runs "fxn(patches,dists)" over the non-local patches of a video.
+
+    patches = [NumQueries,K,pt,c,ps,ps] neighbors of each query
+    dists = [NumQueries,K] their distances
+    fxn returns [NumQueries,1,pt,c,ps,ps]
+
+    mem_budget = bytes available for the folds and the in-flight batches
+    batch_size = overrides the batch chosen from the budget
+    coords = [top,left,btm,right] region of the queries (default: all)
+    nthreads = worker threads running batches concurrently; "fxn" must
+               be thread-safe when nthreads > 1
+    """
+
+    def __init__(self, fxn, mem_budget, k=10, ps=7, pt=1, ws=10, wt=0,
+                 chnls=-1, stride0=1, stride1=1, dilation=1, coords=None,
+                 fflow=None, bflow=None, use_stream=True, batch_size=None,
+                 nthreads=1):
+        self.fxn = fxn
+        self.mem_budget = mem_budget
+        self.k = k
+        self.ps = ps
+        self.pt = pt
+        self.stride0 = stride0
+        self.dilation = dilation
+        self.coords = coords
+        self.batch_size = batch_size
+        self.nthreads = max(nthreads,1)
+        self.search = SearchNl(fflow, bflow, k, ps, pt, ws, wt, chnls=chnls,
+                               dilation=dilation, stride=stride1,
+                               use_stream=use_stream)
+        self.scatter = ScatterNl(ps,pt,dilation=dilation)
+
+    def _get_coords(self,vshape):
+        if not(self.coords is None): return list(self.coords)
+        t,c,h,w = vshape
+        return [0,0,h,w]
+
+    def num_queries(self,vshape):
+        t,c,h,w = vshape
+        coords = self._get_coords(vshape)
+        n_h,n_w = QueryRange(0,0,self.stride0,coords,t).grid
+        return t * n_h * n_w
+
+    def num_workers(self,device):
+        """
+        The worker threads on "device"; one when its kernels may not
+        run concurrently
+        """
+        if self.nthreads == 1: return 1
+        if th.device(device).type == "cpu" and not(backend.concurrent_cpu()):
+            return 1
+        return self.nthreads
+
+    def fixed_memory(self,vshape,device):
+        """
+        Bytes of each worker's fold and the weights, independent of the
+        batch size
+        """
+        t,c,h,w = vshape
+        nbytes = self.num_workers(device) * memory.vid_bytes(vshape)
+        return nbytes + memory.vid_bytes((t,1,h,w))
+
+    def batch_memory(self,vshape,nq,device,dtype=th.float32):
+        """
+        Bytes of the buffers of one batch of "nq" queries of a video
+        of "dtype"
+        """
+
+        # -- search & neighbor patches --
+        ws_h,ws_w,wt,k,chnls = self.search._get_args(vshape)
+        use_flow = not(cached_zero_flow(self.search))
+        params = {"nq":nq,"vshape":vshape,"k":k,"ps":self.ps,"pt":self.pt,
+                  "ws":self.search.ws,"wt":wt,"use_stream":self.search.use_stream,
+                  "stride":self.search.stride,"dilation":self.dilation,
+                  "stride0":self.stride0,"use_flow":use_flow,"device":device,
+                  "dtype":dtype}
+        nbytes = memory.estimate("search",**params)["forward"]
+        nbytes += memory.estimate("scatter",**params)["forward"]
+
+        # -- the output patches --
+        nbytes += memory.patch_bytes(nq,1,self.pt,vshape[1],self.ps)
+        return nbytes
+
+    def get_batch_size(self,vshape,device,dtype=th.float32):
+        """
+        The largest batch of queries fitting in the memory budget,
+        with one batch in flight per worker
+        """
+        nq = self.num_queries(vshape)
+        if not(self.batch_size is None): return min(self.batch_size,nq)
+        nworkers = self.num_workers(device)
+        budget = self.mem_budget - self.fixed_memory(vshape,device)
+        budget = budget // nworkers
+        if budget < self.batch_memory(vshape,1,device,dtype):
+            msg = "Memory budget of %d bytes is too small for one query."
+            raise ValueError(msg % self.mem_budget)
+
+        # -- the memory grows with the batch; bisect --
+        lo,hi = 1,nq
+        while lo < hi:
+            mid = (lo + hi + 1)//2
+            if self.batch_memory(vshape,mid,device,dtype) <= budget: lo = mid
+            else: hi = mid - 1
+        return lo
+
+    def __call__(self, vid):
+        """
+        The normalized fold of "fxn" over every query; runs without grad.
+        """
+
+        # -- unpack --
+        t,c,h,w = vid.shape
+        device = vid.device
+        coords = self._get_coords(vid.shape)
+        nq = self.num_queries(vid.shape)
+        batch_size = self.get_batch_size(vid.shape,device,vid.dtype)
+        nworkers = self.num_workers(device)
+
+        # -- one fold per worker --
+        folds = [iFold(vid.shape,coords,stride=self.stride0,
+                       dilation=self.dilation,device=device)
+                 for _ in range(nworkers)]
+
+        # -- worker "rank" runs every nworkers-th batch --
+        starts = list(range(0,nq,batch_size))
+        def run_batches(rank):
+            try:
+                with th.no_grad(): # grad mode is thread-local
+                    for index in starts[rank::nworkers]:
+                        nbatch = min(batch_size,nq-index)
+                        queries = QueryRange(index,nbatch,self.stride0,
+                                             coords,t)
+                        dists,inds = self.search(vid,queries)
+                        patches = self.scatter(vid,inds)
+                        patches = self.fxn(patches,dists)
+                        folds[rank](patches,index)
+            finally:
+                # -- the thread's scratch buffers outlive no batch --
+                workspace.clear()
+
+        # -- batches --
+        if nworkers == 1:
+            run_batches(0)
+        else:
+            with ThreadPoolExecutor(nworkers) as pool:
+                workers = [pool.submit(run_batches,rank)
+                           for rank in range(nworkers)]
+                for worker in workers: worker.result()
+
+        # -- reduce; in rank order --
+        with th.no_grad():
+            vid_fold = folds[0].vid
+            for fold_nl in folds[1:]: vid_fold += fold_nl.vid
+
+        # -- normalize; every query is folded with the same weight --
+        weights = folds[0].norm_map(self.ps,self.pt)
+        return vid_fold / th.where(weights > 0,weights,th.ones_like(weights))
@@ -0,0 +1,183 @@
+"""
+
+Coarse-to-fine (pyramid) engine for SearchNl and CrossSearchNl
+
+The videos and flows are halved in size "levels" times. The
+coarsest level scans its whole (small) search window; each finer
+level upsamples the best "NSEED*k" of the level above into seeds and
+only scans a "ws_r x ws_r" window around each seed.
+
+Candidates are written in search-window coordinates (wt_k,ws_i,ws_j)
+as in the PatchMatch engine. At every level the windows are centered
+on the flow-chained centers of that level's (downsampled) flows, and
+the finest level uses the search window of the exhaustive search.
+
+"""
+
+# -- linalg --
+import math
+import torch as th
+import torch.nn.functional as nnf
+
+# -- local --
+from dnls.utils.flow import chain_centers
+from dnls.patchmatch.search import anchor_patches,cand_dists,merge
+from dnls.patchmatch.search import window_inds,metric_conf
+
+# -- sizes --
+CAND_NUMEL = 2**24 # max elements of the coarse-scan candidates
+NSEED = 2 # seeds per neighbor kept at the coarser levels
+
+
+def search_topk(vid0, vid1, qinds, fflow, bflow, dists, inds,
+                h0_off, w0_off, h1_off, w1_off,
+                ps, pt, ws_h, ws_w, wt, chnls, dilation, stride,
+                use_adj, reflect_bounds, search_abs,
+                tranges, n_tranges, min_tranges, levels, ws_r, metric="l2"):
+    """
+    Fills the top-k "dists" and "inds" [NumQueries,K(,3)] in-place.
+
+    metric = "l2" (SearchNl) or "prod" (CrossSearchNl)
+    """
+
+    # -- unpack --
+    nq,k = dists.shape
+    t,c,h,w = vid0.shape
+    qinds = qinds.long()
+    largest = metric_conf(metric,ps)[2]
+
+    # -- keep a patch inside the coarsest frame --
+    levels = max(0,min(levels,int(math.log2(max(1,min(h,w)//ps)))))
+
+    # -- given flows are chained; the caller decided zero flow --
+    zero_flow = fflow is None and bflow is None
+
+    # -- pyramids --
+    vids0 = pyramid(vid0,levels)
+    vids1 = vids0 if vid1 is vid0 else pyramid(vid1,levels)
+    fflows = pyramid(fflow,levels,True)
+    bflows = pyramid(bflow,levels,True)
+    sizes = [v.shape[-2:] for v in vids0]
+
+    win_p,cands = None,None
+    for level in reversed(range(levels+1)):
+
+        # -- level's queries & windows --
+        scale = 2**level
+        q_l = qinds.clone()
+        q_l[:,1:] = th.div(q_l[:,1:],scale,rounding_mode="floor")
+        win = level_window(ws_h,ws_w,stride,search_abs,level)
+        frames,centers = chain_centers(q_l,fflows[level],bflows[level],
+                                       tranges,n_tranges,min_tranges,
+                                       sizes[level],zero_flow)
+        centers = centers.long()
+
+        # -- level's patches --
+        ref = anchor_patches(vids0[level],q_l,ps,pt,chnls,dilation,use_adj,
+                             reflect_bounds,h0_off//scale,w0_off//scale,metric)
+        pargs = (vids1[level],ref,q_l,ps,pt,chnls,dilation,use_adj,
+                 reflect_bounds,h1_off//scale,w1_off//scale,metric)
+
+        # -- scan the coarsest window --
+        nkeep = k if level == 0 else NSEED*k
+        if cands is None:
+            vals,cands = scan_window(pargs,frames,centers,win,nkeep,largest)
+            win_p = win
+            continue
+
+        # -- refine around the upsampled seeds --
+        seeds = upsample_cands(cands,win_p,win)
+        r_cands = refine_cands(seeds,ws_r,win)
+        vals = cand_dists(pargs,window_inds(r_cands,frames,centers,win))
+        vals,cands = merge(vals,r_cands,nkeep,win,largest)
+        win_p = win
+
+    # -- fill --
+    dists[...] = vals
+    inds[...] = window_inds(cands,frames,centers,win).int()
+
+def pyramid(vid,levels,is_flow=False):
+    """
+    [vid, vid/2, ..., vid/2^levels]; flows are also scaled by 1/2
+
+    A missing (zero) flow stays None at every level.
+    """
+    if vid is None: return [None]*(levels+1)
+    vids = [vid]
+    for level in range(levels):
+        vid = nnf.avg_pool2d(vid,2,ceil_mode=True)
+        if is_flow: vid = vid/2.
+        vids.append(vid)
+    return vids
+
+def level_window(ws_h,ws_w,stride,search_abs,level):
+    """
+    The search window of a level; each window step is "2^level"
+    steps of the full-resolution window.
+    """
+    scale = 2**level
+    if search_abs:
+        ws_h = (ws_h-1)//scale+1
+        ws_w = (ws_w-1)//scale+1
+    else:
+        ws_h = level_size(ws_h,scale)
+        ws_w = level_size(ws_w,scale)
+    return (ws_h,ws_w,stride,search_abs)
+
+def level_size(ws,scale):
+    # -- ceil of each side of the window --
+    lo,hi = (ws-1)//2,ws//2
+    lo,hi = (lo-1)//scale+1,(hi-1)//scale+1
+    return lo + hi + 1
+
+def upsample_cands(cands,win_p,win):
+    """
+    Window locations of the coarser level -> locations of this level
+    """
+    ws_h,ws_w,_,search_abs = win
+    ws_h_p,ws_w_p,_,_ = win_p
+    half_h,half_w = ((ws_h-1)//2,(ws_w-1)//2) if not(search_abs) else (0,0)
+    half_h_p,half_w_p = ((ws_h_p-1)//2,(ws_w_p-1)//2) if not(search_abs) else (0,0)
+    ws_i = (half_h + 2*(cands[...,1] - half_h_p)).clamp(0,ws_h-1)
+    ws_j = (half_w + 2*(cands[...,2] - half_w_p)).clamp(0,ws_w-1)
+    return th.stack([cands[...,0],ws_i,ws_j],-1)
+
+def refine_cands(seeds,ws_r,win):
+    """
+    The "ws_r x ws_r" window locations around each seed [NumQueries,K*ws_r^2,3]
+    """
+    ws_h,ws_w,_,_ = win
+    nq,k,_ = seeds.shape
+    offs = th.arange(ws_r,device=seeds.device) - (ws_r-1)//2
+    off_i,off_j = th.meshgrid(offs,offs,indexing="ij")
+    ws_i = (seeds[...,1,None] + off_i.reshape(1,1,-1)).clamp(0,ws_h-1)
+    ws_j = (seeds[...,2,None] + off_j.reshape(1,1,-1)).clamp(0,ws_w-1)
+    wt_k = seeds[...,0,None].expand_as(ws_i)
+    cands = th.stack([wt_k,ws_i,ws_j],-1)
+    return cands.view(nq,-1,3)
+
+def scan_window(pargs,frames,centers,win,k,largest):
+    """
+    The top-k of every location of the window, scanned in chunks
+    """
+
+    # -- all window locations --
+    ws_h,ws_w,_,_ = win
+    nq,st = frames.shape
+    device = frames.device
+    grid = th.stack(th.meshgrid(th.arange(st,device=device),
+                                th.arange(ws_h,device=device),
+                                th.arange(ws_w,device=device),
+                                indexing="ij"),-1).view(-1,3)
+
+    # -- running top-k --
+    vals,cands = None,None
+    nchunk = max(k,CAND_NUMEL // (4 * nq))
+    for start in range(0,grid.shape[0],nchunk):
+        c_cands = grid[None,start:start+nchunk].expand(nq,-1,-1)
+        c_vals = cand_dists(pargs,window_inds(c_cands,frames,centers,win))
+        if not(vals is None):
+            c_vals = th.cat([vals,c_vals],1)
+            c_cands = th.cat([cands,c_cands],1)
+        vals,cands = merge(c_vals,c_cands,k,win,largest)
+    return vals,cands
@@ -2,8 +2,8 @@
 # -- python --
 import torch as th
 
-# -- cpp cuda kernel --
-import dnls_cuda
+# -- backend dispatch (cuda kernels load lazily) --
+from dnls import backend
 
 
 def allocate_vid(vid_shape,device):
@@ -11,9 +11,10 @@ def allocate_vid(vid_shape,device):
     return vid
 
 def allocate_patches(nlInds,ps,pt,c):
+    # -- uninitialized; the kernels write every pixel (zero when invalid) --
     device = nlInds.device
     nq,k = nlInds.shape[:2]
-    patches = th.zeros((nq,k,pt,c,ps,ps),device=device,dtype=th.float32)
+    patches = th.empty((nq,k,pt,c,ps,ps),device=device,dtype=th.float32)
     return patches
 
 
@@ -30,7 +31,8 @@ class ScatterNlFunction(th.autograd.Function):
         pt = patchsize_time (forward only)
         """
         patches = allocate_patches(nlInds,ps,pt,vid.shape[1])
-        dnls_cuda.scatter_forward(vid, patches, nlInds, dilation, adj, reflect_bounds)
+        scatter_forward = backend.get("scatter_forward",vid.device)
+        scatter_forward(vid, patches, nlInds, dilation, adj, reflect_bounds)
         # print("nlInds.shape: ",nlInds.shape)
         ctx.save_for_backward(nlInds)
         ctx.ps,ctx.pt = ps,pt
@@ -55,11 +57,13 @@ class ScatterNlFunction(th.autograd.Function):
         grad_vid = allocate_vid(vid_shape,grad_patches.device)
         grad_patches = grad_patches.contiguous()
         if btype in "default" or btype in "simple":
-            dnls_cuda.scatter_backward(grad_vid,grad_patches,nlInds,
-                                              dilation,exact,adj,reflect_bounds)
+            scatter_backward = backend.get("scatter_backward",grad_vid.device)
+            scatter_backward(grad_vid,grad_patches,nlInds,
+                                    dilation,exact,adj,reflect_bounds)
         elif btype in "efficient":
-            dnls_cuda.scatter_backward_eff(grad_vid,grad_patches,nlInds,
-                                           dilation,exact,adj,reflect_bounds)
+            scatter_backward_eff = backend.get("scatter_backward_eff",grad_vid.device)
+            scatter_backward_eff(grad_vid,grad_patches,nlInds,
+                                 dilation,exact,adj,reflect_bounds)
         else:
             raise ValueError(f"Uknown backward type for scatter [{btype}]")
         return grad_vid,None,None,None,None,None,None,None,None
@@ -6,81 +6,134 @@ import numpy as np
 # -- padding --
 from dnls.utils.pads import comp_pads
 
-# -- cpp cuda kernel --
-import dnls_cuda
+# -- topk --
+from dnls.utils.topk import get_topk
 
+# -- flow-chained search centers --
+from dnls.utils.flow import chain_centers,is_zero_flow,cached_zero_flow
 
-def get_topk(l2_vals,l2_inds,vals,inds):
+# -- raster query ranges --
+from dnls.utils.inds import get_query_inds
 
-    # -- reshape exh --
-    nq,st,ws,ws = l2_vals.shape
-    l2_vals = l2_vals.view(nq,-1)
-    l2_inds = l2_inds.view(nq,-1,3)
+# -- temporal search plans --
+from dnls.utils.tranges import create_frame_range
 
-    # -- shape info --
-    b,_ = l2_vals.shape
-    _,k = vals.shape
+# -- backend dispatch (cuda kernels load lazily) --
+from dnls import backend
 
-    # -- take mins --
-    order = th.argsort(l2_vals,dim=1,descending=False)
-    vals[:b,:] = th.gather(l2_vals,1,order[:,:k])
-    for i in range(inds.shape[-1]):
-        inds[:b,:,i] = th.gather(l2_inds[:,:,i],1,order[:,:k])
+# -- reused scratch buffers --
+from dnls import workspace
+
+# -- box-filtered kernel (dense, zero-flow, pt = 1) --
+from dnls.box import search as search_box
+
+# -- approximate kernels --
+from dnls.patchmatch import search as search_pm
+from dnls.pyramid import search as search_pyr
+
+# -- max elements of the (chunked) exhaustive buffers when streaming --
+STREAM_NUMEL = 2**24
 
 def allocate_vid(vid_shape,device):
     vid = th.zeros(vid_shape,device=device,dtype=th.float32)
     return vid
 
-def allocate_bufs(nq,t,ws_h,ws_w,device):
-    bufs = th.zeros(nq,3,t,ws_h,ws_w,dtype=th.int32,device=device)
-    return bufs
+def allocate_exh(nq,wt,ws_h,ws_w,device,pool=False):
+    # -- scratch buffers (that do not escape the call) come from the pool --
+    shape = (nq,2*wt+1,ws_h,ws_w)
+    if pool:
+        dists = workspace.get_buffer("search_dists_exh",shape,th.float32,
+                                     device,fill=float("inf"))
+        inds = workspace.get_buffer("search_inds_exh",shape+(3,),th.int32,
+                                    device,fill=-1)
+        return dists,inds
+    dists = th.full(shape,float("inf"),device=device,dtype=th.float32)
+    inds = th.full(shape+(3,),-1,device=device,dtype=th.int32)
+    return dists,inds
 
-def allocate_exh(nq,wt,ws_h,ws_w,device):
-    dists = th.zeros((nq,2*wt+1,ws_h,ws_w),device=device,dtype=th.float32)
-    dists[...] = float("inf")
-    inds = th.zeros((nq,2*wt+1,ws_h,ws_w,3),device=device,dtype=th.int32)
-    inds[...] = -1
+def allocate_rtn(nq,k,device,init=True):
+    # -- "init=False" when the caller overwrites every entry --
+    alloc = th.zeros if init else th.empty
+    dists = alloc((nq,k),device=device,dtype=th.float32)
+    inds = alloc((nq,k,3),device=device,dtype=th.int32)
     return dists,inds
 
-def allocate_rtn(nq,k,device):
-    dists = th.zeros((nq,k),device=device,dtype=th.float32)
-    inds = th.zeros((nq,k,3),device=device,dtype=th.int32)
+def search_exh(search_fwd, vid0, vid1, qinds, traj,
+               h0_off, w0_off, h1_off, w1_off,
+               k, ps, pt, ws_h, ws_w, wt, chnls,
+               dilation, stride, use_k, use_adj, reflect_bounds, search_abs,
+               tranges, n_tranges, min_tranges):
+
+    # -- allocs --
+    device = qinds.device
+    nq = qinds.shape[0]
+    dists_exh,inds_exh = allocate_exh(nq,wt,ws_h,ws_w,device,pool=use_k)
+
+    # -- forward --
+    search_fwd(vid0, vid1, qinds, dists_exh, inds_exh,
+               h0_off, w0_off, h1_off, w1_off,
+               ps, pt, ws_h, ws_w,
+               wt, chnls, dilation, stride, use_adj,
+               reflect_bounds, search_abs, traj, tranges,
+               n_tranges, min_tranges)
+    # -- topk --
+    if use_k:
+        dists,inds = allocate_rtn(nq,k,device,init=False)
+        get_topk(dists_exh,inds_exh,dists,inds)
+    else:
+        b = dists_exh.shape[0]
+        dists=dists_exh.view(b,-1)
+        inds=inds_exh.view(b,-1,3)
     return dists,inds
 
-def create_frame_range(nframes,nWt_f,nWt_b,ps_t,device):
-    tranges,n_tranges,min_tranges = [],[],[]
-    for t_c in range(nframes-ps_t+1):
-
-        # -- limits --
-        shift_t = min(0,t_c - nWt_b) + max(0,t_c + nWt_f - nframes + ps_t)
-        t_start = max(t_c - nWt_b - shift_t,0)
-        t_end = min(nframes - ps_t, t_c + nWt_f - shift_t)+1
-
-        # -- final range --
-        trange = [t_c]
-        trange_s = np.arange(t_c+1,t_end)
-        trange_e = np.arange(t_start,t_c)[::-1]
-        for t_i in range(trange_s.shape[0]):
-            trange.append(trange_s[t_i])
-        for t_i in range(trange_e.shape[0]):
-            trange.append(trange_e[t_i])
-
-        # -- aug vars --
-        n_tranges.append(len(trange))
-        min_tranges.append(np.min(trange))
-
-        # -- add padding --
-        for pad in range(nframes-len(trange)):
-            trange.append(-1)
-
-        # -- to tensor --
-        trange = th.IntTensor(trange).to(device)
-        tranges.append(trange)
-
-    tranges = th.stack(tranges).to(device).type(th.int32)
-    n_tranges = th.IntTensor(n_tranges).to(device).type(th.int32)
-    min_tranges = th.IntTensor(min_tranges).to(device).type(th.int32)
-    return tranges,n_tranges,min_tranges
+def search_stream(search_fwd, search_topk, vid0, vid1, qinds, traj,
+                  h0_off, w0_off, h1_off, w1_off,
+                  k, ps, pt, ws_h, ws_w, wt, chnls,
+                  dilation, stride, use_adj, reflect_bounds, search_abs,
+                  tranges, n_tranges, min_tranges, early_stop=True):
+    """
+    Top-k search without the exhaustive buffers of the whole batch.
+
+    Engines with a "search_topk" (the cpu k-heap per query, the box
+    engine's running top-k over window rows) fill the top-k directly.
+    Otherwise (cuda) "search_fwd" fills the exhaustive buffers for one
+    chunk of queries at a time, so the peak memory is "STREAM_NUMEL"
+    elements plus the (nq,k) outputs; the chunk buffers are reused
+    from the workspace pool across chunks and calls.
+
+    With "early_stop", the cpu heap abandons a candidate once its partial
+    distance reaches the current k-th distance; the top-k is unchanged.
+    """
+
+    # -- unpack --
+    device = qinds.device
+    nq = qinds.shape[0]
+    dists,inds = allocate_rtn(nq,k,device,init=False)
+
+    # -- cpu heap / box rows --
+    if not(search_topk is None):
+        search_topk(vid0, vid1, qinds, dists, inds,
+                    h0_off, w0_off, h1_off, w1_off,
+                    ps, pt, ws_h, ws_w, wt, chnls, dilation, stride,
+                    use_adj, reflect_bounds, search_abs,
+                    traj, tranges, n_tranges, min_tranges, early_stop)
+        return dists,inds
+
+    # -- chunks of queries --
+    numel = ws_h * ws_w * 4*(2*wt+1)
+    nchunk = max(1,STREAM_NUMEL // numel)
+    for start in range(0,nq,nchunk):
+        end = min(start+nchunk,nq)
+        dists_exh,inds_exh = allocate_exh(end-start,wt,ws_h,ws_w,device,True)
+        search_fwd(vid0, vid1, qinds[start:end],
+                   dists_exh, inds_exh,
+                   h0_off, w0_off, h1_off, w1_off,
+                   ps, pt, ws_h, ws_w,
+                   wt, chnls, dilation, stride, use_adj,
+                   reflect_bounds, search_abs, traj[start:end],
+                   tranges, n_tranges, min_tranges)
+        get_topk(dists_exh,inds_exh,dists[start:end],inds[start:end])
+    return dists,inds
 
 class SearchNlFunction(th.autograd.Function):
 
@@ -89,46 +142,89 @@ class SearchNlFunction(th.autograd.Function):
                 h0_off, w0_off, h1_off, w1_off,
                 k, ps, pt, ws_h, ws_w, wt, chnls,
                 dilation=1,stride=1,use_k=True,use_adj=True,
-                reflect_bounds=True,search_abs=False,exact=False):
+                reflect_bounds=True,search_abs=False,exact=False,
+                use_stream=True,mode="exh",iters=4,levels=2,ws_r=5,
+                early_stop=True,zero_flow=None):
         """
         vid0 = [T,C,H,W]
-        qinds = [NumQueries,K,3]
+        qinds = [NumQueries,3] or a QueryRange/(start,num,stride,coords)
         ws = search Window Spatial (ws)
         wt = search Window Time (wt)
+        mode = "exh" (exhaustive), "patchmatch" or "pyramid" (approximate)
+
+        fflow = bflow = None searches with zero flow; the flow-chained
+        centers [NumQueries,2*wt+1,2] are computed once per query.
+        zero_flow = SearchNl's cached "is_zero_flow"; scanned when None
         """
 
-        # -- unpack --
+        # -- zero flow is searched as "None" flows --
+        if zero_flow is None:
+            zero_flow = is_zero_flow(fflow,bflow)
+        if zero_flow:
+            fflow,bflow = None,None
+
+        # -- unpack; a raster range is expanded on the video's device --
+        t,c,h,w = vid0.shape
+        queries = qinds
+        qinds = get_query_inds(qinds,t,vid0.device)
         device = qinds.device
         nq = qinds.shape[0]
-        t,c,h,w = vid0.shape
-        qinds = qinds.type(th.int32)
-
-        # -- allocs --
-        bufs = allocate_bufs(nq,t,ws_h,ws_w,device)
-        dists_exh,inds_exh = allocate_exh(nq,wt,ws_h,ws_w,device)
 
         # -- pre-computed search offsets --
         tranges,n_tranges,min_tranges = create_frame_range(t,wt,wt,pt,device)
 
-        # -- forward --
-        dnls_cuda.search_forward(vid0, vid1, qinds, fflow, bflow,
-                                 dists_exh, inds_exh,
-                                 h0_off, w0_off, h1_off, w1_off,
-                                 ps, pt, ws_h, ws_w,
-                                 wt, chnls, dilation, stride, use_adj,
-                                 reflect_bounds, search_abs, bufs, tranges,
-                                 n_tranges, min_tranges)
-        # -- topk --
-        if use_k:
+        # -- engines of the device --
+        search_fwd = backend.get("search_forward",device)
+        search_topk = backend.lookup("search_topk",device)
+
+        # -- box-filtered fast path; decided from the raster, no syncs --
+        use_box = mode == "exh" and search_box.is_supported(
+            vid0, queries, fflow, bflow, ps, pt, ws_h, ws_w, wt, dilation,
+            stride, use_adj, reflect_bounds, search_abs,
+            h0_off, w0_off, h1_off, w1_off, zero_flow)
+        if use_box:
+            search_fwd = search_box.search_forward
+            search_topk = search_box.search_topk
+
+        # -- flow-chained centers (the pyramid chains each level) --
+        if mode != "pyramid":
+            _,traj = chain_centers(qinds, fflow, bflow, tranges,
+                                   n_tranges, min_tranges, (h,w), zero_flow)
+
+        # -- top-k without the exhaustive buffers --
+        if mode == "patchmatch":
+            assert use_k,"PatchMatch only returns the top-k."
             dists,inds = allocate_rtn(nq,k,device)
-            get_topk(dists_exh,inds_exh,dists,inds)
-            # dists[:,0] = 0. # fix the "-100" hack to 0.
+            search_pm.search_topk(vid0, vid1, qinds, dists, inds,
+                                  h0_off, w0_off, h1_off, w1_off,
+                                  ps, pt, ws_h, ws_w, wt, chnls, dilation,
+                                  stride, use_adj, reflect_bounds, search_abs,
+                                  traj, tranges, n_tranges, min_tranges, iters)
+        elif mode == "pyramid":
+            assert use_k,"The pyramid search only returns the top-k."
+            dists,inds = allocate_rtn(nq,k,device)
+            search_pyr.search_topk(vid0, vid1, qinds, fflow, bflow, dists, inds,
+                                   h0_off, w0_off, h1_off, w1_off,
+                                   ps, pt, ws_h, ws_w, wt, chnls, dilation,
+                                   stride, use_adj, reflect_bounds, search_abs,
+                                   tranges, n_tranges, min_tranges,
+                                   levels, ws_r)
+        elif use_k and use_stream:
+            dists,inds = search_stream(search_fwd, search_topk,
+                                       vid0, vid1, qinds, traj,
+                                       h0_off, w0_off, h1_off, w1_off,
+                                       k, ps, pt, ws_h, ws_w, wt, chnls,
+                                       dilation, stride, use_adj,
+                                       reflect_bounds, search_abs,
+                                       tranges, n_tranges, min_tranges,
+                                       early_stop)
         else:
-            # args = th.where(dists_exh<0)
-            # dists_exh[args] = 0. # fix the "-100" hack to 0.
-            b = dists_exh.shape[0]
-            dists=dists_exh.view(b,-1)#.contiguous()
-            inds=inds_exh.view(b,-1,3)#.contiguous()
+            dists,inds = search_exh(search_fwd, vid0, vid1, qinds, traj,
+                                    h0_off, w0_off, h1_off, w1_off,
+                                    k, ps, pt, ws_h, ws_w, wt, chnls,
+                                    dilation, stride, use_k, use_adj,
+                                    reflect_bounds, search_abs,
+                                    tranges, n_tranges, min_tranges)
 
         # -- for backward --
         ctx.save_for_backward(qinds,inds,vid0,vid1)
@@ -152,15 +248,16 @@ class SearchNlFunction(th.autograd.Function):
         h1_off, w1_off = ctx.h1_off,ctx.w1_off
         grad_vid0 = allocate_vid(vid_shape,grad_dists.device)
         grad_vid1 = allocate_vid(vid_shape,grad_dists.device)
-        dnls_cuda.search_backward(grad_vid0,grad_vid1,vid0,vid1,
-                                  grad_dists,inds,qinds,
-                                  h0_off, w0_off, h1_off, w1_off,
-                                  ps,pt,dil, use_adj,reflect_bounds,exact)
-        th.cuda.synchronize()
+        search_bwd = backend.get("search_backward",vid0.device)
+        search_bwd(grad_vid0,grad_vid1,vid0,vid1,
+                   grad_dists,inds,qinds,
+                   h0_off, w0_off, h1_off, w1_off,
+                   ps,pt,dil, use_adj,reflect_bounds,exact)
+        if vid0.is_cuda: th.cuda.synchronize()
 
         return grad_vid0,grad_vid1,None,None,None,\
             None,None,None,None,None,None,None,None,None,\
-            None,None,None,None,None,None,None,None,None
+            None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None
 
 class SearchNl(th.nn.Module):
 
@@ -168,7 +265,8 @@ class SearchNl(th.nn.Module):
                  dilation=1, stride=1,
                  use_k=True, use_adj=True, reflect_bounds=True,
                  search_abs=False, exact=False,
-                 h0_off=0,w0_off=0,h1_off=0,w1_off=0):
+                 h0_off=0,w0_off=0,h1_off=0,w1_off=0,use_stream=True,
+                 mode="exh",iters=4,levels=2,ws_r=5,early_stop=True):
         super(SearchNl, self).__init__()
         self.k = k
         self.ps = ps
@@ -187,6 +285,12 @@ class SearchNl(th.nn.Module):
         self.use_adj = use_adj
         self.use_k = use_k
         self.exact = exact
+        self.use_stream = use_stream
+        self.mode = mode
+        self.iters = iters
+        self.levels = levels
+        self.ws_r = ws_r
+        self.early_stop = early_stop
         self.reflect_bounds = reflect_bounds
         self.search_abs = search_abs
 
@@ -207,17 +311,18 @@ class SearchNl(th.nn.Module):
         return ws_h,ws_w,wt,k,chnls
 
     def _update_flow(self,vshape,device):
-        t,c,h,w = vshape
-        zflow = th.ones((t,2,h,w),device=device)
-        if self.fflow is None: self.fflow = zflow
-        if self.bflow is None: self.bflow = zflow
-        for i in [0,2,3]:
-            assert self.fflow.shape[i] == vshape[i],"Must be equal size: %d" % i
-            assert self.bflow.shape[i] == vshape[i],"Must be equal size: %d" % i
+        # -- a "None" flow is zero; only the given flows are checked --
+        for flow in [self.fflow,self.bflow]:
+            if flow is None: continue
+            for i in [0,2,3]:
+                assert flow.shape[i] == vshape[i],"Must be equal size: %d" % i
+
+        # -- zero flow is decided once per (new or modified) flow --
+        return cached_zero_flow(self)
 
     def forward(self, vid0, qinds, vid1=None):
         if vid1 is None: vid1 = vid0
-        self._update_flow(vid0.shape,vid0.device)
+        zero_flow = self._update_flow(vid0.shape,vid0.device)
         ws_h,ws_w,wt,k,chnls = self._get_args(vid0.shape)
         return SearchNlFunction.apply(vid0,vid1,qinds,self.fflow,self.bflow,
                                       self.h0_off,self.w0_off,self.h1_off,self.w1_off,
@@ -225,5 +330,8 @@ class SearchNl(th.nn.Module):
                                       self.dilation,self.stride,
                                       self.use_k,self.use_adj,
                                       self.reflect_bounds,self.search_abs,
-                                      self.exact)
+                                      self.exact,self.use_stream,
+                                      self.mode,self.iters,
+                                      self.levels,self.ws_r,
+                                      self.early_stop,zero_flow)
 
@@ -49,7 +49,7 @@ def numba_launcher(vid,wvid,patches,nlDists,nlInds,lam,dilation):
     vid[...] = vid_nba[...]
     wvid[...] = wvid_nba[...]
 
-@njit
+@njit(cache=True)
 def numba_gather(vid,wvid,patches,vals,inds,lam,dilation):
 
     # -- valid index --
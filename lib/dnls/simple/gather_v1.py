@@ -61,7 +61,7 @@ def numba_launcher(vid,wvid,patches,nlDists,nlInds):
                                    nlDists_nba,nlInds_nba,lamb,kpt,qpb)
 
 
-@cuda.jit(debug=False,max_registers=64)
+@cuda.jit(debug=False,max_registers=64,cache=True)
 def numba_gather(vid,wvid,patches,nlDists,nlInds,lamb,kpt,qpb):
 
     # -- reflective boundary --
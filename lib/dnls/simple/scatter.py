@@ -61,7 +61,7 @@ def numba_launcher(patches,vid,inds,dilation):
     numba_scatter[nblocks,nthreads](patches_nba,vid_nba,inds_nba,dilation,kpt,qpb)
 
 # -- reflect padding --
-@cuda.jit(debug=False,max_registers=64)
+@cuda.jit(debug=False,max_registers=64,cache=True)
 def numba_scatter(patches,vid,inds,dilation,kpt,qpb):
 
     # -- reflective boundary --
@@ -132,7 +132,7 @@ def numba_scatter(patches,vid,inds,dilation,kpt,qpb):
 
 
 # -- zero padding --
-@cuda.jit(debug=False,max_registers=64)
+@cuda.jit(debug=False,max_registers=64,cache=True)
 def numba_scatter_zp(patches,vid,inds,dilation,kpt,qpb):
 
     # -- reflective boundary --
@@ -44,7 +44,7 @@ def numba_launcher(vid,patches,inds,dilation):
     vid[...] = vid_nba[...]
 
 # -- reflect padding --
-@jit(nopython=True,debug=False)
+@jit(nopython=True,debug=False,cache=True)
 def numba_scatter(vid,patches,inds,dilation):
 
     # -- "inline" function --
@@ -94,7 +94,7 @@ def numba_scatter(vid,patches,inds,dilation):
 
 
 # -- reflect padding --
-@jit(nopython=True,debug=True)
+@jit(nopython=True,debug=True,cache=True)
 def numba_scatter_cycle(vid,patches,inds,dilation):
 
     # -- "inline" function --
@@ -13,6 +13,12 @@ from einops import rearrange,repeat
 # -- padding --
 from dnls.utils.pads import comp_pads
 
+# -- topk --
+from dnls.utils.topk import get_topk
+
+# -- temporal search plans --
+from dnls.utils.tranges import create_frame_range
+
 # -- fold/unfold
 from torch.nn.functional import fold,unfold,pad
 
@@ -38,10 +44,9 @@ def run(vid,iqueries,flow,k,ps,pt,ws,wt,chnls,stride0=4,stride1=1,dilation=1,
     # -- patches of topk --
     if use_k:
         nlDists,nlInds = allocate_k(nq,k,device)
-        get_topk(nlDists_exh,nlInds_exh,nlDists,nlInds)
+        get_topk(nlDists_exh,nlInds_exh,nlDists,nlInds,largest=True)
     else:
-        args = th.where(th.isnan(nlDists_exh))
-        nlDists_exh[args] = -th.inf # fix nan
+        nlDists_exh.nan_to_num_(nan=-th.inf,posinf=th.inf,neginf=-th.inf)
         nq = nlDists_exh.shape[0]
         nlDists=nlDists_exh[:,0].view(nq,-1).contiguous()
         nlInds=nlInds_exh[:,0].view(nq,-1,3).contiguous()
@@ -83,65 +88,10 @@ def allocate_exh(nq,ws,wt,device):
     inds[...] = -1
     return dists,inds
 
-def get_topk(l2_vals,l2_inds,vals,inds):
-
-    # -- reshape exh --
-    nq,st,ws,ws = l2_vals.shape
-    l2_vals = l2_vals.view(nq,-1)
-    l2_inds = l2_inds.view(nq,-1,3)
-
-    # -- shape info --
-    b,_ = l2_vals.shape
-    _,k = vals.shape
-
-    # -- fill nan --
-    l2_vals[th.where(th.isnan(l2_vals))] = -th.inf # fix nan
-
-    # -- take mins --
-    order = th.argsort(l2_vals,dim=1,descending=True)
-    vals[:b,:] = th.gather(l2_vals,1,order[:,:k])
-    for i in range(inds.shape[-1]):
-        inds[:b,:,i] = th.gather(l2_inds[:,:,i],1,order[:,:k])
-
 #
 # -- Numba --
 #
 
-def create_frame_range(nframes,nWt_f,nWt_b,ps_t,device):
-    tranges,n_tranges,min_tranges = [],[],[]
-    for t_c in range(nframes-ps_t+1):
-
-        # -- limits --
-        shift_t = min(0,t_c - nWt_b) + max(0,t_c + nWt_f - nframes + ps_t)
-        t_start = max(t_c - nWt_b - shift_t,0)
-        t_end = min(nframes - ps_t, t_c + nWt_f - shift_t)+1
-
-        # -- final range --
-        trange = [t_c]
-        trange_s = np.arange(t_c+1,t_end)
-        trange_e = np.arange(t_start,t_c)[::-1]
-        for t_i in range(trange_s.shape[0]):
-            trange.append(trange_s[t_i])
-        for t_i in range(trange_e.shape[0]):
-            trange.append(trange_e[t_i])
-
-        # -- aug vars --
-        n_tranges.append(len(trange))
-        min_tranges.append(np.min(trange))
-
-        # -- add padding --
-        for pad in range(nframes-len(trange)):
-            trange.append(-1)
-
-        # -- to tensor --
-        trange = th.IntTensor(trange).to(device)
-        tranges.append(trange)
-
-    tranges = th.stack(tranges).to(device)
-    n_tranges = th.IntTensor(n_tranges).to(device)
-    min_tranges = th.IntTensor(min_tranges).to(device)
-    return tranges,n_tranges,min_tranges
-
 def numba_search_launcher(vid,iqueries,nlDists,nlInds,
                           fflow,bflow,k,ps,pt,ws,wt,chnls,stride0,stride1,
                           dilation,use_search_abs,use_bound,use_adj):
@@ -192,7 +142,7 @@ def numba_search_launcher(vid,iqueries,nlDists,nlInds,
 
 
 # @cuda.jit(debug=True,max_registers=64,opt=False)
-@cuda.jit(debug=False,max_registers=64)
+@cuda.jit(debug=False,max_registers=64,cache=True)
 def numba_search(vid,iqueries,dists,inds,fflow,bflow,ps,pt,chnls,stride,dilation,
                  oh0,ow0,oh1,ow1,bufs,tranges,n_tranges,min_tranges,ws_iters,bpb,
                  use_search_abs,use_bound,use_adj):
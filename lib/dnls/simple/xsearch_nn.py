@@ -180,7 +180,7 @@ def numba_search_launcher(vid,start_index,nqueries,nlDists,
 
 
 # @cuda.jit(debug=True,max_registers=64,opt=False)
-@cuda.jit(debug=False,max_registers=64)
+@cuda.jit(debug=False,max_registers=64,cache=True)
 def numba_search(vid,start_index,nqueries,
                  dists,ps,stride,dilation,
                  oh0,ow0,oh1,ow1,use_bound,h_iters,w_iters,bpb):
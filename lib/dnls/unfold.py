@@ -8,8 +8,8 @@ A gather _without_ a race condition with k == 1
 # -- python --
 import torch as th
 
-# -- cpp cuda kernel --
-import dnls_cuda
+# -- backend dispatch (cuda kernels load lazily) --
+from dnls import backend
 
 
 def allocate_vid(vid_shape,device):
@@ -36,7 +36,8 @@ class UnfoldFunction(th.autograd.Function):
         device = vid.device
 
         # -- forward --
-        dnls_cuda.unfold_forward(vid, patches, qStart, stride, dilation)
+        unfold_forward = backend.get("unfold_forward",vid.device)
+        unfold_forward(vid, patches, qStart, stride, dilation)
 
         # -- store --
         ctx.qStart = qStart
@@ -60,7 +61,8 @@ class UnfoldFunction(th.autograd.Function):
         grad_vid = allocate_vid(vid_shape,grad_patches.device)
 
         # -- forward --
-        dnls_cuda.unfold_backward(grad_vid,grad_patches,qStart,stride,dilation)
+        unfold_backward = backend.get("unfold_backward",grad_vid.device)
+        unfold_backward(grad_vid,grad_patches,qStart,stride,dilation)
 
         return None,grad_vid,None,None,None,None
 
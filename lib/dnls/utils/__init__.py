@@ -5,3 +5,6 @@ from . import timer
 from . import gpu_mem
 from . import pads
 from . import misc
+from . import topk
+from . import flow
+from . import tranges
@@ -0,0 +1,127 @@
+"""
+
+Flow-chained search centers (per-query trajectories)
+
+The search walks the optical flow from the query frame outward, one
+frame at a time, and scans a window around the chained center of each
+frame. The chain only depends on the query, so it is computed here once
+per (query,frame) rather than per search-window offset, and the kernels
+read the compact [NumQueries,st,2] trajectory (st = n_tranges.max(),
+at most 2*wt+1).
+
+"""
+
+# -- linalg --
+import torch as th
+
+
+def is_zero_flow(fflow,bflow):
+    """
+    True when the flows are missing or identically zero
+
+    Scans the flows and waits on their device; modules decide it
+    once per flow with "cached_zero_flow".
+    """
+    return all(flow is None or not(th.any(flow != 0).item())
+               for flow in [fflow,bflow])
+
+def cached_zero_flow(module):
+    """
+    "is_zero_flow" of the module's "fflow" and "bflow"
+
+    Only rescanned when a flow is set again or modified in-place
+    (the tensors' version counters), not on every forward.
+    """
+    flows = (module.fflow,module.bflow)
+    key = tuple(None if f is None else (id(f),f._version) for f in flows)
+    cache = getattr(module,"_zero_flow",None)
+    if cache is None or cache[0] != key:
+        # -- keep the flows, so their ids are not reused --
+        cache = (key,flows,is_zero_flow(*flows))
+        module._zero_flow = cache
+    return cache[2]
+
+def search_frames(qinds,tranges,n_tranges):
+    """
+    The frames searched by each query [NumQueries,st]; -1 for padding
+    """
+    t = tranges.shape[0]
+    st = int(n_tranges.max().item())
+    ti = qinds[:,0].long().clamp(0,t-1)
+    frames = tranges.long()[ti][:,:st]
+    n_frames = n_tranges.long()[ti]
+    wt_k = th.arange(st,device=qinds.device)
+    pad = -th.ones_like(frames)
+    frames = th.where(wt_k[None,:] < n_frames[:,None],frames,pad)
+    return frames
+
+def chain_centers(qinds,fflow,bflow,tranges,n_tranges,min_tranges,hw=None,
+                  zero_flow=None):
+    """
+    qinds = [NumQueries,3]
+    hw = (H,W) of the frames; only needed when the flows are None
+    zero_flow = the caller's "is_zero_flow"; scanned here when None
+
+    returns:
+      frames = [NumQueries,st] (-1 for padding)
+      centers = [NumQueries,st,2] (h,w) as int32
+
+    With zero flow (or "fflow" and "bflow" set to None) the flows are
+    never read; each center is the query (clamped to the frame after
+    the query's own frame, as the chain does). A single missing flow
+    chains as zero.
+    """
+
+    # -- unpack --
+    nq = qinds.shape[0]
+    qinds = qinds.long()
+    frames = search_frames(qinds,tranges,n_tranges)
+    st = frames.shape[1]
+
+    # -- zero-flow fast path --
+    if zero_flow is None:
+        zero_flow = is_zero_flow(fflow,bflow)
+    if zero_flow:
+        centers = qinds[:,None,1:].repeat(1,st,1)
+        flow = bflow if fflow is None else fflow
+        h,w = hw if flow is None else flow.shape[-2:]
+        centers[:,1:,0].clamp_(0,h-1)
+        centers[:,1:,1].clamp_(0,w-1)
+        return frames,centers.int()
+
+    # -- chain along the flow; a missing flow is zero --
+    if fflow is None: fflow = th.zeros_like(bflow)
+    if bflow is None: bflow = th.zeros_like(fflow)
+    t,_,h,w = fflow.shape
+    ti = qinds[:,0].clamp(0,t-1)
+    centers = th.zeros((nq,st,2),dtype=th.long,device=qinds.device)
+    centers[:,0,0] = qinds[:,1]
+    centers[:,0,1] = qinds[:,2]
+    for k in range(1,st):
+
+        # -- previous frame is one step closer to the query frame --
+        n_ti = frames[:,k]
+        direction = th.sign(n_ti - ti)
+        prev_t = n_ti - direction
+        use_prev = frames[:,k-1] == prev_t
+        prev = th.where(use_prev[:,None],centers[:,k-1],centers[:,0])
+
+        # -- legalize access --
+        ch0,cw0 = prev[:,0],prev[:,1]
+        l_ch0 = ch0.clamp(0,h-1)
+        l_cw0 = cw0.clamp(0,w-1)
+        l_ct0 = prev_t.clamp(0,t-1)
+
+        # -- access flows --
+        fwd = direction[:,None] > 0
+        flow_f = fflow[l_ct0,:,l_ch0,l_cw0]
+        flow_b = bflow[l_ct0,:,l_ch0,l_cw0]
+        flow = th.where(fwd,flow_f,flow_b)
+
+        # -- round & bounds --
+        cw = (cw0 + flow[:,0] + 0.5).long().clamp(0,w-1)
+        ch = (ch0 + flow[:,1] + 0.5).long().clamp(0,h-1)
+        centers[:,k,0] = ch
+        centers[:,k,1] = cw
+
+    return frames,centers.int()
@@ -13,86 +13,110 @@ def get_exh_inds(vid,stride=1):
     qSearch = t*h*w // stride
     return get_query_batch(0,qSearch,stride,t,h,w,vid.device)
 
-def get_query_batch(index,qSearch,stride,t,h,w,device):
-    srch_inds = numba_query_launcher(index,qSearch,stride,t,h,w,device)
-    return srch_inds
-
-def get_iquery_batch(index,qSearch,stride,_coords,t,device=None,dtype=None):
-
-    # -- add temporal if needed --
-    coords = list(_coords) # copy
-    if len(coords) == 4: # spatial only; add time
-        coords = [0,t,] + coords
-
-    # -- unpack --
-    sq_t = coords[1] - coords[0]
-    sq_h = coords[4] - coords[2]
-    sq_w = coords[5] - coords[3]
-    fstart,top,left = coords[0],coords[2],coords[3]
-
-    # -- get inds --
-    srch_inds = numba_query_launcher(index,qSearch,stride,sq_t,sq_h,sq_w,device,dtype)
-
-    # -- add offsets --
-    srch_inds[:,0] += fstart
-    srch_inds[:,1] += top
-    srch_inds[:,2] += left
-
-    return srch_inds
-
-def numba_query_launcher(index,qSearch,stride,t,h,w,device=None,dtype=None):
-    # -- type assert --
-    assert not(device is None) or not(dtype is None)
-
-    # -- exec fill of search values --
-    srch_inds = np.zeros((qSearch,3),dtype=np.int64)
-    # assert (h % stride == 0) and (w % stride == 0)
-    numba_query_raster(srch_inds,index,qSearch,stride,t,h,w)
-    # numba_query_equal(srch_inds,index,qSearch,stride,t,h,w)
-    srch_inds = th.from_numpy(srch_inds).contiguous()
-
-    # -- handle device --
-    if not(dtype is None):
-        srch_inds = srch_inds.type(type(dtype))
-    elif not(device is None):
-        srch_inds = srch_inds.to(device)
-    else:
-        raise ValueError("We need dtype or device not None.")
-    return srch_inds
-
-@njit
-def numba_query_raster(srch_inds,index,qSearch,stride,t,h,w):
-    # hs = (h-1) // (stride-1) + 1
-    # ws = (w-1) // (stride-1) + 1
-    nh = int((h-1) // stride) + 1
-    nw = int((w-1) // stride) + 1
-    npf = nh*nw
-    hw = h*w
-    stride2 = stride**2
-    for raw_qi in prange(qSearch):
-
-        # -- ind -> ti --
-        # ind = stride2 * (qi + index)
-        # ti = ((qi * strid2) // hw) % t
-        qi = raw_qi + index
-        ti = qi // (nh*nw)
-        _qi = qi % (nh*nw)
-        # ind_f = (stride2*qi) % hw
-        # hi = (stride)*((stride*ind_f) // w)
-        hi = ((_qi // nw) * stride) % h
-        wi = ((_qi % nw) * stride) % w
-        # wi = ((stride-1)*ind_f) % w
-        # wi = (ind_f/stride) % w
-        # hi = (stride)*(ind_f // (stride*w))
-        # wi = (ind_f/stride) % w
-
-        # -- fill --
-        srch_inds[raw_qi,0] = ti
-        srch_inds[raw_qi,1] = hi
-        srch_inds[raw_qi,2] = wi
-
-
-@njit
+def get_query_batch(index,qSearch,stride,t,h,w,device=None,dtype=th.int64):
+    """
+    The queries [index,index+qSearch) of the strided raster of the video
+    """
+    return QueryRange(index,qSearch,stride,[0,t,0,0,h,w]).expand(device,dtype)
+
+def get_iquery_batch(index,qSearch,stride,coords,t,device=None,dtype=th.int64):
+    """
+    The queries [index,index+qSearch) of the strided raster of "coords"
+
+    coords = [top,left,btm,right] or [t_start,t_end,top,left,btm,right]
+    """
+    return QueryRange(index,qSearch,stride,coords,t).expand(device,dtype)
+
+def get_query_inds(qinds,t,device):
+    """
+    The [NumQueries,3] int32 queries of the search kernels from
+
+    - a tensor of indices (cast only when not already int32)
+    - a QueryRange, expanded directly on "device"
+    - a tuple (start,num,stride,coords) describing a QueryRange
+    """
+    if isinstance(qinds,(tuple,list)):
+        qinds = QueryRange(*qinds,t=t)
+    if isinstance(qinds,QueryRange):
+        return qinds.expand(device,th.int32)
+    if qinds.dtype != th.int32:
+        qinds = qinds.type(th.int32)
+    return qinds.to(device)
+
+def get_raster(qinds,t):
+    """
+    The QueryRange of the queries, or None when they are not a raster
+
+    - a QueryRange, or a tuple (start,num,stride,coords) describing one
+    - a tensor from "QueryRange.expand" not modified in-place since
+
+    The tensor's values are never read, so this does not sync the device.
+    """
+    if isinstance(qinds,(tuple,list)):
+        return QueryRange(*qinds,t=t)
+    if isinstance(qinds,QueryRange):
+        return qinds
+    raster = getattr(qinds,"_raster",None)
+    if raster is None or raster[1] != qinds._version:
+        return None
+    return raster[0]
+
+class QueryRange():
+    """
+    The lazy raster of queries [start,start+num) inside "coords"
+
+    A query "qi" of the raster is
+
+        ti = t_start + qi // (n_h*n_w)
+        hi = top + stride * ((qi % (n_h*n_w)) // n_w)
+        wi = left + stride * (qi % n_w)
+
+    Kernels can read the four numbers (start,num,stride,coords) in place
+    of the [num,3] indices; "expand" builds them with tensor ops directly
+    on the target device, and tags them with the raster ("get_raster").
+    """
+
+    def __init__(self,start,num,stride,coords,t=None):
+        coords = list(coords) # copy
+        if len(coords) == 4: # spatial only; add time
+            coords = [0,t,] + coords
+        self.start = start
+        self.num = num
+        self.stride = stride
+        self.coords = coords
+
+    def __len__(self):
+        return self.num
+
+    @property
+    def shape(self):
+        return (self.num,3)
+
+    @property
+    def grid(self):
+        # -- queries along each side of the rectangle --
+        t_start,t_end,top,left,btm,right = self.coords
+        n_h = (btm - top - 1)//self.stride + 1
+        n_w = (right - left - 1)//self.stride + 1
+        return n_h,n_w
+
+    def expand(self,device=None,dtype=th.int64):
+        """
+        The [num,3] indices (ti,hi,wi) on "device"
+        """
+        t_start,t_end,top,left,btm,right = self.coords
+        n_h,n_w = self.grid
+        qi = th.arange(self.start,self.start+self.num,
+                       device=device,dtype=th.int64)
+        s_qi = qi % (n_h*n_w)
+        ti = t_start + th.div(qi,n_h*n_w,rounding_mode="floor")
+        hi = top + self.stride * th.div(s_qi,n_w,rounding_mode="floor")
+        wi = left + self.stride * (s_qi % n_w)
+        qinds = th.stack([ti,hi,wi],-1).type(dtype)
+        qinds._raster = (self,qinds._version)
+        return qinds
+
+@njit(cache=True)
 def numba_query_equal(srch_inds,index,qSearch,stride,t,h,w):
     qSearchTotal_t = h*w//stride
     stride_sr = np.sqrt(stride)
@@ -0,0 +1,34 @@
+import torch as th
+
+def get_topk(l2_vals,l2_inds,vals,inds,largest=False):
+    """
+    Writes the k best of the exhaustive search into "vals" and "inds".
+
+    l2_vals = [NumQueries,...] and l2_inds = [NumQueries,...,3]
+    vals = [NumQueries,K] and inds = [NumQueries,K,3]
+
+    Uses a partial selection (th.topk) rather than a full sort and
+    reads all index channels with a single gather. NaNs are ranked
+    last: +inf when "largest" is False and -inf otherwise. The NaNs
+    are replaced in-place, so "l2_vals" is clobbered; the exhaustive
+    buffers are scratch space.
+    """
+
+    # -- reshape exh --
+    nq = l2_vals.shape[0]
+    l2_vals = l2_vals.view(nq,-1)
+    l2_inds = l2_inds.view(nq,-1,l2_inds.shape[-1])
+
+    # -- shape info --
+    b,_ = l2_vals.shape
+    _,k = vals.shape
+
+    # -- fill nan --
+    worst = -th.inf if largest else th.inf
+    l2_vals.nan_to_num_(nan=worst,posinf=th.inf,neginf=-th.inf)
+
+    # -- take best --
+    topk = th.topk(l2_vals,k,dim=1,largest=largest,sorted=True)
+    vals[:b,:] = topk.values
+    order = topk.indices[...,None].expand(-1,-1,l2_inds.shape[-1])
+    inds[:b,...] = th.gather(l2_inds,1,order)
@@ -0,0 +1,53 @@
+"""
+
+Temporal search plans shared by the search operators
+
+Each anchor frame "t_c" searches itself, then the frames after it and
+then the frames before it (nearest first). The plans only depend on
+the video length and search sizes, so they are built once with tensor
+ops and cached per device.
+
+"""
+
+# -- python --
+from functools import lru_cache
+
+# -- linalg --
+import torch as th
+
+
+def create_frame_range(nframes,nWt_f,nWt_b,ps_t,device):
+    """
+    returns:
+      tranges = [nframes-ps_t+1,nframes] (-1 for padding)
+      n_tranges = [nframes-ps_t+1]
+      min_tranges = [nframes-ps_t+1]
+
+    The int32 tensors are cached and shared across calls; do not
+    modify them in-place.
+    """
+    return _create_frame_range(nframes,nWt_f,nWt_b,ps_t,th.device(device))
+
+@lru_cache(maxsize=64)
+def _create_frame_range(nframes,nWt_f,nWt_b,ps_t,device):
+
+    # -- limits --
+    t_c = th.arange(nframes-ps_t+1)[:,None]
+    shift_t = (t_c - nWt_b).clamp(max=0)
+    shift_t += (t_c + nWt_f - nframes + ps_t).clamp(min=0)
+    t_start = (t_c - nWt_b - shift_t).clamp(min=0)
+    t_end = (t_c + nWt_f - shift_t).clamp(max=nframes - ps_t)+1
+
+    # -- [t_c, t_c+1, ..., t_end-1, t_c-1, ..., t_start, -1, ...] --
+    t_i = th.arange(nframes)[None,:]
+    n_fwd = (t_end - t_c - 1).clamp(min=0)
+    n_bwd = t_c - t_start
+    n_tranges = 1 + n_fwd + n_bwd
+    tranges = th.where(t_i <= n_fwd, t_c + t_i, t_c + n_fwd - t_i)
+    tranges = th.where(t_i < n_tranges, tranges, -th.ones_like(tranges))
+
+    # -- to device (once) --
+    tranges = tranges.type(th.int32).to(device)
+    n_tranges = n_tranges[:,0].type(th.int32).to(device)
+    min_tranges = t_start[:,0].type(th.int32).to(device)
+    return tranges,n_tranges,min_tranges
@@ -0,0 +1,131 @@
+"""
+
+Workspace pool for scratch buffers
+
+The ops of a batched loop allocate the same buffers (the exhaustive
+search buffers, the streamed chunks, ...) thousands of times.
+"get_buffer" returns a view of a flat buffer keyed by (name,dtype,device)
+that is reused across calls instead:
+
+    dists = workspace.get_buffer("search_exh_dists",shape,th.float32,
+                                 device,fill=float("inf"))
+
+A request of any shape is a view of the key's buffer when it fits, so
+a batch (or chunk) with fewer queries reuses the buffer of a larger one
+and only a larger request grows it; the pool never holds two buffers
+for the same name.
+
+Lifetime: a buffer is only valid until the next "get_buffer" with the
+same key, so it must not escape the op (be returned or saved for
+backward) and must not be held across calls. Buffers without "fill"
+are returned uninitialized; use them only when fully overwritten.
+
+Size: each thread has its own pool, holding at most "max_bytes"; the
+least recently used buffers are released first and a buffer larger
+than the limit is never pooled. "set_limit(0)" disables pooling and
+"clear()" releases the calling thread's buffers once its loop is done.
+
+"""
+
+# -- python --
+import threading
+from collections import OrderedDict
+
+# -- linalg --
+import torch as th
+
+# -- default limit of each thread's pool --
+MAX_BYTES = 2**28
+
+
+class WorkspacePool():
+
+    def __init__(self,max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.buffers = OrderedDict()
+        self.nbytes = 0
+
+    def get(self,name,shape,dtype,device,fill=None):
+        """
+        A "shape" view of the (name,dtype,device) buffer; uninitialized
+        unless "fill"
+        """
+
+        # -- reuse when large enough; most recently used last --
+        key = (name,dtype,th.device(device))
+        numel = shape_numel(shape)
+        buf = self.buffers.pop(key,None)
+        if not(buf is None) and buf.numel() < numel:
+            self.nbytes -= buf_bytes(buf)
+            buf = None # released before growing
+        if buf is None:
+            buf = th.empty(numel,dtype=dtype,device=device)
+            self._add(key,buf)
+        else:
+            self.buffers[key] = buf
+
+        # -- init --
+        buf = buf[:numel].view(shape)
+        if not(fill is None): buf.fill_(fill)
+        return buf
+
+    def clear(self):
+        self.buffers.clear()
+        self.nbytes = 0
+
+    def set_limit(self,max_bytes):
+        self.max_bytes = max_bytes
+        self._evict(0)
+
+    def __len__(self):
+        return len(self.buffers)
+
+    def _add(self,key,buf):
+        nbytes = buf_bytes(buf)
+        if nbytes > self.max_bytes: return
+        self._evict(nbytes)
+        self.buffers[key] = buf
+        self.nbytes += nbytes
+
+    def _evict(self,nbytes):
+        # -- release the least recently used until "nbytes" more fit --
+        while self.buffers and self.nbytes + nbytes > self.max_bytes:
+            _,buf = self.buffers.popitem(last=False)
+            self.nbytes -= buf_bytes(buf)
+
+def shape_numel(shape):
+    numel = 1
+    for size in shape: numel *= size
+    return numel
+
+def buf_bytes(buf):
+    return buf.numel() * buf.element_size()
+
+#
+# -- Thread-local pools --
+#
+
+_LOCAL = threading.local()
+
+def get_pool():
+    """
+    The workspace pool of the calling thread
+    """
+    if not(hasattr(_LOCAL,"pool")):
+        _LOCAL.pool = WorkspacePool()
+    return _LOCAL.pool
+
+def get_buffer(name,shape,dtype,device,fill=None):
+    return get_pool().get(name,shape,dtype,device,fill)
+
+def clear():
+    """
+    Releases the buffers of the calling thread's pool
+    """
+    get_pool().clear()
+
+def set_limit(max_bytes):
+    """
+    The max bytes of the calling thread's pool; 0 disables pooling
+    """
+    get_pool().set_limit(max_bytes)
@@ -2,8 +2,8 @@
 # -- python --
 import torch as th
 
-# -- cpp cuda kernel --
-import dnls_cuda
+# -- backend dispatch (cuda kernels load lazily) --
+from dnls import backend
 
 from dnls.utils.timer import ExpTimer
 
@@ -39,8 +39,9 @@ class WpSumFunction(th.autograd.Function):
         """
         # if WpSumFunction.vid is None: WpSumFunction.vid = vid
         patches = allocate_patches(inds,ps,pt,vid.shape[1])
-        dnls_cuda.wpsum_forward(vid, patches, dists, inds,
-                                h_off,w_off,dilation,adj,reflect_bounds)
+        wpsum_forward = backend.get("wpsum_forward",vid.device)
+        wpsum_forward(vid, patches, dists, inds,
+                      h_off,w_off,dilation,adj,reflect_bounds)
         # print("dists._version: ",dists._version)
         # print("inds._version: ",inds._version)
         ctx.save_for_backward(dists,inds,vid)
@@ -75,16 +76,18 @@ class WpSumFunction(th.autograd.Function):
 
         # -- gradient for video --
         grad_vid = allocate_vid(vid_shape,grad_patches.device)
-        dnls_cuda.wpsum_backward_vid(grad_vid,grad_patches,dists,inds,
-                                     h_off,w_off,dilation,adj,reflect_bounds,exact)
+        wpsum_backward_vid = backend.get("wpsum_backward_vid",grad_vid.device)
+        wpsum_backward_vid(grad_vid,grad_patches,dists,inds,
+                           h_off,w_off,dilation,adj,reflect_bounds,exact)
 
         # -- gradient for dists --
         grad_dists = th.zeros_like(dists)
-        dnls_cuda.wpsum_backward_dists(grad_dists,grad_patches,vid,inds,
-                                       h_off,w_off,dilation,adj,reflect_bounds,exact)
+        wpsum_backward_dists = backend.get("wpsum_backward_dists",grad_dists.device)
+        wpsum_backward_dists(grad_dists,grad_patches,vid,inds,
+                             h_off,w_off,dilation,adj,reflect_bounds,exact)
 
         # -- stop timer --
-        th.cuda.synchronize()
+        if grad_vid.is_cuda: th.cuda.synchronize()
         timer.stop("wpsum_bwd")
         # print(timer)
 
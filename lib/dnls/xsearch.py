@@ -7,89 +7,125 @@ from einops import rearrange,repeat
 # -- padding --
 from dnls.utils.pads import comp_pads
 
-# -- cpp cuda kernel --
-import dnls_cuda
-from dnls.utils.timer import ExpTimer
+# -- topk --
+from dnls.utils.topk import get_topk
 
+# -- flow-chained search centers --
+from dnls.utils.flow import chain_centers,is_zero_flow,cached_zero_flow
 
+# -- raster query ranges --
+from dnls.utils.inds import get_query_inds
 
-def get_topk(l2_vals,l2_inds,vals,inds):
+# -- temporal search plans --
+from dnls.utils.tranges import create_frame_range
 
-    # -- reshape exh --
-    nq,st,ws,ws = l2_vals.shape
-    l2_vals = l2_vals.view(nq,-1)
-    l2_inds = l2_inds.view(nq,-1,3)
+# -- backend dispatch (cuda kernels load lazily) --
+from dnls import backend
 
-    # -- shape info --
-    b,_ = l2_vals.shape
-    _,k = vals.shape
+# -- reused scratch buffers --
+from dnls import workspace
+from dnls.utils.timer import ExpTimer
 
-    # -- fill nan --
-    l2_vals[th.where(th.isnan(l2_vals))] = -th.inf # fix nan
+# -- approximate kernel --
+from dnls.pyramid import search as search_pyr
 
-    # -- take mins --
-    order = th.argsort(l2_vals,dim=1,descending=True)
-    vals[:b,:] = th.gather(l2_vals,1,order[:,:k])
-    for i in range(inds.shape[-1]):
-        inds[:b,:,i] = th.gather(l2_inds[:,:,i],1,order[:,:k])
+# -- max elements of the (chunked) exhaustive buffers when streaming --
+STREAM_NUMEL = 2**24
 
 def allocate_vid(vid_shape,device):
     vid = th.zeros(vid_shape,device=device,dtype=th.float32)
     return vid
 
-def allocate_bufs(nq,t,ws_h,ws_w,wt,device):
-    if wt <= 0:
-        bufs = th.zeros(1,1,1,1,1,dtype=th.int32,device=device)
-    else:
-        bufs = th.zeros(nq,3,t,ws_h,ws_w,dtype=th.int32,device=device)
-    return bufs
-
-def allocate_exh(nq,ws_h,ws_w,wt,device):
-    dists = th.zeros((nq,2*wt+1,ws_h,ws_w),device=device,dtype=th.float32)
-    dists[...] = -float("inf")
-    inds = th.zeros((nq,2*wt+1,ws_h,ws_w,3),device=device,dtype=th.int32)
-    inds[...] = -1
+def allocate_exh(nq,ws_h,ws_w,wt,device,pool=False):
+    # -- scratch buffers (that do not escape the call) come from the pool --
+    shape = (nq,2*wt+1,ws_h,ws_w)
+    if pool:
+        dists = workspace.get_buffer("xsearch_dists_exh",shape,th.float32,
+                                     device,fill=-float("inf"))
+        inds = workspace.get_buffer("xsearch_inds_exh",shape+(3,),th.int32,
+                                    device,fill=-1)
+        return dists,inds
+    dists = th.full(shape,-float("inf"),device=device,dtype=th.float32)
+    inds = th.full(shape+(3,),-1,device=device,dtype=th.int32)
     return dists,inds
 
-def allocate_rtn(nq,k,device):
-    dists = th.zeros((nq,k),device=device,dtype=th.float32)
-    inds = th.zeros((nq,k,3),device=device,dtype=th.int32)
+def allocate_rtn(nq,k,device,init=True):
+    # -- "init=False" when the caller overwrites every entry --
+    alloc = th.zeros if init else th.empty
+    dists = alloc((nq,k),device=device,dtype=th.float32)
+    inds = alloc((nq,k,3),device=device,dtype=th.int32)
     return dists,inds
 
-def create_frame_range(nframes,nWt_f,nWt_b,ps_t,device):
-    tranges,n_tranges,min_tranges = [],[],[]
-    for t_c in range(nframes-ps_t+1):
-
-        # -- limits --
-        shift_t = min(0,t_c - nWt_b) + max(0,t_c + nWt_f - nframes + ps_t)
-        t_start = max(t_c - nWt_b - shift_t,0)
-        t_end = min(nframes - ps_t, t_c + nWt_f - shift_t)+1
-
-        # -- final range --
-        trange = [t_c]
-        trange_s = np.arange(t_c+1,t_end)
-        trange_e = np.arange(t_start,t_c)[::-1]
-        for t_i in range(trange_s.shape[0]):
-            trange.append(trange_s[t_i])
-        for t_i in range(trange_e.shape[0]):
-            trange.append(trange_e[t_i])
-
-        # -- aug vars --
-        n_tranges.append(len(trange))
-        min_tranges.append(np.min(trange))
-
-        # -- add padding --
-        for pad in range(nframes-len(trange)):
-            trange.append(-1)
-
-        # -- to tensor --
-        trange = th.IntTensor(trange).to(device)
-        tranges.append(trange)
-
-    tranges = th.stack(tranges).to(device).type(th.int32)
-    n_tranges = th.IntTensor(n_tranges).to(device).type(th.int32)
-    min_tranges = th.IntTensor(min_tranges).to(device).type(th.int32)
-    return tranges,n_tranges,min_tranges
+def xsearch_exh(xsearch_fwd, vid0, vid1, qinds, traj,
+                k, ps, pt, ws_h, ws_w, wt, chnls,
+                stride, dilation, use_search_abs,
+                reflect_bounds, use_adj, use_k,
+                oh0, ow0, oh1, ow1, tranges, n_tranges, min_tranges):
+
+    # -- unpack --
+    device = qinds.device
+    nq = qinds.shape[0]
+    t,c,h,w = vid0.shape
+
+    # -- allocs --
+    dists_exh,inds_exh = allocate_exh(nq,ws_h,ws_w,wt,device,pool=use_k)
+
+    # -- forward --
+    xsearch_fwd(vid0, vid1, qinds, dists_exh, inds_exh,
+                ps, pt, ws_h, ws_w, wt, chnls, stride, dilation,
+                use_search_abs, reflect_bounds, use_adj,
+                oh0, ow0, oh1, ow1,
+                traj,tranges,n_tranges,min_tranges)
+    if vid0.is_cuda:
+        th.cuda.synchronize()
+
+    # -- topk --
+    if use_k:
+        dists,inds = allocate_rtn(nq,k,device,init=False)
+        get_topk(dists_exh,inds_exh,dists,inds,largest=True)
+        dists = dists.contiguous()
+        inds = inds.contiguous()
+    else:
+        dists_exh.nan_to_num_(nan=-th.inf,posinf=th.inf,neginf=-th.inf)
+        b = dists_exh.shape[0]
+        dists=dists_exh.view(b,-1)#.contiguous()
+        inds=inds_exh.view(b,-1,3)#.contiguous()
+    return dists,inds
+
+def xsearch_stream(xsearch_fwd, xsearch_topk, vid0, vid1, qinds, traj,
+                   k, ps, pt, ws_h, ws_w, wt, chnls,
+                   stride, dilation, use_search_abs,
+                   reflect_bounds, use_adj,
+                   oh0, ow0, oh1, ow1, tranges, n_tranges, min_tranges):
+    """
+    Top-k search without the exhaustive buffers of the whole batch.
+
+    An "xsearch_topk" engine (the cpu running top-k over candidate tiles)
+    fills the top-k directly. Otherwise (cuda) "xsearch_fwd" fills the
+    exhaustive buffers for one chunk of queries at a time.
+    """
+
+    # -- cpu running top-k --
+    if not(xsearch_topk is None):
+        return xsearch_topk(
+            vid0, vid1, qinds, k,
+            ps, pt, ws_h, ws_w, wt, chnls, stride, dilation,
+            use_search_abs, reflect_bounds, use_adj,
+            oh0, ow0, oh1, ow1, traj, tranges, n_tranges, min_tranges)
+
+    # -- chunks of queries --
+    nq = qinds.shape[0]
+    dists,inds = allocate_rtn(nq,k,qinds.device,init=False)
+    numel = ws_h * ws_w * 4*(2*wt+1)
+    nchunk = max(1,STREAM_NUMEL // numel)
+    for start in range(0,nq,nchunk):
+        end = min(start+nchunk,nq)
+        dists[start:end],inds[start:end] = xsearch_exh(
+            xsearch_fwd, vid0, vid1, qinds[start:end], traj[start:end],
+            k, ps, pt, ws_h, ws_w, wt, chnls, stride, dilation,
+            use_search_abs, reflect_bounds, use_adj, True,
+            oh0, ow0, oh1, ow1, tranges, n_tranges, min_tranges)
+    return dists,inds
 
 class CrossSearchNlFunction(th.autograd.Function):
 
@@ -98,60 +134,69 @@ class CrossSearchNlFunction(th.autograd.Function):
                 k, ps, pt, ws_h, ws_w, wt, chnls,
                 stride,dilation,lam,
                 use_search_abs, reflect_bounds, use_adj, use_k,
-                oh0, ow0, oh1, ow1, exact):
+                oh0, ow0, oh1, ow1, exact, use_stream=True,
+                mode="exh", levels=2, ws_r=5, zero_flow=None):
         """
         vid = [T,C,H,W]
-        qinds = [NumQueries,K,3]
+        qinds = [NumQueries,3] or a QueryRange/(start,num,stride,coords)
         ws = xsearch Window Spatial (ws)
         wt = xsearch Window Time (wt)
+        mode = "exh" (exhaustive) or "pyramid" (approximate)
+
+        fflow = bflow = None searches with zero flow; the flow-chained
+        centers [NumQueries,2*wt+1,2] are computed once per query.
+        zero_flow = CrossSearchNl's cached "is_zero_flow"; scanned when None
         """
 
-        # -- unpack --
+        # -- zero flow is searched as "None" flows --
+        if zero_flow is None:
+            zero_flow = is_zero_flow(fflow,bflow)
+        if zero_flow:
+            fflow,bflow = None,None
+
+        # -- unpack; a raster range is expanded on the video's device --
+        t,c,h,w = vid0.shape
+        qinds = get_query_inds(qinds,t,vid0.device)
         device = qinds.device
         nq = qinds.shape[0]
-        t,c,h,w = vid0.shape
-        qinds = qinds.type(th.int32)
-
-        # -- allocs --
-        bufs = allocate_bufs(nq,t,ws_h,ws_w,wt,device)
-        dists_exh,inds_exh = allocate_exh(nq,ws_h,ws_w,wt,device)
 
         # -- pre-computed xsearch offsets --
         tranges,n_tranges,min_tranges = create_frame_range(t,wt,wt,pt,device)
 
-        # -- forward --
-        dnls_cuda.xsearch_forward(vid0, vid1, qinds, fflow, bflow,
-                                  dists_exh, inds_exh,
-                                  ps, pt, ws_h, ws_w, wt, chnls, stride, dilation,
-                                  use_search_abs, reflect_bounds, use_adj,
-                                  oh0, ow0, oh1, ow1,
-                                  bufs,tranges,n_tranges,min_tranges)
-        th.cuda.synchronize()
-        th.cuda.empty_cache()
-        # print(dists_exh[:3,:3,:3])
-        # print("dists_exh._version:",dists_exh._version)
-        # print("inds_exh._version:",inds_exh._version)
-
-        # -- topk --
-        # b = dists_exh.shape[0]
-        # dists=dists_exh.view(b,-1)#.contiguous()
-        # inds=inds_exh.view(b,-1,3)#.contiguous()
-        # print(dists_exh[0],use_search_abs)
-        # print(k, ps, pt, ws_h, ws_w, wt, chnls, use_search_abs, use_adj, reflect_bounds)
-        # print(oh0, ow0, oh1, ow1)
-
-        if use_k:
+        # -- flow-chained centers (the pyramid chains each level) --
+        if mode != "pyramid":
+            _,traj = chain_centers(qinds, fflow, bflow, tranges,
+                                   n_tranges, min_tranges, (h,w), zero_flow)
+
+        # -- engines of the device --
+        xsearch_fwd = backend.get("xsearch_forward",device)
+        xsearch_topk = backend.lookup("xsearch_topk",device)
+
+        # -- top-k without the exhaustive buffers --
+        if mode == "pyramid":
+            assert use_k,"The pyramid search only returns the top-k."
             dists,inds = allocate_rtn(nq,k,device)
-            get_topk(dists_exh,inds_exh,dists,inds)
-            dists = dists.contiguous()
-            inds = inds.contiguous()
+            search_pyr.search_topk(vid0, vid1, qinds, fflow, bflow, dists, inds,
+                                   oh0, ow0, oh1, ow1,
+                                   ps, pt, ws_h, ws_w, wt, chnls, dilation,
+                                   stride, use_adj, reflect_bounds,
+                                   use_search_abs, tranges, n_tranges,
+                                   min_tranges, levels, ws_r, "prod")
+        elif use_k and use_stream:
+            dists,inds = xsearch_stream(xsearch_fwd, xsearch_topk,
+                                        vid0, vid1, qinds, traj,
+                                        k, ps, pt, ws_h, ws_w, wt, chnls,
+                                        stride, dilation, use_search_abs,
+                                        reflect_bounds, use_adj,
+                                        oh0, ow0, oh1, ow1,
+                                        tranges, n_tranges, min_tranges)
         else:
-            args = th.where(th.isnan(dists_exh))
-            dists_exh[args] = -th.inf # fix nan
-            b = dists_exh.shape[0]
-            dists=dists_exh.view(b,-1)#.contiguous()
-            inds=inds_exh.view(b,-1,3)#.contiguous()
-        # print(dists)
+            dists,inds = xsearch_exh(xsearch_fwd, vid0, vid1, qinds, traj,
+                                     k, ps, pt, ws_h, ws_w, wt, chnls,
+                                     stride, dilation, use_search_abs,
+                                     reflect_bounds, use_adj, use_k,
+                                     oh0, ow0, oh1, ow1,
+                                     tranges, n_tranges, min_tranges)
 
         # -- for backward --
         ctx.save_for_backward(dists,inds,
@@ -189,10 +234,11 @@ class CrossSearchNlFunction(th.autograd.Function):
         vid0_grad = allocate_vid(vid_shape,grad_dists.device)
         vid1_grad = allocate_vid(vid_shape,grad_dists.device)
         # th.cuda.synchronize()
-        dnls_cuda.xsearch_backward(vid0_grad,vid1_grad,vid0,vid1,
-                                   qinds,grad_dists,inds,
-                                   oh0,ow0,oh1,ow1,
-                                   ps,pt,lam,reflect_bounds,exact)
+        xsearch_bwd = backend.get("xsearch_backward",vid0.device)
+        xsearch_bwd(vid0_grad,vid1_grad,vid0,vid1,
+                    qinds,grad_dists,inds,
+                    oh0,ow0,oh1,ow1,
+                    ps,pt,lam,reflect_bounds,exact)
 
         # -- stop timer --
         # th.cuda.synchronize()
@@ -201,13 +247,14 @@ class CrossSearchNlFunction(th.autograd.Function):
 
 
         # th.cuda.synchronize()
-        return vid0_grad,vid1_grad,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None
+        return vid0_grad,vid1_grad,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None,None
 
 class CrossSearchNl(th.nn.Module):
 
     def __init__(self, fflow, bflow, k, ps, pt, ws, wt, oh0=0, ow0=0, oh1=0, ow1=0,
                  chnls=-1,stride=1, dilation=1, lam = 1., use_search_abs=False,
-                 reflect_bounds=True, use_adj=True, use_k=True, exact=True):
+                 reflect_bounds=True, use_adj=True, use_k=True, exact=True,
+                 use_stream=True, mode="exh", levels=2, ws_r=5):
         super(CrossSearchNl, self).__init__()
         self.k = k
         self.ps = ps
@@ -229,6 +276,10 @@ class CrossSearchNl(th.nn.Module):
         self.oh1 = oh1
         self.ow1 = ow1
         self.exact = exact
+        self.use_stream = use_stream
+        self.mode = mode
+        self.levels = levels
+        self.ws_r = ws_r
 
     def _get_args(self,vshape):
         # -- unpack --
@@ -249,17 +300,18 @@ class CrossSearchNl(th.nn.Module):
         return ws_h,ws_w,wt,k,chnls
 
     def _update_flow(self,vshape,device):
-        t,c,h,w = vshape
-        zflow = th.ones((t,2,h,w),device=device)
-        if self.fflow is None: self.fflow = zflow
-        if self.bflow is None: self.bflow = zflow
-        for i in [0,2,3]:
-            assert self.fflow.shape[i] == vshape[i],"Must be equal size: %d" % i
-            assert self.bflow.shape[i] == vshape[i],"Must be equal size: %d" % i
+        # -- a "None" flow is zero; only the given flows are checked --
+        for flow in [self.fflow,self.bflow]:
+            if flow is None: continue
+            for i in [0,2,3]:
+                assert flow.shape[i] == vshape[i],"Must be equal size: %d" % i
+
+        # -- zero flow is decided once per (new or modified) flow --
+        return cached_zero_flow(self)
 
     def forward(self, vid0, iqueries, vid1=None):
         if vid1 is None: vid1 = vid0
-        self._update_flow(vid0.shape,vid0.device)
+        zero_flow = self._update_flow(vid0.shape,vid0.device)
         ws_h,ws_w,wt,k,chnls = self._get_args(vid0.shape)
         return CrossSearchNlFunction.apply(vid0,vid1,iqueries,self.fflow,self.bflow,
                                            k,self.ps,self.pt,ws_h,ws_w,wt,chnls,
@@ -267,4 +319,6 @@ class CrossSearchNl(th.nn.Module):
                                            self.use_search_abs,self.reflect_bounds,
                                            self.use_adj,self.use_k,
                                            self.oh0,self.ow0,self.oh1,self.ow1,
-                                           self.exact)
+                                           self.exact,self.use_stream,
+                                           self.mode,self.levels,self.ws_r,
+                                           zero_flow)
@@ -3,6 +3,7 @@
 An example script for a basic non-local denoiser.
 This example script uses "fold" which requires k == 1.
 Thus, we don't aggregate non-local patches spatially.
+The batch size is chosen by the pipeline from a memory budget.
 
 """
 
@@ -23,10 +24,9 @@ ps = 7 # patch size
 pt = 1 # patch size across time
 stride = 1 # spacing between patch centers
 dilation = 1 # spacing between kernels
-batch_size = 128 # num of patches per batch
+mem_budget = 2**30 # bytes for the folds and the in-flight batches
+nthreads = 1 # batches run concurrently (helps on many-core cpus)
 coords = [4,8,60,50] # interior rectangle to processes (top,left,btm,right)
-vshape = vid.shape
-t,c,h,w = vid.shape
 
 # -- search params --
 flow = None # no flow
@@ -35,27 +35,11 @@ ws = 10 # spatial-search space in each 2-dim direction
 wt = 3 # time-search space across in each fwd-bwd direction
 chnls = 3 # number of channels to use for search
 
-# -- compute interior square size --
-sq_h = coords[2] - coords[0]
-sq_w = coords[3] - coords[1]
-sq_hw = sq_h * sq_w
-
-# -- init iunfold and ifold --
-fold_nl = dnls.ifold.iFold(vshape,coords,stride=stride,dilation=dilation)
-wfold_nl = dnls.ifold.iFold(vshape,coords,stride=stride,dilation=dilation)
-scatter_nl = dnls.scatter.ScatterNl(ps,pt,dilation=dilation)
-
-# -- compute number of batches --
-n_h = (sq_h-1)//stride+1
-n_w = (sq_w-1)//stride+1
-n_total = t * n_h * n_w
-nbatches = (n_total-1) // batch_size + 1
-
 # -- example function --
 def apply_fxn(patches_nl_i,dists):
     """
     patches_i.shape = (batch_size,k,pt,c,ps,ps)
-    with k == 1 and pt == 1
+    returns (batch_size,1,pt,c,ps,ps)
     k = number of neighbors
     pt = temporal patch size
     """
@@ -67,35 +51,16 @@ def apply_fxn(patches_nl_i,dists):
     wpatches = th.sum(wpatches,1,True)
     return wpatches
 
-# -- iterate over batches --
-for batch in range(nbatches):
-
-    # -- batch info --
-    index = min(batch_size * batch,n_total)
-    batch_size_i = min(batch_size,n_total-index)
-
-    # -- get patches --
-    queries = dnls.utils.inds.get_iquery_batch(index,batch_size_i,
-                                               stride,coords,t,device)
-    dists,inds = dnls.simple.search.run(noisy,queries,flow,k,
-                                        ps,pt,ws,wt,chnls,
-                                        stride=stride,dilation=dilation)
-
-    # -- get patches --
-    patches_nl_i = scatter_nl(noisy,inds)
-
-    # -- process --
-    patches_mod_i = apply_fxn(patches_nl_i,dists)
-
-    # -- regroup --
-    fold_nl(patches_mod_i,index)
-    ones = th.ones_like(patches_mod_i)
-    wfold_nl(ones,index)
+# -- batches sized to the memory budget --
+pipeline = dnls.pipeline.NonLocalPipeline(apply_fxn, mem_budget, k=k, ps=ps,
+                                          pt=pt, ws=ws, wt=wt, chnls=chnls,
+                                          stride0=stride, stride1=stride,
+                                          dilation=dilation, coords=coords,
+                                          fflow=flow, bflow=flow,
+                                          nthreads=nthreads)
+print("batch size: ",pipeline.get_batch_size(noisy.shape,noisy.device))
+deno = pipeline(noisy)
 
 # -- save modded video --
-deno = fold_nl.vid
-weights = wfold_nl.vid
-deno /= weights
 dnls.testing.data.save_burst(noisy,"./output/","noisy")
 dnls.testing.data.save_burst(deno,"./output/","deno")
-
@@ -0,0 +1,71 @@
+# -- python --
+import pytest
+import importlib
+
+# -- linalg --
+import torch as th
+
+# -- dnls --
+import dnls
+from dnls import backend
+
+
+def test_cpu_engines():
+    """
+
+    Test the cpu engines resolve from the registry
+
+    """
+    for op in ["search_forward","search_topk","search_backward"]:
+        assert backend.get(op,"cpu") is getattr(dnls.cpu.search,op)
+    for op in ["xsearch_forward","xsearch_topk","xsearch_backward"]:
+        assert backend.get(op,th.device("cpu")) is getattr(dnls.cpu.xsearch,op)
+    for op in ["fold_forward","fold_backward"]:
+        assert backend.get(op,"cpu") is getattr(dnls.cpu.fold,op)
+    for op in ["unfold_forward","unfold_backward"]:
+        assert backend.get(op,"cpu") is getattr(dnls.cpu.unfold,op)
+
+def test_register():
+    """
+
+    Test registering (and missing) engines
+
+    """
+
+    # -- missing engine --
+    op = "_test_op"
+    assert not(backend.has(op,"cpu"))
+    with pytest.raises(NotImplementedError):
+        backend.get(op,"cpu")
+
+    # -- callable & module path --
+    impl = lambda vid: vid
+    backend.register(op,"cpu",impl)
+    assert backend.get(op,"cpu") is impl
+    backend.ENGINES.pop((op,"cpu"))
+    backend.register("search_topk","meta","dnls.cpu.search")
+    assert backend.get("search_topk","meta") is dnls.cpu.search.search_topk
+    backend.ENGINES.pop(("search_topk","meta"))
+
+def test_lazy_cuda():
+    """
+
+    Test the package imports without loading the cuda extension
+
+    """
+    if importlib.util.find_spec("dnls_cuda") is None:
+        assert not(backend.cuda_available())
+        with pytest.raises(ImportError):
+            backend.get("scatter_forward","cuda")
+
+def test_warmup():
+    """
+
+    Test the warm-up compiles (or loads) every cpu kernel once
+
+    """
+    shapes = [(3,3,32,32)]
+    times = dnls.warmup([th.float32],shapes,verbose=False)
+    names = set(name for name,_,_ in times.keys())
+    assert names == set(dnls.jit.WARMUPS.keys())
+    assert all(secs >= 0 for secs in times.values())
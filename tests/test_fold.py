@@ -388,6 +388,90 @@ class TestFold(unittest.TestCase):
         assert error < 1e-10
         # print("GPU Max: ",th.cuda.max_memory_reserved()/(1024**3))
 
+    #
+    # -- Test the CPU Engine v.s. NN --
+    #
+
+    def test_cpu_fold(self):
+
+        # -- random patches --
+        th.manual_seed(123)
+        t,c,h,w = 3,3,32,32
+        for ps,stride,dil in [(5,4,2),(3,1,1),(7,2,1)]:
+            nh = (h-1)//stride + 1
+            nw = (w-1)//stride + 1
+            qTotal,qSize = t*nh*nw,37
+            patches = th.rand((qTotal,1,1,c,ps,ps))
+            patches_nn = patches.clone().requires_grad_(True)
+            patches_nl = patches.clone().requires_grad_(True)
+
+            # -- nn fold of the padded video --
+            padf = dil * (ps//2)
+            hp,wp = h+2*padf,w+2*padf
+            shape_str = '(t np) 1 1 c h w -> t (c h w) np'
+            patches_r = rearrange(patches_nn,shape_str,t=t)
+            vid_pad = fold(patches_r,(hp,wp),(ps,ps),stride=stride,dilation=dil)
+            vid_nn = vid_pad[:,:,padf:padf+h,padf:padf+w]
+
+            # -- batches accumulate into the module's video --
+            fold_nl = dnls.fold.Fold((t,c,h,w),stride=stride,dilation=dil,
+                                     device="cpu")
+            for qindex in range(0,qTotal,qSize):
+                vid_nl = fold_nl(patches_nl[qindex:qindex+qSize],qindex)
+            assert vid_nl is fold_nl.vid
+            assert th.allclose(vid_nn,vid_nl,atol=1e-5)
+
+            # -- check backward --
+            vid_grad = th.randn_like(vid_nl)
+            th.autograd.backward(vid_nn,vid_grad)
+            th.autograd.backward(vid_nl,vid_grad)
+            assert th.allclose(patches_nn.grad,patches_nl.grad,atol=1e-5)
+
+    def test_cpu_fold_weights(self):
+
+        # -- random patches & weights --
+        th.manual_seed(123)
+        t,c,h,w = 3,3,32,32
+        ps,stride,dil = 5,2,1
+        nh = (h-1)//stride + 1
+        nw = (w-1)//stride + 1
+        qTotal,qSize = t*nh*nw,37
+        vshape = (t,c,h,w)
+        kwargs = {"stride":stride,"dilation":dil,"device":"cpu"}
+
+        for pt in [1,2]:
+            patches = th.rand((qTotal,1,pt,c,ps,ps)).requires_grad_(True)
+            weights = th.rand(qTotal).requires_grad_(True)
+
+            # -- one pass & two passes --
+            fold_nl = dnls.fold.Fold(vshape,use_weights=True,**kwargs)
+            fold_gt = dnls.fold.Fold(vshape,**kwargs)
+            wfold_gt = dnls.fold.Fold((t,1,h,w),**kwargs)
+            for qindex in range(0,qTotal,qSize):
+                sl = slice(qindex,qindex+qSize)
+                vid_nl,wvid_nl = fold_nl(patches[sl],qindex,weights[sl])
+                vid_gt = fold_gt(patches[sl],qindex,weights[sl])
+                wvid_gt = wfold_gt(th.ones_like(patches[sl][:,:,:,:1]),
+                                   qindex,weights[sl])
+            assert wvid_nl.shape == (t,1,h,w)
+            assert th.allclose(vid_nl,vid_gt,atol=1e-5)
+            assert th.allclose(wvid_nl,wvid_gt,atol=1e-5)
+
+            # -- the gradients of both --
+            grads = [th.randn_like(vid_nl),th.randn_like(wvid_nl)]
+            grads_nl = th.autograd.grad([vid_nl,wvid_nl],[patches,weights],grads)
+            grads_gt = th.autograd.grad([vid_gt,wvid_gt],[patches,weights],grads)
+            for grad_nl,grad_gt in zip(grads_nl,grads_gt):
+                assert th.allclose(grad_nl,grad_gt,atol=1e-4)
+
+            # -- the cached map of uniform weights --
+            fold_nl = dnls.fold.Fold(vshape,use_weights=True,**kwargs)
+            for qindex in range(0,qTotal,qSize):
+                vid_nl,wvid_nl = fold_nl(patches[qindex:qindex+qSize],qindex)
+            norm = fold_nl.norm_map(ps,pt)
+            assert th.equal(norm,wvid_nl)
+            assert fold_nl.norm_map(ps,pt) is norm
+
     #
     # -- Launcher --
     #
@@ -337,6 +337,57 @@ def test_compare_fold(ps,stride,dilation,ws,wt,pt,chnls):
     error = th.mean((grad_nn - grad_nl)**2).item()
     assert error < tol
 
+#
+# -- Test CPU Gather --
+#
+
+def test_cpu_gather_vs_loop(ps,dilation):
+
+    # -- random patches & inds --
+    k,lam = 4,.5
+    t,c,h,w = 3,3,12,12
+    nq = 30
+    for pt in [1,2]:
+        inds = th.stack([th.randint(-1,t,(nq,k)),
+                         th.randint(-2,h+2,(nq,k)),
+                         th.randint(-2,w+2,(nq,k))],-1).int()
+        dists = th.rand((nq,k))
+        patches = th.rand((nq,k,pt,c,ps,ps)).requires_grad_(True)
+
+        # -- forward & backward --
+        gather_nl = dnls.gather.GatherNl((t,c,h,w),1,0,dilation=dilation,
+                                         lam=lam,device="cpu")
+        vid_nl,wvid_nl = gather_nl(patches,dists,inds)
+        vid_grad = th.randn_like(vid_nl)
+        th.autograd.backward(vid_nl,vid_grad)
+
+        # -- loop reference --
+        vid_gt,wvid_gt = th.zeros((t,c,h,w)),th.zeros((t,c,h,w))
+        grad_gt = th.zeros_like(patches)
+        bounds = lambda v,lim: -v if v < 0 else (2*(lim-1)-v if v >= lim else v)
+        psHalf = (ps-1)//2
+        for qi in range(nq):
+            for ki in range(k):
+                ti,hi,wi = inds[qi,ki].tolist()
+                weight = np.exp(-lam * dists[qi,ki].item())
+                for pk in range(pt):
+                    for pi in range(ps):
+                        for pj in range(ps):
+                            vH = hi + dilation*(pi - psHalf)
+                            vW = wi + dilation*(pj - psHalf)
+                            if not((0 <= vH < h) and (0 <= vW < w)): continue
+                            pix = patches[qi,ki,pk,:,pi,pj].detach()
+                            if 0 <= ti+pk < t:
+                                vid_gt[ti+pk,:,vH,vW] += weight * pix
+                                wvid_gt[ti+pk,:,vH,vW] += weight
+                            vT = bounds(ti+pk,t)
+                            grad_gt[qi,ki,pk,:,pi,pj] = vid_grad[vT,:,vH,vW]
+
+        # -- compare --
+        assert th.abs(vid_nl - vid_gt).max().item() < 1e-5
+        assert th.abs(wvid_nl - wvid_gt).max().item() < 1e-5
+        assert th.equal(patches.grad,grad_gt)
+
 #
 # -- Helpers --
 #
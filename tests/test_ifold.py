@@ -578,6 +578,169 @@ def test_shrink_search():
     assert error < 1e-10
     th.cuda.synchronize()
 
+def test_cpu_inplace_batches(ps,stride,dilation):
+
+    # -- random patches --
+    t,c,h,w = 3,3,32,32
+    coords = [3,7,30,25]
+    top,left,btm,right = coords
+    n_h,n_w = (btm-top-1)//stride+1,(right-left-1)//stride+1
+    qTotal,qSize = t*n_h*n_w,37
+    patches = th.rand((qTotal,1,1,c,ps,ps)).requires_grad_(True)
+    args = (stride,dilation,0,False,True)
+
+    # -- batches accumulate into the module's video --
+    fold_nl = dnls.ifold.iFold((t,c,h,w),coords,stride=stride,
+                               dilation=dilation,device="cpu")
+    for qindex in range(0,qTotal,qSize):
+        vid_nl = fold_nl(patches[qindex:qindex+qSize],qindex)
+    assert vid_nl is fold_nl.vid
+    vid_gt = th.zeros((t,c,h,w))
+    dnls.cpu.ifold.ifold_forward(vid_gt,patches.detach(),*coords,0,*args)
+    assert th.allclose(vid_nl,vid_gt,atol=1e-6)
+
+    # -- the gradient reaches every batch --
+    vid_grad = th.randn_like(vid_nl)
+    th.autograd.backward(vid_nl,vid_grad)
+    grad_gt = th.zeros_like(patches)
+    dnls.cpu.ifold.ifold_backward(vid_grad,grad_gt,*coords,0,*args)
+    assert th.allclose(patches.grad,grad_gt)
+
+    # -- the batch's (contiguous) frames hold all of its pixels,
+    # -- with temporal patches reflected at the video's last frame --
+    for pt in [1,2,3]:
+        patches_pt = th.rand((qTotal,1,pt,c,ps,ps))
+        for qindex in range(0,qTotal,qSize):
+            patches_i = patches_pt[qindex:qindex+qSize]
+            vid_box,vid_gt = th.zeros((t,c,h,w)),th.zeros((t,c,h,w))
+            bvid,bstart = dnls.ifold.batch_frames(vid_box,coords,qindex,
+                                                  len(patches_i),ps,pt,
+                                                  stride,dilation,False)
+            assert bvid.is_contiguous()
+            dnls.cpu.ifold.ifold_forward(bvid,patches_i,*coords,bstart,*args)
+            dnls.cpu.ifold.ifold_forward(vid_gt,patches_i,*coords,qindex,
+                                         *args)
+            assert th.allclose(vid_box,vid_gt,atol=1e-6)
+
+@pytest.mark.skipif(not(dnls.backend.cuda_available()),reason="requires cuda")
+def test_cuda_inplace_batches(ps,stride,dilation):
+
+    # -- random patches --
+    device = "cuda:0"
+    t,c,h,w = 3,3,32,32
+    coords = [3,7,30,25]
+    top,left,btm,right = coords
+    n_h,n_w = (btm-top-1)//stride+1,(right-left-1)//stride+1
+    qTotal,qSize = t*n_h*n_w,37
+    patches = th.rand((qTotal,1,1,c,ps,ps),device=device)
+
+    # -- batched & single pass --
+    fold_nl = dnls.ifold.iFold((t,c,h,w),coords,stride=stride,
+                               dilation=dilation,use_weights=True,
+                               device=device)
+    fold_gt = dnls.ifold.iFold((t,c,h,w),coords,stride=stride,
+                               dilation=dilation,device=device)
+    for qindex in range(0,qTotal,qSize):
+        vid_nl,wvid_nl = fold_nl(patches[qindex:qindex+qSize],qindex)
+    vid_gt = fold_gt(patches,0)
+    assert th.allclose(vid_nl,vid_gt,atol=1e-5)
+
+def test_cpu_fold_weights(ps,stride,dilation):
+
+    # -- random patches & weights --
+    t,c,h,w = 3,3,32,32
+    coords = [3,7,30,25]
+    top,left,btm,right = coords
+    n_h,n_w = (btm-top-1)//stride+1,(right-left-1)//stride+1
+    qTotal,qSize = t*n_h*n_w,37
+    vshape = (t,c,h,w)
+    kwargs = {"stride":stride,"dilation":dilation,"device":"cpu"}
+
+    for pt in [1,2]:
+        patches = th.rand((qTotal,1,pt,c,ps,ps)).requires_grad_(True)
+        weights = th.rand(qTotal).requires_grad_(True)
+
+        # -- one pass & two passes --
+        fold_nl = dnls.ifold.iFold(vshape,coords,use_weights=True,**kwargs)
+        fold_gt = dnls.ifold.iFold(vshape,coords,**kwargs)
+        wfold_gt = dnls.ifold.iFold((t,1,h,w),coords,**kwargs)
+        for qindex in range(0,qTotal,qSize):
+            sl = slice(qindex,qindex+qSize)
+            vid_nl,wvid_nl = fold_nl(patches[sl],qindex,weights[sl])
+            vid_gt = fold_gt(patches[sl],qindex,weights[sl])
+            wvid_gt = wfold_gt(th.ones_like(patches[sl][:,:,:,:1]),
+                               qindex,weights[sl])
+        assert wvid_nl.shape == (t,1,h,w)
+        assert th.allclose(vid_nl,vid_gt,atol=1e-5)
+        assert th.allclose(wvid_nl,wvid_gt,atol=1e-5)
+
+        # -- the gradients of both --
+        grads = [th.randn_like(vid_nl),th.randn_like(wvid_nl)]
+        grads_nl = th.autograd.grad([vid_nl,wvid_nl],[patches,weights],grads)
+        grads_gt = th.autograd.grad([vid_gt,wvid_gt],[patches,weights],grads)
+        for grad_nl,grad_gt in zip(grads_nl,grads_gt):
+            assert th.allclose(grad_nl,grad_gt,atol=1e-4)
+
+        # -- the cached map of uniform weights --
+        fold_nl = dnls.ifold.iFold(vshape,coords,use_weights=True,**kwargs)
+        for qindex in range(0,qTotal,qSize):
+            vid_nl,wvid_nl = fold_nl(patches[qindex:qindex+qSize],qindex)
+        norm = fold_nl.norm_map(ps,pt)
+        assert th.equal(norm,wvid_nl)
+        assert fold_nl.norm_map(ps,pt) is norm
+
+@pytest.mark.skipif(not(dnls.backend.cuda_available()),reason="requires cuda")
+def test_cpu_vs_cuda_pt(ps,stride,dilation):
+
+    # -- random patches spanning two frames --
+    t,c,h,w = 3,3,32,32
+    coords = [3,7,30,25]
+    top,left,btm,right = coords
+    n_h,n_w = (btm-top-1)//stride+1,(right-left-1)//stride+1
+    qTotal,pt = t*n_h*n_w,2
+    patches = th.rand((qTotal,1,pt,c,ps,ps))
+
+    # -- fold & its gradient on each engine --
+    vids,grads = {},{}
+    vid_grad = th.randn((t,c,h,w))
+    for device in ["cpu","cuda:0"]:
+        patches_d = patches.to(device).requires_grad_(True)
+        fold_nl = dnls.ifold.iFold((t,c,h,w),coords,stride=stride,
+                                   dilation=dilation,device=device)
+        vid_nl = fold_nl(patches_d,0)
+        th.autograd.backward(vid_nl,vid_grad.to(device))
+        vids[device] = vid_nl.detach().cpu()
+        grads[device] = patches_d.grad.cpu()
+
+    # -- compare --
+    assert th.allclose(vids["cpu"],vids["cuda:0"],atol=1e-5)
+    assert th.allclose(grads["cpu"],grads["cuda:0"],atol=1e-5)
+
+@pytest.mark.skipif(not(dnls.backend.cuda_available()),reason="requires cuda")
+def test_cpu_vs_cuda_pt_batches(ps,stride,dilation):
+
+    # -- random patches spanning three frames --
+    t,c,h,w = 4,3,32,32
+    coords = [3,7,30,25]
+    top,left,btm,right = coords
+    n_h,n_w = (btm-top-1)//stride+1,(right-left-1)//stride+1
+    qTotal,qSize = t*n_h*n_w,37
+    for pt in [2,3]:
+        patches = th.rand((qTotal,1,pt,c,ps,ps))
+
+        # -- batched folds (start > 0 narrows the cuda frames) --
+        vids = {}
+        for device in ["cpu","cuda:0"]:
+            fold_nl = dnls.ifold.iFold((t,c,h,w),coords,stride=stride,
+                                       dilation=dilation,device=device)
+            for qindex in range(0,qTotal,qSize):
+                vid_nl = fold_nl(patches[qindex:qindex+qSize].to(device),
+                                 qindex)
+            vids[device] = vid_nl.cpu()
+
+        # -- compare --
+        assert th.allclose(vids["cpu"],vids["cuda:0"],atol=1e-5)
+
 def run_fold(_patches,_t,_h,_w,_stride=1,_dil=1,_adj=False):
     # -- avoid pytest fixtures --
     patches = _patches
@@ -361,6 +361,70 @@ def test_batched(ps,stride,dilation,top,btm,left,right):
     th.cuda.empty_cache()
 
 
+def test_cpu_batched_adjoint(ps,stride,dilation):
+
+    # -- random video --
+    t,c,h,w = 3,3,32,32
+    coords = [3,7,30,25]
+    vid = th.rand((t,c,h,w))
+    qSize = 97
+
+    for border in ["reflect","zero"]:
+
+        # -- full and batched unfold --
+        iunfold_nl = dnls.iunfold.iUnfold(ps,coords,stride=stride,
+                                          dilation=dilation,border=border)
+        vid_nl = vid.clone().requires_grad_(True)
+        patches_full = iunfold_nl(vid)
+        qTotal = patches_full.shape[0]
+        patches_nl = [iunfold_nl(vid_nl,qindex,min(qSize,qTotal-qindex))
+                      for qindex in range(0,qTotal,qSize)]
+        patches_nl = th.cat(patches_nl,0)
+        assert th.equal(patches_full,patches_nl)
+
+        # -- backward is the adjoint of the (linear) forward --
+        patches_grad = th.randn_like(patches_nl)
+        th.autograd.backward(patches_nl,patches_grad)
+        vid_r = th.randn_like(vid)
+        lhs = th.sum(vid_nl.grad * vid_r).item()
+        rhs = th.sum(iunfold_nl(vid_r) * patches_grad).item()
+        assert abs(lhs - rhs) < 1e-3 * (1 + abs(rhs))
+
+        # -- ifold is the adjoint of the zero-border unfold --
+        if border == "reflect": continue
+        ifold_nl = dnls.ifold.iFold((t,c,h,w),coords,stride=stride,
+                                    dilation=dilation,device="cpu")
+        for qindex in range(0,qTotal,qSize):
+            ifold_nl(patches_grad[qindex:qindex+qSize],qindex)
+        lhs = th.sum(ifold_nl.vid * vid_r).item()
+        assert abs(lhs - rhs) < 1e-3 * (1 + abs(rhs))
+
+@pytest.mark.skipif(not(dnls.backend.cuda_available()),reason="requires cuda")
+def test_cpu_vs_cuda_pt_bwd(ps,stride,dilation):
+
+    # -- the patches of the queries stay inside the frames --
+    m = dilation*ps
+    t,c,h,w = 3,3,2*m+16,2*m+16
+    coords = [m,m,h-m,w-m]
+    vid = th.rand((t,c,h,w))
+    pt = 2
+
+    # -- the unfold's gradient on each engine --
+    grads = {}
+    for device in ["cpu","cuda:0"]:
+        iunfold_nl = dnls.iunfold.iUnfold(ps,coords,pt,stride=stride,
+                                          dilation=dilation,border="zero")
+        vid_d = vid.to(device).requires_grad_(True)
+        patches = iunfold_nl(vid_d)
+        if not("patches" in grads):
+            grads["patches"] = th.randn(patches.shape)
+        th.autograd.backward(patches,grads["patches"].to(device))
+        grads[device] = vid_d.grad.cpu()
+
+    # -- compare --
+    assert th.allclose(grads["cpu"],grads["cuda:0"],atol=1e-4)
+
+
 def run_fold(_patches,_t,_h,_w,_stride=1,_dil=1):
     # -- avoid pytest fixtures --
     patches = _patches
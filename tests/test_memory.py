@@ -0,0 +1,238 @@
+
+# -- python --
+import gc
+import pytest
+import numpy as np
+
+# -- linalg --
+import torch as th
+from torch.profiler import profile,ProfilerActivity
+
+# -- dnls --
+import dnls
+from dnls import backend
+
+#
+# -- meshgrid --
+#
+
+def pytest_generate_tests(metafunc):
+    seed = 123
+    th.manual_seed(seed)
+    np.random.seed(seed)
+    test_lists = {"ps":[5,7],"wt":[0,1],"use_k":[True,False],
+                  "use_stream":[True,False]}
+    for key,val in test_lists.items():
+        if key in metafunc.fixturenames:
+            metafunc.parametrize(key,val)
+
+#
+# -- measured peaks --
+#
+
+def peak_cpu(fxn):
+    """
+    Peak bytes allocated by torch on the cpu while running "fxn"
+
+    Garbage from earlier tests is collected first, so no unrelated
+    frees are counted, and the workspace pool is emptied.
+    """
+    dnls.workspace.clear()
+    gc.collect()
+    gc.disable()
+    with profile(activities=[ProfilerActivity.CPU],profile_memory=True) as prof:
+        fxn()
+    gc.enable()
+    events = prof.profiler.kineto_results.events()
+    events = [e for e in events if e.name() == "[memory]"]
+    nbytes,peak = 0,0
+    for event in sorted(events,key=lambda e: e.start_ns()):
+        nbytes += event.nbytes()
+        peak = max(peak,nbytes)
+    return peak
+
+def peak_cuda(fxn):
+    """
+    Peak bytes allocated on the cuda device while running "fxn"
+    """
+    dnls.workspace.clear()
+    th.cuda.synchronize()
+    start = th.cuda.memory_allocated()
+    th.cuda.reset_peak_memory_stats()
+    fxn()
+    th.cuda.synchronize()
+    return th.cuda.max_memory_allocated() - start
+
+def run_ops(vid,nq,k,ps,pt,ws,wt,use_k,use_stream,dilation=1):
+    """
+    The forward & backward of each op as {op:(fwd,bwd)} closures
+
+    The search takes a stride-1 raster of queries, as the pipeline's
+    batches, so dilation = 1 runs its box-filtered path.
+    """
+
+    # -- inputs --
+    t,c,h,w = vid.shape
+    device = vid.device
+    qinds = dnls.utils.inds.get_query_batch(0,nq,1,t,h,w,device,th.int32)
+    queries = dnls.utils.inds.QueryRange(0,nq,1,[0,0,h,w],t)
+    vid1 = vid.clone()
+    vid.requires_grad_(True)
+    ops = {}
+
+    # -- search --
+    search = dnls.search.SearchNl(None, None, k, ps, pt, ws, wt,
+                                  dilation=dilation, use_k=use_k,
+                                  use_stream=use_stream)
+    with th.no_grad():
+        dists,inds = search(vid,queries)
+    inds = inds[:,:k].contiguous()
+    def search_fwd():
+        ops["search_out"] = search(vid,queries,vid1)[0]
+    def search_bwd():
+        th.autograd.grad(ops["search_out"],vid,ops["search_grad"])
+    ops["search"] = (search_fwd,search_bwd)
+
+    # -- scatter --
+    scatter = dnls.scatter.ScatterNl(ps,pt)
+    def scatter_fwd():
+        ops["scatter_out"] = scatter(vid,inds)
+    def scatter_bwd():
+        th.autograd.grad(ops["scatter_out"],vid,ops["scatter_grad"])
+    ops["scatter"] = (scatter_fwd,scatter_bwd)
+
+    # -- wpsum --
+    wdists = th.rand((nq,k),device=device,requires_grad=True)
+    wpsum = dnls.wpsum.WeightedPatchSum(ps,pt)
+    def wpsum_fwd():
+        ops["wpsum_out"] = wpsum(vid,wdists,inds)
+    def wpsum_bwd():
+        th.autograd.grad(ops["wpsum_out"],[vid,wdists],ops["wpsum_grad"])
+    ops["wpsum"] = (wpsum_fwd,wpsum_bwd)
+
+    # -- xsearch --
+    xsearch = dnls.xsearch.CrossSearchNl(None, None, k, ps, pt, ws, wt,
+                                         dilation=dilation, use_k=use_k,
+                                         use_stream=use_stream)
+    def xsearch_fwd():
+        ops["xsearch_out"] = xsearch(vid,qinds,vid1)[0]
+    def xsearch_bwd():
+        th.autograd.grad(ops["xsearch_out"],vid,ops["xsearch_grad"])
+    ops["xsearch"] = (xsearch_fwd,xsearch_bwd)
+
+    # -- gather --
+    patches = th.rand((nq,k,pt,c,ps,ps),device=device,requires_grad=True)
+    gather = dnls.gather.GatherNl(vid.shape,ws,wt,device=device)
+    def gather_fwd():
+        ops["gather_out"] = gather(patches,wdists.detach(),inds)[0]
+    def gather_bwd():
+        th.autograd.grad(ops["gather_out"],patches,ops["gather_grad"])
+    ops["gather"] = (gather_fwd,gather_bwd)
+
+    # -- ifold & iunfold --
+    fpatches = th.rand((nq,1,pt,c,ps,ps),device=device,requires_grad=True)
+    ifold = dnls.ifold.iFold(vid.shape,None,device=device)
+    iunfold = dnls.iunfold.iUnfold(ps,None,pt)
+    def ifold_fwd():
+        ops["ifold_out"] = ifold(fpatches,0)
+    def ifold_bwd():
+        th.autograd.grad(ops["ifold_out"],fpatches,ops["ifold_grad"])
+    def iunfold_fwd():
+        ops["iunfold_out"] = iunfold(vid,0,nq)
+    def iunfold_bwd():
+        th.autograd.grad(ops["iunfold_out"],vid,ops["iunfold_grad"])
+    ops["ifold"] = (ifold_fwd,ifold_bwd)
+    ops["iunfold"] = (iunfold_fwd,iunfold_bwd)
+
+    return ops
+
+def check_peaks(device,peak_fxn,passes,names,nq,vshape,k,ps,pt,ws,wt,use_k,
+                use_stream,tol,dilation=1,dtype=th.float32):
+    vid = th.rand(vshape,device=device,dtype=dtype)
+    fxns = run_ops(vid,nq,k,ps,pt,ws,wt,use_k,use_stream,dilation)
+    for op in names:
+        est = dnls.memory.estimate(op, nq=nq, vshape=vshape, k=k, ps=ps,
+                                   pt=pt, ws=ws, wt=wt, use_k=use_k,
+                                   use_stream=use_stream, dilation=dilation,
+                                   stride0=1, device=device, dtype=dtype)
+        fwd,bwd = fxns[op]
+        measured = peak_fxn(fwd)
+        assert abs(est["forward"] - measured) <= tol*measured,(op,est,measured)
+        if not("backward" in passes): continue
+        out = fxns[op+"_out"]
+        fxns[op+"_grad"] = th.ones_like(out)
+        measured = peak_fxn(bwd)
+        assert abs(est["backward"] - measured) <= tol*measured,(op,est,measured)
+
+#
+# -- tests --
+#
+
+def test_search_cpu(ps,wt,use_k,use_stream):
+    """
+
+    Test the estimated peaks of the search's forward & backward passes
+    on the cpu; dilation = 1 & pt = 1 take the box-filtered path
+
+    """
+    vshape = (3,3,32,32)
+    nq,k,ws = 256,5,7
+    for pt,dilation in [(1,1),(1,2),(2,1)]:
+        check_peaks("cpu",peak_cpu,["forward","backward"],["search"],nq,
+                    vshape,k,ps,pt,ws,wt,use_k,use_stream,.1,dilation)
+
+def test_search_box_cpu(ps,use_k):
+    """
+
+    Test the estimated peak of the box-filtered search's forward pass
+    on the cpu over larger frames and windows, and float64 videos
+
+    """
+    vshape = (3,3,64,64)
+    k,pt,wt = 10,1,1
+    for nq,ws in [(100,9),(700,21),(2000,9)]:
+        for dtype in [th.float32,th.float64]:
+            check_peaks("cpu",peak_cpu,["forward"],["search"],nq,vshape,
+                        k,ps,pt,ws,wt,use_k,True,.1,dtype=dtype)
+
+def test_wpsum_cpu(ps):
+    """
+
+    Test the estimated peak of the wpsum's forward pass on the cpu
+
+    """
+    vshape = (3,3,32,32)
+    nq,k,pt,ws,wt = 256,5,1,7,0
+    check_peaks("cpu",peak_cpu,["forward"],["wpsum"],nq,vshape,
+                k,ps,pt,ws,wt,True,True,.1)
+
+@pytest.mark.skipif(not(backend.cuda_available()),reason="requires cuda")
+def test_ops_cuda(ps,wt,use_k,use_stream):
+    """
+
+    Test the estimated peaks of the forward & backward passes on cuda
+
+    """
+    vshape = (3,3,64,64)
+    nq,k,pt,ws = 2048,5,1,9
+    names = ["search","xsearch","scatter","gather","wpsum","ifold","iunfold"]
+    check_peaks("cuda:0",peak_cuda,["forward","backward"],names,nq,vshape,
+                k,ps,pt,ws,wt,use_k,use_stream,.1)
+
+def test_estimate_scaling():
+    """
+
+    Test the estimates grow with the batch and the search window
+
+    """
+    vshape = (3,3,64,64)
+    for op in dnls.memory.ESTIMATES:
+        small = dnls.memory.estimate(op,nq=128,vshape=vshape,k=5,ps=5)
+        large = dnls.memory.estimate(op,nq=256,vshape=vshape,k=5,ps=5)
+        assert small["forward"] <= large["forward"]
+        assert small["backward"] <= large["backward"]
+    exh = {ws:dnls.memory.estimate("search",nq=128,vshape=vshape,ws=ws,
+                                    use_k=False)["forward"] for ws in [5,9]}
+    assert exh[5] < exh[9]
+    with pytest.raises(ValueError):
+        dnls.memory.estimate("_test_op",nq=1,vshape=vshape)
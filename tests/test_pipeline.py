@@ -0,0 +1,207 @@
+
+# -- python --
+import os
+import sys
+import pytest
+import subprocess
+from pathlib import Path
+import numpy as np
+
+# -- linalg --
+import torch as th
+from einops import rearrange
+
+# -- dnls --
+import dnls
+
+#
+# -- meshgrid --
+#
+
+def pytest_generate_tests(metafunc):
+    seed = 123
+    th.manual_seed(seed)
+    np.random.seed(seed)
+    test_lists = {"ps":[3,5],"stride0":[1,2],"dilation":[1,2]}
+    for key,val in test_lists.items():
+        if key in metafunc.fixturenames:
+            metafunc.parametrize(key,val)
+
+def weighted_mean(patches,dists):
+    weights = th.exp(-10. * dists)
+    weights = rearrange(weights,'b k -> b k 1 1 1 1')
+    weights /= th.sum(weights,1,True)
+    return th.sum(patches * weights,1,True)
+
+def test_pipeline_vs_loop(ps,stride0,dilation):
+    """
+
+    Test the pipeline with a hand-written batched loop
+
+    """
+
+    # -- get args --
+    k,pt,ws,wt = 4,1,5,1
+    t,c,h,w = 3,3,24,24
+    coords = [2,3,20,22]
+    device = "cpu"
+    vid = th.rand((t,c,h,w),dtype=th.float32)
+
+    # -- pipeline --
+    pipe = dnls.pipeline.NonLocalPipeline(weighted_mean, 0, k=k, ps=ps, pt=pt,
+                                          ws=ws, wt=wt, stride0=stride0,
+                                          dilation=dilation, coords=coords,
+                                          batch_size=37)
+    deno = pipe(vid)
+
+    # -- loop --
+    search = dnls.search.SearchNl(None, None, k, ps, pt, ws, wt,
+                                  dilation=dilation)
+    scatter_nl = dnls.scatter.ScatterNl(ps,pt,dilation=dilation)
+    fold_nl = dnls.ifold.iFold(vid.shape,coords,stride=stride0,
+                               dilation=dilation,use_weights=True,
+                               device=device)
+    ntotal = pipe.num_queries(vid.shape)
+    for index in range(0,ntotal,37):
+        nbatch = min(37,ntotal-index)
+        queries = dnls.utils.inds.get_iquery_batch(index,nbatch,stride0,
+                                                   coords,t,device)
+        dists,inds = search(vid,queries)
+        patches = weighted_mean(scatter_nl(vid,inds),dists)
+        vid_f,weights = fold_nl(patches,index)
+    deno_gt = vid_f / th.where(weights > 0,weights,th.ones_like(weights))
+
+    # -- compare --
+    error = th.abs(deno - deno_gt).max().item()
+    assert error < 1e-6
+
+def test_pipeline_threads(ps,stride0):
+    """
+
+    Test the batches run on several workers match the sequential run
+
+    """
+
+    # -- get args --
+    k,pt,ws,wt = 4,1,5,1
+    t,c,h,w = 3,3,24,24
+    vid = th.rand((t,c,h,w),dtype=th.float32)
+
+    # -- sequential & threaded --
+    deno = {}
+    for nthreads in [1,3]:
+        pipe = dnls.pipeline.NonLocalPipeline(weighted_mean, 0, k=k, ps=ps,
+                                              pt=pt, ws=ws, wt=wt,
+                                              stride0=stride0, batch_size=29,
+                                              nthreads=nthreads)
+        deno[nthreads] = pipe(vid)
+
+    # -- compare --
+    error = th.abs(deno[1] - deno[3]).max().item()
+    assert error < 1e-6
+
+def test_pipeline_workspace():
+    """
+
+    Test the pipeline's batches reuse one exhaustive buffer, which is
+    released once the batches are done
+
+    """
+
+    # -- get args --
+    k,pt,ws,wt = 4,1,5,1
+    t,c,h,w = 3,3,24,24
+    vid = th.rand((t,c,h,w),dtype=th.float32)
+
+    # -- exhaustive buffers are pooled; the last batch is smaller --
+    dnls.workspace.clear()
+    pool = dnls.workspace.get_pool()
+    grown = []
+    get = pool.get
+    def get_buffer(*args,**kwargs):
+        buf = get(*args,**kwargs)
+        grown.append(len(pool))
+        return buf
+    pool.get = get_buffer
+    try:
+        pipe = dnls.pipeline.NonLocalPipeline(weighted_mean, 0, k=k, ps=3,
+                                              pt=pt, ws=ws, wt=wt,
+                                              use_stream=False,
+                                              batch_size=500)
+        pipe(vid)
+    finally:
+        del pool.get
+    assert len(grown) > 0 and max(grown) == 2 # dists & inds
+    assert len(pool) == 0 and pool.nbytes == 0
+
+    # -- also released when a batch raises --
+    def failing(patches,dists):
+        assert len(pool) == 2
+        raise RuntimeError("_test_fxn")
+    pipe.fxn = failing
+    with pytest.raises(RuntimeError):
+        pipe(vid)
+    assert len(pool) == 0 and pool.nbytes == 0
+
+def test_pipeline_workqueue():
+    """
+
+    Test the threaded pipeline falls back to one worker under numba's
+    "workqueue" threading layer, which aborts on concurrent kernels
+
+    """
+
+    # -- a fresh process; the layer is fixed by its first kernel --
+    code = "\n".join([
+        "import torch as th, dnls",
+        "th.manual_seed(123)",
+        "vid = th.rand((3,3,24,24))",
+        "fxn = lambda patches,dists: patches[:,:1]",
+        "deno = {}",
+        "for nthreads in [1,3]:",
+        "    pipe = dnls.pipeline.NonLocalPipeline(fxn, 0, k=4, ps=5, ws=5,",
+        "        wt=1, dilation=2, batch_size=29, nthreads=nthreads)",
+        "    deno[nthreads] = pipe(vid)",
+        "    assert pipe.num_workers('cpu') == 1",
+        "assert th.equal(deno[1],deno[3])",
+    ])
+    env = dict(os.environ)
+    env["NUMBA_THREADING_LAYER"] = "workqueue"
+    env["NUMBA_NUM_THREADS"] = "4"
+    libdir = str(Path(dnls.__file__).parents[1])
+    env["PYTHONPATH"] = os.pathsep.join([libdir,env.get("PYTHONPATH","")])
+    proc = subprocess.run([sys.executable,"-c",code],env=env,
+                          capture_output=True,text=True)
+    assert proc.returncode == 0,proc.stderr
+
+def test_batch_size():
+    """
+
+    Test the batch chosen from the memory budget
+
+    """
+    vshape = (3,3,32,32)
+    device = th.device("cpu")
+    pipe = dnls.pipeline.NonLocalPipeline(None, 0, k=7, ps=5, ws=9, wt=1)
+    nq = pipe.num_queries(vshape)
+    fixed = pipe.fixed_memory(vshape,device)
+
+    # -- a budget for exactly "n" queries --
+    for n in [2,50,nq]:
+        budget = fixed + pipe.batch_memory(vshape,n,device)
+        pipe.mem_budget = budget
+        assert pipe.get_batch_size(vshape,device) == n
+        pipe.mem_budget = budget - 1
+        assert pipe.get_batch_size(vshape,device) == n-1
+
+    # -- too small --
+    pipe.mem_budget = fixed
+    with pytest.raises(ValueError):
+        pipe.get_batch_size(vshape,device)
+
+    # -- each worker has its own fold and batch in flight --
+    pipe.nthreads = 2
+    nworkers = pipe.num_workers(device)
+    fixed = pipe.fixed_memory(vshape,device)
+    pipe.mem_budget = fixed + nworkers*pipe.batch_memory(vshape,50,device)
+    assert pipe.get_batch_size(vshape,device) == 50
@@ -383,6 +383,85 @@ def test_scatter_vs_unfold(exact,ps,pt,k):
     th.cuda.synchronize()
     nb.cuda.synchronize()
 
+def test_cpu_scatter_vs_unfold(exact,ps):
+
+    # -- load data --
+    dname = "davis_baseball_64x64"
+    device = "cpu"
+    vid = dnls.testing.data.load_burst("./data/",dname,ext="jpg")
+    vid = th.from_numpy(vid)[:3].to(device).contiguous()/255.
+    t,c,h,w = vid.shape
+
+    # -- raster inds (k = 1) --
+    queryInds = dnls.utils.inds.get_query_batch(0,t*h*w,1,t,h,w,device)
+    inds = queryInds[:,None].int()
+
+    # -- prepare videos --
+    vid_nn = vid.clone().requires_grad_(True)
+    vid_nl = vid.clone().requires_grad_(True)
+
+    # -- run forward --
+    scatter_nl = dnls.scatter.ScatterNl(ps,1,exact=exact)
+    patches_nn = run_unfold(vid_nn,ps)
+    patches_nl = scatter_nl(vid_nl,inds)
+
+    # -- run backward --
+    patches_grad = th.randn_like(patches_nn)
+    th.autograd.backward(patches_nn,patches_grad)
+    th.autograd.backward(patches_nl,patches_grad)
+
+    # -- check forward --
+    error = th.abs(patches_nn - patches_nl).max().item()
+    assert error < 1e-6
+
+    # -- check backward --
+    error = th.abs(vid_nn.grad - vid_nl.grad).max().item()
+    assert error < 1e-4
+
+def test_cpu_scatter_vs_loop(exact,pt):
+
+    # -- random video & inds --
+    ps,k,dil,adj = 5,4,2,1
+    t,c,h,w = 4,3,16,16
+    vid = th.rand((t,c,h,w))
+    nq = 20
+    inds = th.stack([th.randint(0,t-pt+1,(nq,k)),
+                     th.randint(-2,h+2,(nq,k)),
+                     th.randint(-2,w+2,(nq,k))],-1).int()
+
+    for reflect_bounds in [True,False]:
+
+        # -- forward & backward --
+        vid_nl = vid.clone().requires_grad_(True)
+        scatter_nl = dnls.scatter.ScatterNl(ps,pt,dilation=dil,exact=exact,
+                                            adj=adj,reflect_bounds=reflect_bounds)
+        patches = scatter_nl(vid_nl,inds)
+        patches_grad = th.randn_like(patches)
+        th.autograd.backward(patches,patches_grad)
+
+        # -- loop reference --
+        patches_gt = th.zeros_like(patches)
+        grad_gt = th.zeros_like(vid)
+        bounds = lambda v,lim: -v if v < 0 else (2*(lim-1)-v if v >= lim else v)
+        for qi in range(nq):
+            for ki in range(k):
+                ti,hi,wi = inds[qi,ki].tolist()
+                for pk in range(pt):
+                    for pi in range(ps):
+                        for pj in range(ps):
+                            vT = bounds(ti+pk,t)
+                            vH = hi + dil*(pi - ps//2 + adj)
+                            vW = wi + dil*(pj - ps//2 + adj)
+                            if reflect_bounds:
+                                vH,vW = bounds(vH,h),bounds(vW,w)
+                            if not((0 <= vH < h) and (0 <= vW < w)): continue
+                            patches_gt[qi,ki,pk,:,pi,pj] = vid[vT,:,vH,vW]
+                            grad_gt[vT,:,vH,vW] += patches_grad[qi,ki,pk,:,pi,pj]
+
+        # -- compare --
+        assert th.equal(patches,patches_gt)
+        assert th.abs(vid_nl.grad - grad_gt).max().item() < 1e-5
+
 #
 # -- Misc --
 #
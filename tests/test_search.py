@@ -435,3 +435,979 @@ def test_cu_vs_th_bwd(ps,stride0,stride1,dilation,reflect_bounds,exact):
     assert error < tol_max
 
 
+
+#
+# -- CPU Engine Testing --
+#
+
+def test_cpu_vs_th_fwd(ps,stride0,stride1,dilation,reflect_bounds,exact):
+    """
+
+    Test the CPU code with torch code
+
+    Forward Pass
+
+    """
+    # -- get args --
+    dil = dilation
+    dname,ext = "davis_baseball_64x64","jpg"
+    k,pt = 1,1
+    wt = 0
+    ws = -1
+    k = -1
+    # stride0 = stride
+    # stride1 = 1
+    search_abs = True
+    use_k = k>0
+    exact = True
+
+    # -- init vars --
+    device = "cpu"
+    clean_flow = True
+    comp_flow = False
+    gpu_stats = False
+    adj = True
+    only_full = True
+
+    # -- load data --
+    vid = dnls.testing.data.load_burst("./data/",dname,ext=ext)
+    vid = th.from_numpy(vid).to(device)[:1,].contiguous()
+    gpu_mem.print_gpu_stats(gpu_stats,"post-io")
+
+    # -- grow img --
+    vid = th.cat([vid,vid],-1)
+    # vid = th.cat([vid,vid],-1)
+    # vid = th.cat([vid,vid],-2)
+    vid = th.cat([vid,vid],-2)
+
+    # -- normalize --
+    vid /= vid.max()
+    # vidr = th.ones_like(vid)
+    vidr = th.rand_like(vid)
+
+    # -- compute flow --
+    flows = dnls.testing.flow.get_flow(comp_flow,clean_flow,vid,vid,0.)
+
+    # -- unpack image --
+    device = vid.device
+    shape = vid.shape
+    t,color,h,w = shape
+    vshape = vid.shape
+    chnls = vid.shape[1]
+
+    # -- sub square --
+    top,btm,left,right = 0,h,0,w
+    coords = [top,left,btm,right]
+    # sq_h = coords[2] - coords[0]
+    # sq_w = coords[3] - coords[1]
+
+    # -- pads --
+    oh0,ow0,hp,wp = comp_pads(vid.shape, ps, stride0, dil)
+    oh1,ow1,hp1,wp1 = comp_pads(vid.shape, ps, stride1, dil)
+    n_h = (hp - (ps-1)*dil - 1)//stride0 + 1
+    n_w = (wp - (ps-1)*dil - 1)//stride0 + 1
+    n_h1 = (hp1 - (ps-1)*dil - 1)//stride1 + 1
+    n_w1 = (wp1 - (ps-1)*dil - 1)//stride1 + 1
+
+    # -- batching info --
+    npix = t * h * w
+    ntotal = t * n_h * n_w
+    nbatch = ntotal
+    nbatches = (ntotal-1) // nbatch + 1
+
+    # -- exec fold fxns --
+    use_adj = True
+    h0_off,w0_off,_,_ = comp_pads(vid.shape, ps, stride0, 1)
+    h1_off,w1_off,_,_ = comp_pads(vid.shape, ps, stride1, 1)
+    search = dnls.search.SearchNl(flows.fflow, flows.bflow, k, ps, pt,
+                                  ws, wt, dilation=dil, stride=stride1,
+                                  use_k = use_k,use_adj=use_adj,
+                                  reflect_bounds=reflect_bounds,
+                                  search_abs=search_abs,exact=exact,
+                                  h0_off=h0_off,w0_off=w0_off,
+                                  h1_off=h1_off,w1_off=w1_off)
+
+    # -- query inds --
+    qindex = 0
+    iqueries = dnls.utils.inds.get_iquery_batch(qindex,nbatch,stride0,
+                                                coords,t,device)
+
+    # -- run search --
+    mode = "reflect" if reflect_bounds else "zero"
+    score_gt = dnls.simple.search_nn.run_nn(vid,ps,stride=stride0,mode=mode,
+                                              dilation=dil,vid1=vidr,stride1=stride1)
+    score_gt = rearrange(score_gt,'(sh sw) (h w) -> h w sh sw',sh=n_h,h=n_h1)
+
+
+    # -- testing code --
+    score_te,inds_te = search(vid,iqueries,vid1=vidr)
+    score_te = rearrange(score_te,'(sh sw) (h w) -> h w sh sw',sh=n_h,h=n_h1)
+
+    # -- compare --
+    tol = 1e-5
+    error = th.mean(th.abs(score_te - score_gt)/score_gt.abs()).item()
+    if error > tol: print("error: ",error)
+    assert error < tol
+
+    tol = 1e-4
+    max_error = th.abs((score_te - score_gt)/score_gt.abs()).max().item()
+    if max_error > tol: print("max error: ",max_error)
+    assert max_error < tol
+
+
+def test_cpu_vs_th_bwd(ps,stride0,stride1,dilation,reflect_bounds,exact):
+    """
+
+    Test the CPU code with torch code
+
+    Backward Pass
+
+    """
+    # -- get args --
+    dil = dilation
+    dname,ext = "davis_baseball_64x64","jpg"
+    k,pt = 1,1
+    wt = 0
+    ws = -1
+    k = -1
+    # stride0 = stride
+    # stride1 = 4
+    search_abs = True
+    use_k = k>0
+    exact = True
+
+    # -- init vars --
+    device = "cpu"
+    clean_flow = True
+    comp_flow = False
+    gpu_stats = False
+    adj = True
+    only_full = True
+
+    # -- load data --
+    vid = dnls.testing.data.load_burst("./data/",dname,ext=ext)
+    vid = th.from_numpy(vid).to(device)[:1,].contiguous()
+    gpu_mem.print_gpu_stats(gpu_stats,"post-io")
+
+    # -- grow img --
+    # vid = th.cat([vid,vid],-1)
+    # vid = th.cat([vid,vid],-1)
+    # vid = th.cat([vid,vid],-2)
+    # vid = th.cat([vid,vid],-2)
+
+    # -- normalize --
+    vid /= vid.max()
+    # vidr = th.ones_like(vid)
+    vidr = th.rand_like(vid)
+
+    # -- allow for grads --
+    vid0_te = vid.clone()
+    vid1_te = vidr.clone()
+    vid0_gt = vid.clone().double() # float32 torch grads are the noisy side
+    vid1_gt = vidr.clone().double()
+    vid0_te.requires_grad_(True)
+    vid1_te.requires_grad_(True)
+    vid0_gt.requires_grad_(True)
+    vid1_gt.requires_grad_(True)
+
+    # -- compute flow --
+    flows = dnls.testing.flow.get_flow(comp_flow,clean_flow,vid,vid,0.)
+
+    # -- unpack image --
+    device = vid.device
+    shape = vid.shape
+    t,color,h,w = shape
+    vshape = vid.shape
+    chnls = vid.shape[1]
+
+    # -- sub square --
+    top,btm,left,right = 0,h,0,w
+    coords = [top,left,btm,right]
+    # sq_h = coords[2] - coords[0]
+    # sq_w = coords[3] - coords[1]
+
+    # -- pads --
+    oh0,ow0,hp,wp = comp_pads(vid.shape, ps, stride0, dil)
+    oh1,ow1,hp1,wp1 = comp_pads(vid.shape, ps, stride1, dil)
+    n_h = (hp - (ps-1)*dil - 1)//stride0 + 1
+    n_w = (wp - (ps-1)*dil - 1)//stride0 + 1
+    n_h1 = (hp1 - (ps-1)*dil - 1)//stride1 + 1
+    n_w1 = (wp1 - (ps-1)*dil - 1)//stride1 + 1
+
+    # -- batching info --
+    npix = t * h * w
+    ntotal = t * n_h * n_w
+    nbatch = ntotal
+    nbatches = (ntotal-1) // nbatch + 1
+
+    # -- exec fold fxns --
+    use_adj = True
+    h0_off,w0_off,_,_ = comp_pads(vid.shape, ps, stride0, 1)
+    h1_off,w1_off,_,_ = comp_pads(vid.shape, ps, stride1, 1)
+    search = dnls.search.SearchNl(flows.fflow, flows.bflow, k, ps, pt,
+                                  ws, wt, dilation=dil, stride=stride1,
+                                  use_k = use_k,use_adj=use_adj,
+                                  reflect_bounds=reflect_bounds,
+                                  search_abs=search_abs,exact=exact,
+                                  h0_off=h0_off,w0_off=w0_off,
+                                  h1_off=h1_off,w1_off=w1_off)
+
+    # -- query inds --
+    qindex = 0
+    iqueries = dnls.utils.inds.get_iquery_batch(qindex,nbatch,stride0,
+                                                coords,t,device)
+    # -- run search --
+    score_te,inds_te = search(vid0_te,iqueries,vid1=vid1_te)
+    score_te = rearrange(score_te,'(sh sw) (h w) -> h w sh sw',sh=n_h,h=n_h1)
+
+    # -- comparison --
+    mode = "reflect" if reflect_bounds else "zero"
+    score_gt = dnls.simple.search_nn.run_nn(vid0_gt,ps,stride=stride0,mode=mode,
+                                            dilation=dil,vid1=vid1_gt,stride1=stride1)
+    score_gt = rearrange(score_gt,'(sh sw) (h w) -> h w sh sw',sh=n_h,h=n_h1)
+
+    # -- compute gradient --
+    score_grad = th.rand_like(score_gt)
+    th.autograd.backward(score_gt,score_grad)
+    th.autograd.backward(score_te,score_grad.type(score_te.dtype))
+
+    # -- unpack grads --
+    grad0_te = vid0_te.grad
+    grad1_te = vid1_te.grad
+    grad0_gt = vid0_gt.grad
+    grad1_gt = vid1_gt.grad
+
+
+    #
+    # -- Backward Step --
+    #
+
+    # -- tolerances --
+    small_thresh = 1e-2
+    tol_mean = 1e-4
+    tol_max = 1e-3
+
+    # -- check 0 --
+    args = th.where(grad0_gt.abs() > small_thresh)
+    diff = th.abs((grad0_te - grad0_gt)/(grad0_gt.abs()+1e-5))
+    error = diff.mean().item()
+    assert error < tol_mean
+    error = diff[args].max().item()
+    assert error < tol_max
+
+    # -- check 1 --
+    args = th.where(grad1_gt.abs() > small_thresh)
+    diff = th.abs((grad1_te - grad1_gt)/(grad1_gt.abs()+1e-10))
+    error = diff.mean().item()
+    assert error < tol_mean
+    error = diff[args].max().item()
+    assert error < tol_max
+
+
+
+def test_cpu_vs_cu_fwd(ps,dilation,reflect_bounds):
+    """
+
+    Test the CPU code with the CUDA code
+
+    Forward Pass with flow and a temporal window
+
+    """
+
+    # -- skip --
+    if not th.cuda.is_available():
+        pytest.skip("CUDA is not available.")
+
+    # -- get args --
+    dil = dilation
+    dname,ext = "davis_baseball_64x64","jpg"
+    k,pt,ws,wt = 5,1,9,1
+    stride0,stride1 = 4,1
+    use_adj = True
+
+    # -- load data --
+    vid = dnls.testing.data.load_burst("./data/",dname,ext=ext)
+    vid = th.from_numpy(vid)[:3,].contiguous()
+    vid /= vid.max()
+    t,color,h,w = vid.shape
+
+    # -- random flow --
+    fflow = 2*th.randn((t,2,h,w),dtype=th.float32)
+    bflow = 2*th.randn((t,2,h,w),dtype=th.float32)
+
+    # -- query inds --
+    coords = [0,0,h,w]
+    ntotal = t * ((h-1)//stride0+1) * ((w-1)//stride0+1)
+    iqueries = dnls.utils.inds.get_iquery_batch(0,ntotal,stride0,
+                                                coords,t,"cpu")
+
+    # -- run search on each device --
+    dists,inds = {},{}
+    for device in ["cpu","cuda:0"]:
+        search = dnls.search.SearchNl(fflow.to(device), bflow.to(device),
+                                      k, ps, pt, ws, wt, dilation=dil,
+                                      stride=stride1, use_adj=use_adj,
+                                      reflect_bounds=reflect_bounds)
+        dists_d,inds_d = search(vid.to(device),iqueries.to(device))
+        dists[device],inds[device] = dists_d.cpu(),inds_d.cpu()
+
+    # -- compare --
+    error = th.abs(dists["cpu"] - dists["cuda:0"]).max().item()
+    assert error < 1e-4
+    assert th.all(inds["cpu"][:,0] == inds["cuda:0"][:,0]).item()
+
+def test_cpu_stream_vs_exh(ps,dilation,reflect_bounds):
+    """
+
+    Test the streaming top-k with the exhaustive search
+
+    Forward Pass with flow and a temporal window
+
+    """
+
+    # -- get args --
+    dil = dilation
+    dname,ext = "davis_baseball_64x64","jpg"
+    k,pt,ws,wt = 5,1,9,1
+    stride0,stride1 = 4,1
+    device = "cpu"
+
+    # -- load data --
+    vid = dnls.testing.data.load_burst("./data/",dname,ext=ext)
+    vid = th.from_numpy(vid)[:3,].contiguous()
+    vid /= vid.max()
+    t,color,h,w = vid.shape
+
+    # -- random flow --
+    fflow = 2*th.randn((t,2,h,w),dtype=th.float32)
+    bflow = 2*th.randn((t,2,h,w),dtype=th.float32)
+
+    # -- query inds --
+    coords = [0,0,h,w]
+    ntotal = t * ((h-1)//stride0+1) * ((w-1)//stride0+1)
+    iqueries = dnls.utils.inds.get_iquery_batch(0,ntotal,stride0,
+                                                coords,t,device)
+
+    # -- run search with/without streaming & early stopping --
+    dists,inds = {},{}
+    for use_stream,early_stop in [(False,False),(True,False),(True,True)]:
+        search = dnls.search.SearchNl(fflow, bflow, k, ps, pt, ws, wt,
+                                      dilation=dil, stride=stride1,
+                                      reflect_bounds=reflect_bounds,
+                                      use_stream=use_stream,
+                                      early_stop=early_stop)
+        key = (use_stream,early_stop)
+        dists[key],inds[key] = search(vid,iqueries)
+
+    # -- compare --
+    error = th.abs(dists[True,False] - dists[False,False]).max().item()
+    assert error < 1e-6
+    assert th.all(inds[True,False][:,0] == inds[False,False][:,0]).item()
+
+    # -- early stopping is exact --
+    assert th.equal(dists[True,True],dists[True,False])
+    assert th.equal(inds[True,True],inds[True,False])
+
+def test_zero_flow_traj(ps,reflect_bounds):
+    """
+
+    Test the zero-flow fast path with a chain along zero flows
+
+    Forward Pass
+
+    """
+
+    # -- get args --
+    dname,ext = "davis_baseball_64x64","jpg"
+    k,pt,ws,wt = 5,1,9,2
+    stride0,stride1 = 4,1
+    device = "cpu"
+
+    # -- load data --
+    vid = dnls.testing.data.load_burst("./data/",dname,ext=ext)
+    vid = th.from_numpy(vid)[:5,].contiguous()
+    vid /= vid.max()
+    t,color,h,w = vid.shape
+    zflow = th.zeros((t,2,h,w),dtype=th.float32)
+
+    # -- query inds --
+    coords = [0,0,h,w]
+    ntotal = t * ((h-1)//stride0+1) * ((w-1)//stride0+1)
+    iqueries = dnls.utils.inds.get_iquery_batch(0,ntotal,stride0,
+                                                coords,t,device)
+
+    # -- trajectories --
+    tranges,n_tranges,min_tranges = dnls.search.create_frame_range(t,wt,wt,pt,
+                                                                   device)
+    args = (tranges,n_tranges,min_tranges,(h,w))
+    frames,traj = dnls.utils.flow.chain_centers(iqueries,None,None,*args)
+    sflow = zflow + 1e-3 # rounds to zero; takes the chained path
+    frames_z,traj_z = dnls.utils.flow.chain_centers(iqueries,sflow,sflow,*args)
+    assert traj.shape == (len(iqueries),2*wt+1,2)
+    assert th.equal(frames,frames_z)
+    assert th.equal(traj,traj_z)
+
+    # -- search with "None" and zero flows --
+    dists,inds = {},{}
+    for name,flow in [("none",None),("zero",zflow)]:
+        search = dnls.search.SearchNl(flow, flow, k, ps, pt, ws, wt,
+                                      stride=stride1,
+                                      reflect_bounds=reflect_bounds)
+        dists[name],inds[name] = search(vid,iqueries)
+
+    # -- compare --
+    assert th.equal(dists["none"],dists["zero"])
+    assert th.equal(inds["none"],inds["zero"])
+
+def test_one_flow(ps,reflect_bounds):
+    """
+
+    Test a single "None" flow searches as a zero flow
+
+    Forward Pass
+
+    """
+
+    # -- get args --
+    dname,ext = "davis_baseball_64x64","jpg"
+    k,pt,ws,wt = 5,1,9,2
+    stride0,stride1 = 4,1
+    device = "cpu"
+
+    # -- load data --
+    vid = dnls.testing.data.load_burst("./data/",dname,ext=ext)
+    vid = th.from_numpy(vid)[:5,].contiguous()
+    vid /= vid.max()
+    t,color,h,w = vid.shape
+    flow = 3*th.randn((t,2,h,w),dtype=th.float32)
+    zflow = th.zeros_like(flow)
+
+    # -- query inds --
+    coords = [0,0,h,w]
+    ntotal = t * ((h-1)//stride0+1) * ((w-1)//stride0+1)
+    iqueries = dnls.utils.inds.get_iquery_batch(0,ntotal,stride0,
+                                                coords,t,device)
+
+    # -- trajectories --
+    tranges,n_tranges,min_tranges = dnls.search.create_frame_range(t,wt,wt,pt,
+                                                                   device)
+    args = (tranges,n_tranges,min_tranges,(h,w))
+    for flows,zflows in [((flow,None),(flow,zflow)),((None,flow),(zflow,flow))]:
+        frames,traj = dnls.utils.flow.chain_centers(iqueries,*flows,*args)
+        frames_z,traj_z = dnls.utils.flow.chain_centers(iqueries,*zflows,*args)
+        assert th.equal(frames,frames_z)
+        assert th.equal(traj,traj_z)
+
+        # -- search with a "None" and a zero flow --
+        for search_nl in [dnls.search.SearchNl,dnls.xsearch.CrossSearchNl]:
+            dists,inds = {},{}
+            for name,_flows in [("none",flows),("zero",zflows)]:
+                search = search_nl(*_flows, k, ps, pt, ws, wt,
+                                   stride=stride1,
+                                   reflect_bounds=reflect_bounds)
+                dists[name],inds[name] = search(vid,iqueries)
+            assert th.equal(dists["none"],dists["zero"])
+            assert th.equal(inds["none"],inds["zero"])
+
+def test_frame_range():
+    """
+
+    Test the cached temporal plans with a per-frame loop
+
+    """
+    for t,wt_f,wt_b,pt in [(1,0,0,1),(5,2,2,1),(7,3,1,2),(10,6,6,1)]:
+
+        # -- reference --
+        tranges_gt,n_tranges_gt,min_tranges_gt = [],[],[]
+        for t_c in range(t-pt+1):
+            shift_t = min(0,t_c - wt_b) + max(0,t_c + wt_f - t + pt)
+            t_start = max(t_c - wt_b - shift_t,0)
+            t_end = min(t - pt, t_c + wt_f - shift_t)+1
+            trange = [t_c] + list(range(t_c+1,t_end))
+            trange += list(range(t_start,t_c))[::-1]
+            n_tranges_gt.append(len(trange))
+            min_tranges_gt.append(min(trange))
+            tranges_gt.append(trange + [-1]*(t-len(trange)))
+
+        # -- compare --
+        tranges,n_tranges,min_tranges = dnls.search.create_frame_range(
+            t,wt_f,wt_b,pt,"cpu")
+        assert tranges.dtype == th.int32
+        assert tranges.tolist() == tranges_gt
+        assert n_tranges.tolist() == n_tranges_gt
+        assert min_tranges.tolist() == min_tranges_gt
+
+        # -- cached --
+        cached = dnls.search.create_frame_range(t,wt_f,wt_b,pt,th.device("cpu"))
+        assert cached[0] is tranges
+
+def test_query_range():
+    """
+
+    Test the vectorized query raster with a per-query loop
+
+    """
+    t,h,w = 5,31,29
+    for stride,coords in [(1,[0,0,h,w]),(3,[3,7,25,20]),(4,[1,4,2,5,30,28])]:
+
+        # -- reference --
+        t_start,t_end = (0,t) if len(coords) == 4 else coords[:2]
+        top,left,btm,right = coords[-4:]
+        qinds_gt = []
+        for ti in range(t_start,t_end):
+            for hi in range(top,btm,stride):
+                for wi in range(left,right,stride):
+                    qinds_gt.append([ti,hi,wi])
+        qinds_gt = th.IntTensor(qinds_gt)
+
+        # -- batches --
+        qrange = dnls.utils.inds.QueryRange(0,len(qinds_gt),stride,coords,t)
+        assert qrange.shape == tuple(qinds_gt.shape)
+        for start,num in [(0,len(qinds_gt)),(7,50),(len(qinds_gt)-9,9)]:
+            qinds = dnls.utils.inds.get_iquery_batch(start,num,stride,coords,t,
+                                                     dtype=th.int32)
+            assert qinds.dtype == th.int32
+            assert th.equal(qinds,qinds_gt[start:start+num])
+
+def test_search_query_range(ps,reflect_bounds):
+    """
+
+    Test the search with raster ranges in place of query tensors
+
+    Forward and Backward Pass on a batch inside a sub-region
+
+    """
+
+    # -- get args --
+    k,pt,ws,wt = 5,1,9,1
+    stride0,dilation = 3,2
+    t,c,h,w = 3,3,32,32
+    coords = [4,2,29,30]
+    start,num = 11,70
+
+    # -- video & queries --
+    vid = th.rand((t,c,h,w),dtype=th.float32)
+    qinds = dnls.utils.inds.get_iquery_batch(start,num,stride0,coords,t)
+    qrange = dnls.utils.inds.QueryRange(start,num,stride0,coords,t)
+
+    # -- run search with each description --
+    search = dnls.search.SearchNl(None, None, k, ps, pt, ws, wt,
+                                  dilation=dilation, exact=True,
+                                  reflect_bounds=reflect_bounds)
+    dists,inds,grads = [],[],[]
+    for queries in [qinds,qrange,(start,num,stride0,coords)]:
+        vid_g = vid.clone().requires_grad_(True)
+        dists_q,inds_q = search(vid_g,queries)
+        th.autograd.backward(dists_q,th.ones_like(dists_q))
+        dists.append(dists_q)
+        inds.append(inds_q)
+        grads.append(vid_g.grad)
+
+    # -- compare --
+    for i in range(1,3):
+        assert th.equal(dists[i],dists[0])
+        assert th.equal(inds[i],inds[0])
+        assert th.equal(grads[i],grads[0])
+
+def test_box_vs_cpu_fwd(ps,reflect_bounds):
+    """
+
+    Test the box-filtered search with the CPU code
+
+    Forward Pass with dense queries and zero flow
+
+    """
+
+    # -- get args --
+    dname,ext = "davis_baseball_64x64","jpg"
+    k,pt,ws,wt = 5,1,9,1
+    stride0,stride1 = 1,1
+    use_adj,search_abs = True,False
+    device = "cpu"
+
+    # -- load data --
+    vid = dnls.testing.data.load_burst("./data/",dname,ext=ext)
+    vid = th.from_numpy(vid)[:3,].contiguous()
+    vid /= vid.max()
+    t,color,h,w = vid.shape
+    vidr = th.rand_like(vid)
+    zflow = th.zeros((t,2,h,w),dtype=th.float32)
+
+    # -- dense queries --
+    coords = [0,0,h,w]
+    qinds = dnls.utils.inds.get_iquery_batch(0,t*h*w,stride0,
+                                             coords,t,device).int()
+    h0_off,w0_off,_,_ = comp_pads(vid.shape, ps, stride0, 1)
+    h1_off,w1_off,_,_ = comp_pads(vid.shape, ps, stride1, 1)
+    tranges,n_tranges,min_tranges = dnls.search.create_frame_range(t,wt,wt,pt,
+                                                                   device)
+    _,traj = dnls.utils.flow.chain_centers(qinds, zflow, zflow, tranges,
+                                           n_tranges, min_tranges)
+    queries = dnls.utils.inds.QueryRange(0,t*h*w,stride0,coords,t)
+    assert dnls.box.search.is_supported(vid, queries, None, None, ps, pt,
+                                        ws, ws, wt, 1, stride1, use_adj,
+                                        reflect_bounds, search_abs,
+                                        h0_off, w0_off, h1_off, w1_off)
+
+    # -- run both engines --
+    dists,inds = {},{}
+    for name,engine in [("box",dnls.box.search),("cpu",dnls.cpu.search)]:
+        dists_e,inds_e = dnls.search.allocate_rtn(len(qinds),k,device)
+        engine.search_topk(vid, vidr, qinds, dists_e, inds_e,
+                           h0_off, w0_off, h1_off, w1_off,
+                           ps, pt, ws, ws, wt, color, 1, stride1,
+                           use_adj, reflect_bounds, search_abs,
+                           traj, tranges, n_tranges, min_tranges)
+        dists[name],inds[name] = dists_e,inds_e
+
+    # -- compare --
+    error = th.abs(dists["box"] - dists["cpu"]).max().item()
+    assert error < 1e-4
+    assert th.all(inds["box"][:,0] == inds["cpu"][:,0]).item()
+
+def test_box_supported():
+    """
+
+    Test the box-filtered path is picked from the query raster alone
+
+    """
+
+    # -- args --
+    t,c,h,w = 3,3,32,32
+    ps,pt,ws,wt = 7,1,9,1
+    vid = th.rand((t,c,h,w))
+    coords = [2,3,30,27]
+    h_off,w_off,_,_ = comp_pads(vid.shape, ps, 1, 1)
+    args = (ps, pt, ws, ws, wt, 1, 1, True, True, False,
+            h_off, w_off, h_off, w_off)
+    is_supported = dnls.box.search.is_supported
+
+    # -- the summed bounding boxes of each frame's queries --
+    QueryRange = dnls.utils.inds.QueryRange
+    n_h,n_w = QueryRange(0,0,1,coords,t).grid
+    for start,num in [(0,t*n_h*n_w),(5,1),(20,30),(n_w-1,2),(100,n_h*n_w)]:
+        queries = QueryRange(start,num,1,coords,t)
+        qinds = queries.expand()
+        area = 0
+        for ti in qinds[:,0].unique():
+            hi,wi = qinds[qinds[:,0] == ti,1],qinds[qinds[:,0] == ti,2]
+            area += (hi.max()-hi.min()+1) * (wi.max()-wi.min()+1)
+        assert dnls.box.search.raster_area(queries) == area.item()
+        assert is_supported(vid,queries,None,None,*args) == (area <= 2*num)
+        assert is_supported(vid,(start,num,1,coords),None,None,*args) \
+            == (area <= 2*num)
+
+    # -- expanded rasters & zero flows take the box path --
+    queries = QueryRange(0,t*n_h*n_w,1,coords,t)
+    zflow = th.zeros((t,2,h,w))
+    qinds = queries.expand()
+    assert is_supported(vid,queries,None,None,*args)
+    assert is_supported(vid,qinds,None,None,*args)
+    assert is_supported(vid,queries,zflow,None,*args,zero_flow=True)
+
+    # -- the kernel takes plain or modified tensors, flows, strides
+    # -- & outside frames --
+    assert not(is_supported(vid,qinds.clone(),None,None,*args))
+    qinds[0,0] = 1
+    assert not(is_supported(vid,qinds,None,None,*args))
+    assert not(is_supported(vid,queries,zflow,None,*args))
+    assert not(is_supported(vid,queries,zflow,None,*args,zero_flow=False))
+    assert not(is_supported(vid,QueryRange(0,9,2,coords,t),None,None,*args))
+    assert not(is_supported(vid,QueryRange(0,9,1,[0,0,h,w+1],t),
+                            None,None,*args))
+    assert not(is_supported(vid,QueryRange(0,t*h*w+1,1,[0,0,h,w],t),
+                            None,None,*args))
+
+def test_box_exh_inds(monkeypatch):
+    """
+
+    Test SearchNl takes the box-filtered path for "get_exh_inds"
+
+    """
+
+    # -- count the box searches --
+    calls = []
+    search_topk = dnls.box.search.search_topk
+    def count_calls(*args,**kwargs):
+        calls.append(1)
+        return search_topk(*args,**kwargs)
+    monkeypatch.setattr(dnls.box.search,"search_topk",count_calls)
+
+    # -- dense queries with "None" and zero flows --
+    t,c,h,w = 3,3,16,16
+    k,ps,pt,ws,wt = 3,3,1,5,1
+    vid = th.rand((t,c,h,w))
+    zflow = th.zeros((t,2,h,w))
+    for flow in [None,zflow]:
+        search = dnls.search.SearchNl(flow, flow, k, ps, pt, ws, wt)
+        search(vid,dnls.utils.inds.get_exh_inds(vid))
+    assert len(calls) == 2
+
+def test_patchmatch_recall(ps,reflect_bounds):
+    """
+
+    Test the recall of the PatchMatch search with the exhaustive search
+
+    Forward Pass
+
+    """
+
+    # -- get args --
+    dname,ext = "davis_baseball_64x64","jpg"
+    k,pt,ws,wt,iters = 10,1,21,1,4
+    stride0,stride1 = 2,1
+    device = "cpu"
+    th.manual_seed(123)
+
+    # -- load data --
+    vid = dnls.testing.data.load_burst("./data/",dname,ext=ext)
+    vid = th.from_numpy(vid)[:3,].contiguous()
+    vid /= vid.max()
+    t,color,h,w = vid.shape
+    zflow = th.zeros((t,2,h,w),dtype=th.float32)
+
+    # -- query inds --
+    coords = [0,0,h,w]
+    ntotal = t * ((h-1)//stride0+1) * ((w-1)//stride0+1)
+    iqueries = dnls.utils.inds.get_iquery_batch(0,ntotal,stride0,
+                                                coords,t,device)
+
+    # -- run exhaustive & approximate search --
+    dists,inds = {},{}
+    for mode in ["exh","patchmatch"]:
+        search = dnls.search.SearchNl(zflow, zflow, k, ps, pt, ws, wt,
+                                      stride=stride1,
+                                      reflect_bounds=reflect_bounds,
+                                      mode=mode, iters=iters)
+        dists[mode],inds[mode] = search(vid,iqueries)
+
+    # -- the exhaustive search is a lower bound --
+    assert th.all(dists["patchmatch"] >= dists["exh"] - 1e-4).item()
+
+    # -- recall --
+    recall = dnls.patchmatch.search.recall(inds["patchmatch"],inds["exh"])
+    assert recall > 0.7
+
+def test_patchmatch_propagate():
+    """
+
+    Test propagation carries a neighbor's match in another frame
+
+    """
+
+    # -- frame 1 of "vid1" is frame 0 of "vid0" shifted by (3,2) --
+    t,c,h,w = 2,3,16,16
+    k,ps,pt,ws,wt = 1,3,1,9,1
+    vid0 = th.rand((t,c,h,w))
+    vid1 = th.rand((t,c,h,w))
+    vid1[1] = th.roll(vid0[0],(3,2),(-2,-1))
+
+    # -- two neighboring queries of frame 0 --
+    qinds = th.tensor([[0,6,6],[0,6,7]])
+    tranges,n_tranges,min_tranges = dnls.search.create_frame_range(t,wt,wt,
+                                                                   pt,"cpu")
+    frames,centers = dnls.utils.flow.chain_centers(qinds,None,None,tranges,
+                                                   n_tranges,min_tranges,
+                                                   (h,w))
+    centers = centers.long()
+    win = (ws,ws,1,False)
+    pm = dnls.patchmatch.search
+    ref = pm.anchor_patches(vid0,qinds,ps,pt,c,1,True,False,0,0)
+    pargs = (vid1,ref,qinds,ps,pt,c,1,True,False,0,0,"l2")
+
+    # -- the first has its match in frame 1; the second only frame 0 --
+    wt_k1 = int((frames[0] == 1).nonzero()[0,0])
+    wt_k0 = int((frames[1] == 0).nonzero()[0,0])
+    cands = th.tensor([[[wt_k1,4+3,4+2]],[[wt_k0,4,4]]])
+    vals = pm.cand_dists(pargs,pm.window_inds(cands,frames,centers,win))
+    assert vals[0,0].item() == 0.
+
+    # -- the second takes the shifted match of the first --
+    neighs = pm.neighbor_queries(qinds,vid0.shape)
+    vals,cands = pm.propagate(pargs,vals,cands,neighs,frames,centers,k,win)
+    inds = pm.window_inds(cands,frames,centers,win)
+    assert inds[1,0].tolist() == [1,9,9]
+    assert vals[1,0].item() == 0.
+
+def test_pyramid_recall(ps,reflect_bounds):
+    """
+
+    Test the recall of the pyramid search with the exhaustive search
+
+    Forward Pass with a large spatial window
+
+    """
+
+    # -- get args --
+    dname,ext = "davis_baseball_64x64","jpg"
+    k,pt,ws,wt = 10,1,31,1
+    stride0,stride1 = 4,1
+    device = "cpu"
+
+    # -- load data --
+    vid = dnls.testing.data.load_burst("./data/",dname,ext=ext)
+    vid = th.from_numpy(vid)[:3,].contiguous()
+    vid /= vid.max()
+    t,color,h,w = vid.shape
+    zflow = th.zeros((t,2,h,w),dtype=th.float32)
+
+    # -- query inds --
+    coords = [0,0,h,w]
+    ntotal = t * ((h-1)//stride0+1) * ((w-1)//stride0+1)
+    iqueries = dnls.utils.inds.get_iquery_batch(0,ntotal,stride0,
+                                                coords,t,device)
+
+    # -- run exhaustive & pyramid search --
+    dists,inds = {},{}
+    for mode,levels in [("exh",0),("pyramid",0),("pyramid",2)]:
+        search = dnls.search.SearchNl(zflow, zflow, k, ps, pt, ws, wt,
+                                      stride=stride1,
+                                      reflect_bounds=reflect_bounds,
+                                      mode=mode, levels=levels)
+        dists[levels,mode],inds[levels,mode] = search(vid,iqueries)
+
+    # -- a single level is exhaustive --
+    error = th.abs(dists[0,"pyramid"] - dists[0,"exh"]).max().item()
+    assert error < 1e-4
+
+    # -- the exhaustive search is a lower bound --
+    assert th.all(dists[2,"pyramid"] >= dists[0,"exh"] - 1e-4).item()
+
+    # -- recall --
+    recall = dnls.patchmatch.search.recall(inds[2,"pyramid"],inds[0,"exh"])
+    assert recall > 0.6
+
+def search_bwd_loop(vid0,vid1,grad_dists,inds,qinds,ps,pt,dilation,
+                    use_adj,reflect_bounds,offs):
+    """
+    The serial loop of the search backward (as the cuda kernel)
+    """
+    t,c,h,w = vid0.shape
+    nq,k = grad_dists.shape
+    h0_off,w0_off,h1_off,w1_off = offs
+    psHalf = ps//2
+    adj = psHalf if use_adj else 0
+    refl = lambda v,lim: (-v if v < 0 else (2*(lim-1)-v if v >= lim else v))
+    bnd = lambda v,lim: refl(v,lim) if reflect_bounds else v
+    grad0,grad1 = th.zeros_like(vid0),th.zeros_like(vid1)
+    for i0 in range(nq):
+        tk_a,hk_a,wk_a = qinds[i0].tolist()
+        for i1 in range(k):
+            ti,hi,wi = inds[i0,i1].tolist()
+            weight = grad_dists[i0,i1].item()
+            for pk in range(pt):
+                tk,tj = bnd(tk_a+pk,t),bnd(ti+pk,t)
+                for pi in range(ps):
+                    for pj in range(ps):
+                        hk = bnd((hk_a-h0_off) + dilation*(pi-psHalf+adj),h)
+                        wk = bnd((wk_a-w0_off) + dilation*(pj-psHalf+adj),w)
+                        hj = bnd((hi-h1_off) + dilation*(pi-psHalf+adj),h)
+                        wj = bnd((wi-w1_off) + dilation*(pj-psHalf+adj),w)
+                        valid_k = (0<=tk<t) and (0<=hk<h) and (0<=wk<w)
+                        valid_j = (0<=tj<t) and (0<=hj<h) and (0<=wj<w)
+                        pix0 = vid0[tk,:,hk,wk] if valid_k else 0.
+                        pix1 = vid1[tj,:,hj,wj] if valid_j else 0.
+                        pix = 2 * weight * (pix0 - pix1)
+                        if valid_j: grad1[tj,:,hj,wj] -= pix
+                        if valid_k: grad0[tk,:,hk,wk] += pix
+    return grad0,grad1
+
+def test_cpu_bwd_tiles(monkeypatch):
+    """
+
+    Test the tiled CPU backward with the serial loop, with row bands
+
+    """
+    t,c,h,w = 3,2,11,9
+    nq,k,ps,dilation = 20,3,3,2
+    offs = (1,0,0,1)
+    vid0,vid1 = th.rand((t,c,h,w)),th.rand((t,c,h,w))
+    grad_dists = th.randn((nq,k))
+    qinds = th.stack([th.randint(0,t,(nq,)),th.randint(0,h,(nq,)),
+                      th.randint(0,w,(nq,))],-1).int()
+    inds = th.stack([th.randint(-1,t+1,(nq,k)),th.randint(-2,h+2,(nq,k)),
+                     th.randint(-2,w+2,(nq,k))],-1).int()
+    for nbands in [1,4]:
+        monkeypatch.setattr(dnls.cpu.search,"num_bands",lambda *a: nbands)
+        for pt,use_adj,reflect_bounds in [(1,True,True),(2,False,True),
+                                          (2,True,False)]:
+            grad0,grad1 = th.zeros_like(vid0),th.zeros_like(vid1)
+            dnls.cpu.search.search_backward(grad0,grad1,vid0,vid1,
+                                            grad_dists,inds,qinds,*offs,
+                                            ps,pt,dilation,use_adj,
+                                            reflect_bounds,False)
+            grad0_gt,grad1_gt = search_bwd_loop(vid0,vid1,grad_dists,inds,
+                                                qinds,ps,pt,dilation,use_adj,
+                                                reflect_bounds,offs)
+            assert th.allclose(grad0,grad0_gt,atol=1e-5)
+            assert th.allclose(grad1,grad1_gt,atol=1e-5)
+
+def test_cpu_double_fwd():
+    """
+
+    Test the CPU engine keeps the precision of float64 videos
+
+    Forward Pass
+
+    """
+
+    # -- pixels only differ past float32's precision --
+    t,c,h,w = 2,2,12,12
+    k,ps,pt,ws,wt = 4,3,1,3,1
+    vid = 1. + 1e-6*th.rand((t,c,h,w),dtype=th.float64)
+
+    # -- in-frame queries (a plain tensor, so the kernel runs) --
+    grid = th.meshgrid(th.arange(t),th.arange(2,h-ps-1,2),
+                       th.arange(2,w-ps-1,2),indexing="ij")
+    qinds = th.stack([g.flatten() for g in grid],-1)
+
+    # -- exhaustive & top-k --
+    for use_k in [False,True]:
+        search = dnls.search.SearchNl(None, None, k if use_k else -1,
+                                      ps, pt, ws, wt, use_k=use_k,
+                                      reflect_bounds=False)
+        dists,inds = search(vid,qinds)
+
+        # -- float64 distances of in-frame candidates --
+        for qi,(ti,hi,wi) in enumerate(qinds.tolist()):
+            p0 = vid[ti,:,hi:hi+ps,wi:wi+ps]
+            for (tj,hj,wj),dist in zip(inds[qi].tolist(),dists[qi].tolist()):
+                if not(0 <= tj < t and 0 <= hj <= h-ps and 0 <= wj <= w-ps):
+                    continue
+                p1 = vid[tj,:,hj:hj+ps,wj:wj+ps]
+                dist_gt = ((p0 - p1)**2).sum().item()
+                assert abs(dist - dist_gt) <= 1e-4 * dist_gt
+
+def test_zero_flow_cached(monkeypatch):
+    """
+
+    Test SearchNl scans its flows once, not on every forward
+
+    """
+
+    # -- count the scans --
+    scans = []
+    is_zero_flow = dnls.utils.flow.is_zero_flow
+    def count_scans(*flows):
+        scans.append(1)
+        return is_zero_flow(*flows)
+    monkeypatch.setattr(dnls.utils.flow,"is_zero_flow",count_scans)
+
+    # -- search with zero flows --
+    t,c,h,w = 3,3,16,16
+    k,ps,pt,ws,wt = 3,3,1,5,1
+    vid = th.rand((t,c,h,w))
+    zflow = th.zeros((t,2,h,w))
+    qinds = th.stack([th.randint(0,n,(20,)) for n in [t,h,w]],-1)
+    search = dnls.search.SearchNl(zflow, zflow.clone(), k, ps, pt, ws, wt)
+    search(vid,qinds)
+    search(vid,qinds)
+    assert len(scans) == 1
+    assert search._update_flow(vid.shape,vid.device)
+
+    # -- in-place and new flows are scanned again --
+    search.fflow += 1.
+    assert not(search._update_flow(vid.shape,vid.device))
+    search.fflow = th.zeros_like(zflow)
+    assert search._update_flow(vid.shape,vid.device)
+    assert len(scans) == 3
@@ -0,0 +1,168 @@
+
+# -- python --
+import pytest
+
+# -- linalg --
+import torch as th
+
+# -- dnls --
+from dnls.utils.topk import get_topk
+
+#
+# -- meshgrid --
+#
+
+def pytest_generate_tests(metafunc):
+    seed = 123
+    th.manual_seed(seed)
+    test_lists = {"largest":[False,True]}
+    for key,val in test_lists.items():
+        if key in metafunc.fixturenames:
+            metafunc.parametrize(key,val)
+
+#
+# -- reference --
+#
+
+def argsort_topk(l2_vals,l2_inds,k,largest):
+    # -- the full (stable) sort of the former search paths; nan last --
+    nq = l2_vals.shape[0]
+    l2_vals = l2_vals.reshape(nq,-1)
+    l2_inds = l2_inds.reshape(nq,-1,l2_inds.shape[-1])
+    worst = -th.inf if largest else th.inf
+    l2_vals = th.where(th.isnan(l2_vals),th.full_like(l2_vals,worst),l2_vals)
+    order = th.argsort(l2_vals,dim=1,descending=largest,stable=True)[:,:k]
+    vals = th.gather(l2_vals,1,order)
+    inds = th.stack([th.gather(l2_inds[...,i],1,order)
+                     for i in range(l2_inds.shape[-1])],-1)
+    return vals,inds
+
+def run_topk(l2_vals,l2_inds,k,largest):
+    nq = l2_vals.shape[0]
+    vals = th.zeros((nq,k),dtype=th.float32)
+    inds = th.zeros((nq,k,3),dtype=th.int32)
+    get_topk(l2_vals.clone(),l2_inds,vals,inds,largest=largest)
+    return vals,inds
+
+def exh_inds(nq,st,ws):
+    # -- distinct [NumQueries,st,ws,ws,3] candidates --
+    numel = st*ws*ws
+    flat = th.arange(nq*numel,dtype=th.int32).view(nq,st,ws,ws)
+    return th.stack([flat // (ws*ws),(flat // ws) % ws,flat % ws],-1)
+
+def check_topk(l2_vals,l2_inds,vals,inds):
+    # -- each selected index is a distinct candidate of its value --
+    nq = l2_vals.shape[0]
+    l2_vals = l2_vals.reshape(nq,-1)
+    l2_inds = l2_inds.reshape(nq,-1,3)
+    for qi in range(nq):
+        cands = {tuple(ind.tolist()):val for ind,val in
+                 zip(l2_inds[qi],l2_vals[qi])}
+        sel = [tuple(ind.tolist()) for ind in inds[qi]]
+        assert len(set(sel)) == len(sel)
+        for ind,val in zip(sel,vals[qi]):
+            cand = cands[ind]
+            assert cand == val or (th.isnan(cand) and th.isinf(val))
+
+#
+# -- tests --
+#
+
+def test_vs_argsort(largest):
+    """
+
+    Test the partial selection with the full sort it replaced
+
+    """
+    nq,st,ws,k = 17,3,5,7
+    l2_vals = th.rand((nq,st,ws,ws))
+    l2_inds = exh_inds(nq,st,ws)
+    vals,inds = run_topk(l2_vals,l2_inds,k,largest)
+    vals_gt,inds_gt = argsort_topk(l2_vals,l2_inds,k,largest)
+    assert th.equal(vals,vals_gt)
+    assert th.equal(inds,inds_gt)
+
+def test_nan_rows(largest):
+    """
+
+    Test NaNs rank last and an all-NaN row still fills its top-k
+
+    """
+    nq,st,ws,k = 6,1,4,5
+    worst = -th.inf if largest else th.inf
+    l2_vals = th.rand((nq,st,ws,ws))
+    l2_vals[0] = float("nan")
+    l2_vals[1,0,0] = float("nan")
+    l2_vals[2,0,1:] = float("nan")
+    l2_inds = exh_inds(nq,st,ws)
+    vals,inds = run_topk(l2_vals,l2_inds,k,largest)
+    vals_gt,inds_gt = argsort_topk(l2_vals,l2_inds,k,largest)
+
+    # -- the all-nan row is all "worst" --
+    assert th.all(vals[0] == worst)
+    check_topk(l2_vals,l2_inds,vals,inds)
+
+    # -- the others match the sort; a nan is never picked over a number --
+    assert not(th.any(th.isnan(vals)))
+    assert th.equal(vals[1:],vals_gt[1:])
+    assert th.equal(inds[1:2],inds_gt[1:2])
+    assert th.equal(inds[3:],inds_gt[3:])
+
+def test_k_above_valid(largest):
+    """
+
+    Test "k" larger than the valid (non-NaN) candidates of a query
+
+    """
+    nq,st,ws,k = 4,2,3,10
+    worst = -th.inf if largest else th.inf
+    l2_vals = th.full((nq,st,ws,ws),float("nan"))
+    l2_vals[:,0,0,:] = th.rand((nq,ws))
+    l2_inds = exh_inds(nq,st,ws)
+    vals,inds = run_topk(l2_vals,l2_inds,k,largest)
+    vals_gt,inds_gt = argsort_topk(l2_vals,l2_inds,k,largest)
+
+    # -- the valid candidates come first, in order --
+    assert th.equal(vals[:,:ws],vals_gt[:,:ws])
+    assert th.equal(inds[:,:ws],inds_gt[:,:ws])
+    assert th.all(vals[:,ws:] == worst)
+    check_topk(l2_vals,l2_inds,vals,inds)
+
+def test_ties(largest):
+    """
+
+    Test tied values give the sort's values and distinct tied candidates
+
+    """
+    nq,st,ws,k = 9,3,4,6
+    l2_vals = th.randint(0,4,(nq,st,ws,ws)).float()
+    l2_inds = exh_inds(nq,st,ws)
+    vals,inds = run_topk(l2_vals,l2_inds,k,largest)
+    vals_gt,inds_gt = argsort_topk(l2_vals,l2_inds,k,largest)
+
+    # -- ties may be taken in any order; the values may not --
+    assert th.equal(vals,vals_gt)
+    check_topk(l2_vals,l2_inds,vals,inds)
+
+    # -- ties inside the top-k select the same candidates --
+    for qi in range(nq):
+        inside = vals[qi] != vals[qi,-1]
+        sel = {tuple(ind.tolist()) for ind in inds[qi][inside]}
+        sel_gt = {tuple(ind.tolist()) for ind in inds_gt[qi][inside]}
+        assert sel == sel_gt
+
+def test_clobbers_input(largest):
+    """
+
+    Test the NaNs of the exhaustive buffer are replaced in-place
+
+    """
+    nq,st,ws,k = 3,1,4,2
+    worst = -th.inf if largest else th.inf
+    l2_vals = th.rand((nq,st,ws,ws))
+    l2_vals[:,0,0,0] = float("nan")
+    l2_inds = exh_inds(nq,st,ws)
+    vals = th.zeros((nq,k),dtype=th.float32)
+    inds = th.zeros((nq,k,3),dtype=th.int32)
+    get_topk(l2_vals,l2_inds,vals,inds,largest=largest)
+    assert th.all(l2_vals[:,0,0,0] == worst)
@@ -247,6 +247,44 @@ class TestUnfold(unittest.TestCase):
         error = th.sum((grad_nn - grad_nl)**2).item()
         assert error < 1e-6
 
+    #
+    # -- Test the CPU Engine v.s. NN --
+    #
+
+    def test_cpu_unfold(self):
+
+        # -- random video --
+        th.manual_seed(123)
+        t,c,h,w = 3,3,32,32
+        for ps,stride,dil in [(3,3,2),(5,1,1),(7,2,1)]:
+            nh = (h-1)//stride + 1
+            nw = (w-1)//stride + 1
+            qTotal,qSize = t*nh*nw,37
+            vid = th.rand((t,c,h,w))
+            vid_nn = vid.clone().requires_grad_(True)
+            vid_nl = vid.clone().requires_grad_(True)
+
+            # -- nn unfold of the reflected video --
+            padf = dil * (ps//2)
+            vid_pad = pad(vid_nn,4*[padf,],mode="reflect")
+            patches_nn = self.run_unfold(vid_pad,ps,stride,dil)
+
+            # -- batched unfold --
+            unfold_nl = dnls.unfold.Unfold(ps,stride=stride,dilation=dil,
+                                           device="cpu")
+            patches_nl = []
+            for qindex in range(0,qTotal,qSize):
+                qNum = min(qSize,qTotal-qindex)
+                patches_nl.append(unfold_nl(vid_nl,qindex,qNum))
+            patches_nl = th.cat(patches_nl)
+            assert th.allclose(patches_nn,patches_nl,atol=1e-6)
+
+            # -- check backward --
+            patches_grad = th.randn_like(patches_nl)
+            th.autograd.backward(patches_nn,patches_grad)
+            th.autograd.backward(patches_nl,patches_grad)
+            assert th.allclose(vid_nn.grad,vid_nl.grad,atol=1e-5)
+
     #
     # -- Launcher --
     #
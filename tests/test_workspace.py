@@ -0,0 +1,79 @@
+
+# -- python --
+import threading
+
+# -- linalg --
+import torch as th
+
+# -- dnls --
+import dnls
+from dnls.workspace import WorkspacePool
+
+
+def test_reuse():
+    """
+
+    Test buffers are reused by key, as views of any fitting shape,
+    and filled on request
+
+    """
+    pool = WorkspacePool(2**20)
+    buf = pool.get("a",(4,5),th.float32,"cpu",fill=1.)
+    assert th.all(buf == 1.).item()
+    buf[...] = 3.
+    assert pool.get("a",(4,5),th.float32,"cpu").data_ptr() == buf.data_ptr()
+    assert pool.get("a",(4,5),th.float32,"cpu",fill=0.).sum().item() == 0.
+    assert not(pool.get("b",(4,5),th.float32,"cpu").data_ptr() == buf.data_ptr())
+    assert not(pool.get("a",(4,5),th.int32,"cpu").data_ptr() == buf.data_ptr())
+    assert len(pool) == 3
+
+    # -- a smaller shape is a view; a larger one grows the buffer --
+    small = pool.get("a",(3,2),th.float32,"cpu")
+    assert small.shape == (3,2) and small.data_ptr() == buf.data_ptr()
+    large = pool.get("a",(4,6),th.float32,"cpu")
+    assert large.shape == (4,6) and len(pool) == 3
+    assert pool.nbytes == 24*4 + 20*4 + 20*4
+
+def test_limits():
+    """
+
+    Test the least recently used buffers are released past the limit
+
+    """
+    pool = WorkspacePool(3*400)
+    bufs = [pool.get(str(i),(100,),th.float32,"cpu") for i in range(3)]
+    pool.get("0",(100,),th.float32,"cpu") # most recent
+    pool.get("3",(100,),th.float32,"cpu") # releases "1"
+    assert len(pool) == 3 and pool.nbytes == 3*400
+    ptr = lambda name: pool.get(name,(100,),th.float32,"cpu").data_ptr()
+    assert ptr("0") == bufs[0].data_ptr()
+    assert not(ptr("1") == bufs[1].data_ptr())
+
+    # -- too large to pool --
+    big = pool.get("big",(1000,),th.float32,"cpu")
+    assert not(pool.get("big",(1000,),th.float32,"cpu").data_ptr()
+               == big.data_ptr())
+
+    # -- disabled --
+    pool.set_limit(0)
+    assert len(pool) == 0 and pool.nbytes == 0
+    assert not(ptr("0") == bufs[0].data_ptr())
+
+def test_thread_pools():
+    """
+
+    Test each thread draws from its own pool
+
+    """
+    buf = dnls.workspace.get_buffer("_test",(8,),th.float32,"cpu")
+    other = []
+    def run():
+        other.append(dnls.workspace.get_buffer("_test",(8,),th.float32,"cpu"))
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    assert not(other[0].data_ptr() == buf.data_ptr())
+    buf_r = dnls.workspace.get_buffer("_test",(8,),th.float32,"cpu")
+    assert buf_r.data_ptr() == buf.data_ptr()
+    dnls.workspace.clear()
+    assert len(dnls.workspace.get_pool()) == 0
@@ -573,3 +573,44 @@ def test_vid_backward(ps,stride,dilation,top,btm,left,right,k):
         if error > tol: print(error)
         assert error < tol
 
+
+def test_cpu_vs_scatter(monkeypatch,ps,dilation,exact):
+
+    # -- random video, scores & inds --
+    set_seed(123)
+    t,c,h,w = 3,3,24,24
+    nq,k,pt = 50,5,1
+    vid = th.rand((t,c,h,w))
+    inds = th.stack([th.randint(0,t,(nq,k)),
+                     th.randint(-2,h+2,(nq,k)),
+                     th.randint(-2,w+2,(nq,k))],-1).int()
+    scores = softmax(th.randn((nq,k)),1)
+
+    for reflect_bounds,nbands in [(True,1),(False,1),(True,5),(False,5)]:
+
+        # -- row bands of the backward's tiles --
+        monkeypatch.setattr(dnls.cpu.wpsum,"num_bands",lambda *a: nbands)
+
+        # -- forward --
+        vid_te,vid_gt = vid.clone(),vid.clone()
+        vid_te.requires_grad_(True)
+        vid_gt.requires_grad_(True)
+        scores_te,scores_gt = scores.clone(),scores.clone()
+        scores_te.requires_grad_(True)
+        scores_gt.requires_grad_(True)
+        wpsum = dnls.wpsum.WeightedPatchSum(ps,pt,dilation=dilation,
+                                            reflect_bounds=reflect_bounds,
+                                            exact=exact)
+        wpatches_te = wpsum(vid_te,scores_te,inds).view(nq,-1)
+        scatter = dnls.scatter.ScatterNl(ps,pt,dilation=dilation,exact=exact,
+                                         reflect_bounds=reflect_bounds)
+        patches_gt = rearrange(scatter(vid_gt,inds),'n k 1 c h w -> n k (c h w)')
+        wpatches_gt = th.sum(scores_gt[...,None] * patches_gt,1)
+        assert th.abs(wpatches_te - wpatches_gt).max().item() < 1e-5
+
+        # -- backward --
+        wpatches_grad = th.rand_like(wpatches_te)
+        th.autograd.backward(wpatches_te,wpatches_grad)
+        th.autograd.backward(wpatches_gt,wpatches_grad)
+        assert th.abs(vid_te.grad - vid_gt.grad).max().item() < 1e-5
+        assert th.abs(scores_te.grad - scores_gt.grad).max().item() < 1e-4
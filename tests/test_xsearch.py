@@ -905,3 +905,230 @@ def test_batched(ps,stride,dilation,top,btm,left,right,ws,wt):
     th.cuda.empty_cache()
     th.cuda.synchronize()
 
+
+#
+# -- CPU Engine Testing --
+#
+
+def test_cpu_vs_th_fwd(ps,stride,dilation,exact):
+    """
+
+    Test the CPU code with torch code
+
+    Forward Pass
+
+    """
+
+    # -- get args --
+    dil = dilation
+    dname,ext = "davis_baseball_64x64","jpg"
+    pt,wt,ws,k = 1,0,-1,-1
+    stride0 = stride
+    stride1 = 1
+    device = "cpu"
+    reflect_bounds = False
+
+    # -- load data --
+    vid = dnls.testing.data.load_burst("./data/",dname,ext=ext)
+    vid = th.from_numpy(vid).to(device)[:1,].contiguous()
+    vid /= vid.max()
+    vidr = th.rand_like(vid)
+    flows = dnls.testing.flow.get_flow(False,True,vid,vid,0.)
+    t,color,h,w = vid.shape
+    coords = [0,0,h,w]
+
+    # -- pads --
+    oh0,ow0,hp,wp = comp_pads(vid.shape, ps, stride0, dil)
+    oh1,ow1,_,_ = comp_pads(vid.shape, ps, stride1, dil)
+    n_h = (hp - (ps-1)*dil - 1)//stride0 + 1
+    n_w = (wp - (ps-1)*dil - 1)//stride0 + 1
+    ntotal = t * n_h * n_w
+
+    # -- exec --
+    xsearch = dnls.xsearch.CrossSearchNl(flows.fflow, flows.bflow,
+                                         k, ps, pt, ws, wt, oh0, ow0, oh1, ow1,
+                                         chnls=-1,dilation=dil, stride=stride1,
+                                         reflect_bounds=reflect_bounds,use_k=False,
+                                         use_search_abs=True,use_adj=True,
+                                         exact=exact)
+    iqueries = dnls.utils.inds.get_iquery_batch(0,ntotal,stride0,
+                                                coords,t,device)
+    score_te,inds_te = xsearch(vid,iqueries,vid1=vidr)
+    score_te = rearrange(score_te,'(sh sw) (h w) -> h w sh sw',sh=n_h,h=h)
+
+    # -- reference --
+    mode = "reflect" if reflect_bounds else "zero"
+    score_gt,_ = dnls.simple.xsearch_nn.run_nn(vid,ps,stride=stride0,mode=mode,
+                                               dilation=dil,vid1=vidr)
+
+    # -- compare --
+    error = th.mean(th.abs(score_te - score_gt)).item()
+    assert error < 1e-5
+    max_error = th.abs(score_te - score_gt).max().item()
+    assert max_error < 1e-4
+
+def test_cpu_vs_th_vid_bwd(ps,stride,dilation,exact):
+    """
+
+    Test the CPU code with torch code
+
+    Backward Pass for videos
+
+    """
+
+    # -- get args --
+    dil = dilation
+    dname,ext = "davis_baseball_64x64","jpg"
+    pt,wt,ws,k = 1,0,-1,-1
+    stride0 = stride
+    stride1 = 1
+    device = "cpu"
+    reflect_bounds = False
+
+    # -- load data --
+    vid = dnls.testing.data.load_burst("./data/",dname,ext=ext)
+    vid = th.from_numpy(vid).to(device)[[4],].contiguous()/255.
+    vid = vid + 25./255. * th.randn_like(vid)
+    flows = dnls.testing.flow.get_flow(False,True,vid,vid,0.)
+    t,color,h,w = vid.shape
+    coords = [0,0,h,w]
+
+    # -- pads --
+    oh0,ow0,hp,wp = comp_pads(vid.shape, ps, stride0, dil)
+    oh1,ow1,_,_ = comp_pads(vid.shape, ps, stride1, dil)
+    n_h = (hp - (ps-1)*dil - 1)//stride0 + 1
+    n_w = (wp - (ps-1)*dil - 1)//stride0 + 1
+    ntotal = t * n_h * n_w
+
+    # -- exec --
+    xsearch = dnls.xsearch.CrossSearchNl(flows.fflow, flows.bflow, k, ps, pt,
+                                         ws, wt, oh0, ow0, oh1, ow1,
+                                         chnls=color,dilation=dil, stride=stride1,
+                                         reflect_bounds=reflect_bounds,use_k=False,
+                                         exact=exact,use_search_abs=True)
+    iqueries = dnls.utils.inds.get_iquery_batch(0,ntotal,stride0,
+                                                coords,t,device)
+
+    # -- allow grads --
+    vid_te,vidr_te = vid.clone(),vid.clone()
+    vid_gt,vidr_gt = vid.clone().double(),vid.clone().double()
+    for vid_i in [vid_te,vidr_te,vid_gt,vidr_gt]:
+        vid_i.requires_grad_(True)
+
+    # -- forward --
+    score_te,inds_te = xsearch(vid_te,iqueries,vid1=vidr_te)
+    score_te = rearrange(score_te,'(sh sw) (h w) -> h w sh sw',sh=n_h,h=h)
+    mode = "reflect" if reflect_bounds else "zero"
+    score_gt,_ = dnls.simple.xsearch_nn.run_nn(vid_gt,ps,stride=stride0,
+                                               dilation=dil,vid1=vidr_gt,
+                                               mode=mode)
+
+    # -- backward --
+    score_grad = th.rand_like(score_gt)/1000.
+    th.autograd.backward(score_gt,score_grad)
+    th.autograd.backward(score_te,score_grad.float())
+
+    # -- compare --
+    _grads_te = [vid_te.grad,vidr_te.grad]
+    _grads_gt = [vid_gt.grad,vidr_gt.grad]
+    for grads_te,grads_gt in zip(_grads_te,_grads_gt):
+        rel_error = th.abs(grads_gt - grads_te)/(th.abs(grads_gt)+1e-10)
+        assert th.max(rel_error).item() < 1e-3
+        assert th.mean(rel_error).item() < 1e-4
+
+def test_cpu_topk_vs_exh(ps,stride,dilation,k):
+    """
+
+    Test the tiled CPU top-k with the CPU exhaustive search
+
+    """
+
+    # -- get args --
+    dil = dilation
+    dname,ext = "davis_baseball_64x64","jpg"
+    pt,ws,wt = 1,9,1
+    k = 5 if k <= 0 else k
+    stride0,stride1 = stride,1
+    device = "cpu"
+
+    # -- load data --
+    vid = dnls.testing.data.load_burst("./data/",dname,ext=ext)
+    vid = th.from_numpy(vid).to(device)[:3,].contiguous()
+    vid /= vid.max()
+    t,color,h,w = vid.shape
+    coords = [0,0,h,w]
+
+    # -- random flow --
+    fflow = 2*th.randn((t,2,h,w),dtype=th.float32)
+    bflow = 2*th.randn((t,2,h,w),dtype=th.float32)
+
+    # -- query inds --
+    ntotal = t * ((h-1)//stride0+1) * ((w-1)//stride0+1)
+    iqueries = dnls.utils.inds.get_iquery_batch(0,ntotal,stride0,
+                                                coords,t,device)
+
+    # -- exhaustive --
+    xsearch = dnls.xsearch.CrossSearchNl(fflow, bflow, -1, ps, pt, ws, wt,
+                                         dilation=dil, stride=stride1,
+                                         use_k=False)
+    dists_exh,inds_exh = xsearch(vid,iqueries)
+    dists_gt = th.topk(dists_exh,k,dim=1).values
+
+    # -- top-k --
+    xsearch = dnls.xsearch.CrossSearchNl(fflow, bflow, k, ps, pt, ws, wt,
+                                         dilation=dil, stride=stride1,
+                                         use_k=True)
+    dists_te,inds_te = xsearch(vid,iqueries)
+
+    # -- compare --
+    error = th.abs(dists_te - dists_gt).max().item()
+    assert error < 1e-4
+
+    # -- inds point at their dists --
+    match = th.all(inds_exh[:,None] == inds_te[:,:,None],-1)
+    ninf = -float("inf")*th.ones_like(dists_exh[:,None])
+    dists_at = th.where(match,dists_exh[:,None],ninf).max(-1).values
+    error = th.abs(dists_te - dists_at).max().item()
+    assert error < 1e-4
+
+def test_pyramid_vs_exh(ps,k):
+    """
+
+    Test the pyramid search with the exhaustive search
+
+    """
+
+    # -- get args --
+    pt,ws,wt = 1,31,1
+    k = 5 if k <= 0 else k
+    stride0,stride1 = 4,1
+    dname,ext = "davis_baseball_64x64","jpg"
+    device = "cpu"
+
+    # -- load data --
+    vid = dnls.testing.data.load_burst("./data/",dname,ext=ext)
+    vid = th.from_numpy(vid).to(device)[:3,].contiguous()
+    vid /= vid.max()
+    t,color,h,w = vid.shape
+    coords = [0,0,h,w]
+    zflow = th.zeros((t,2,h,w),dtype=th.float32)
+
+    # -- query inds --
+    ntotal = t * ((h-1)//stride0+1) * ((w-1)//stride0+1)
+    iqueries = dnls.utils.inds.get_iquery_batch(0,ntotal,stride0,
+                                                coords,t,device)
+
+    # -- run exhaustive & pyramid search --
+    dists = {}
+    for mode,levels in [("exh",0),("pyramid",0),("pyramid",2)]:
+        xsearch = dnls.xsearch.CrossSearchNl(zflow, zflow, k, ps, pt, ws, wt,
+                                             stride=stride1, mode=mode,
+                                             levels=levels)
+        dists[levels,mode],_ = xsearch(vid,iqueries)
+
+    # -- a single level is exhaustive --
+    error = th.abs(dists[0,"pyramid"] - dists[0,"exh"]).max().item()
+    assert error < 1e-3
+
+    # -- the exhaustive search is an upper bound --
+    assert th.all(dists[2,"pyramid"] <= dists[0,"exh"] + 1e-3).item()